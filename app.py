@@ -1,20 +1,46 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 import time
 import os
 from dotenv import load_dotenv
 import pandas as pd
 from datetime import datetime
-from selenium.webdriver.common.keys import Keys
-import subprocess
-import platform
+from selenium.common.exceptions import (
+    StaleElementReferenceException, TimeoutException, NoSuchElementException, JavascriptException
+)
+from urllib.parse import quote, urlsplit
 import uuid
+import atexit
+import json
+import itertools
+import threading
+import functools
+from tracking_store import TrackingStore
+from log_writer import TrackingLogWriter
+from recipient_reader import RecipientStream, RecipientList
+from campaign_jobs import CampaignJob, JobManager, FINISHED_STATES, FAILED
+from campaign_store import CampaignStore, CampaignCheckpoint
+from contact_store import ContactStore, split_values
+from message_template import MessageTemplate
+from bot_pool import BotPool
+from driver_cache import resolve_driver, forget_driver
+from session_monitor import SessionMonitor
+from rate_limiter import AdaptiveRateLimiter
+from retry_engine import (
+    RetryingDispatch, SendFailure, TIMEOUT, INVALID_NUMBER, SESSION_LOST, UI_CHANGED
+)
+from resource_usage import process_tree_memory
+from send_transport import SendTransport, HttpTransport
+from send_metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from send_tracing import tracer
+from screenshot_store import ScreenshotStore
+from media_cache import MediaCache
+from mcp_server import MCPServer, ToolError
 
 app = Flask(__name__)
 
@@ -24,6 +50,10 @@ load_dotenv()
 # Constants for tracking files
 TRACKING_FOLDER = 'message_tracking'
 MESSAGE_LOG_FILE = os.path.join(TRACKING_FOLDER, 'message_log.xlsx')
+MESSAGE_LOG_DB = os.path.join(TRACKING_FOLDER, 'message_log.db')
+CAMPAIGN_DB = os.path.join(TRACKING_FOLDER, 'campaigns.db')
+CONTACT_DB = os.path.join(TRACKING_FOLDER, 'contacts.db')
+SCREENSHOT_DB = os.path.join(TRACKING_FOLDER, 'screenshots.db')
 
 # Constants for file storage
 UPLOAD_FOLDER = 'uploaded_images'
@@ -35,233 +65,318 @@ LOGS_FOLDER = 'logs'
 for folder in [TRACKING_FOLDER, UPLOAD_FOLDER, TEMP_FOLDER, ERROR_FOLDER, LOGS_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
-def update_tracking_log(phone, message_type, content, status, error_message=""):
+# Append-only message log; the Excel file is only written on export
+tracking_store = TrackingStore(MESSAGE_LOG_DB)
+try:
+    imported = tracking_store.import_excel_once(MESSAGE_LOG_FILE)
+    if imported:
+        print(f"Imported {imported} records from {MESSAGE_LOG_FILE} into {MESSAGE_LOG_DB}")
+except Exception as e:
+    print(f"Error importing legacy tracking log: {str(e)}")
+
+# Tracking records are written by a background thread in batches
+log_writer = TrackingLogWriter(
+    tracking_store,
+    batch_size=int(os.getenv('LOG_BATCH_SIZE', '200')),
+    flush_interval=int(os.getenv('LOG_FLUSH_MS', '250')) / 1000,
+    max_queue=int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+)
+log_writer.start()
+atexit.register(log_writer.close)
+
+# Failure screenshots: grabbed on the send thread, deduplicated, recompressed and written in the background
+# into ERROR_FOLDER, whose size is capped at SCREENSHOT_MAX_MB by deleting the oldest
+screenshot_store = ScreenshotStore(
+    ERROR_FOLDER,
+    SCREENSHOT_DB,
+    max_bytes=int(float(os.getenv('SCREENSHOT_MAX_MB', '200')) * 1024 * 1024),
+    max_queue=int(os.getenv('SCREENSHOT_QUEUE_SIZE', '32')),
+    max_width=int(os.getenv('SCREENSHOT_MAX_WIDTH', '1280')),
+    quality=int(os.getenv('SCREENSHOT_QUALITY', '60')),
+    dedupe_distance=int(os.getenv('SCREENSHOT_DEDUPE_DISTANCE', '4')),
+    image_format=os.getenv('SCREENSHOT_FORMAT', 'webp').lower()
+)
+screenshot_store.start()
+atexit.register(screenshot_store.close)
+
+# Images to send, prepared once (oriented, downsized, recompressed) and stored under their content hash
+media_cache = MediaCache(
+    UPLOAD_FOLDER,
+    max_dimension=int(os.getenv('MEDIA_MAX_DIMENSION', '1600')),
+    quality=int(os.getenv('MEDIA_QUALITY', '80')),
+    max_source_bytes=int(float(os.getenv('MEDIA_MAX_MB', '16')) * 1024 * 1024)
+)
+
+# Saved contacts with group/tag indexes; bulk uploads are merged in as they are read
+contact_store = ContactStore(CONTACT_DB)
+CONTACTS_AUTO_MERGE = os.getenv('CONTACTS_AUTO_MERGE', '1') == '1'
+
+# Send latency per stage and failures per class, served in Prometheus format at /metrics
+metrics = MetricsRegistry()
+send_stage_seconds = metrics.histogram(
+    'whatsapp_send_stage_seconds',
+    'Time spent in each stage of a send (navigation, compose or attach, click, confirm, log_write, screenshot)',
+    ['stage']
+)
+send_seconds = metrics.histogram('whatsapp_send_seconds', 'Time of a whole send, by outcome', ['status'])
+chat_opens_total = metrics.counter('whatsapp_chat_opens_total', 'Chats opened, by navigation mode', ['mode'])
+send_failures_total = metrics.counter(
+    'whatsapp_send_failures_total', 'Failed sends, by failure class and the stage that failed', ['failure', 'stage']
+)
+
+# Opt-in per-send span trees (Chrome trace format, open in chrome://tracing or Perfetto).
+# A send is traced with probability TRACE_SAMPLE_RATE, and always when it took TRACE_SLOW_SECONDS or more
+# (or failed, with TRACE_ERRORS=1); all off by default.
+TRACE_FILE = os.getenv('TRACE_FILE', os.path.join(LOGS_FOLDER, 'send_traces.json'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', '0'))
+TRACE_ERRORS = os.getenv('TRACE_ERRORS', '0') == '1'
+TRACE_MAX_MB = float(os.getenv('TRACE_MAX_MB', '20'))
+TRACE_BACKUPS = int(os.getenv('TRACE_BACKUPS', '3'))
+tracer.configure(
+    TRACE_FILE,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_seconds=TRACE_SLOW_SECONDS,
+    keep_errors=TRACE_ERRORS,
+    max_bytes=int(TRACE_MAX_MB * 1024 * 1024),
+    backups=TRACE_BACKUPS
+)
+atexit.register(tracer.close)
+
+def observe_stage(stage, started):
+    """
+    Record the time since started (a perf_counter value) for stage
+    In the stage histogram, and as a span when the send is traced. Returns the current perf_counter.
+    """
+    now = time.perf_counter()
+    send_stage_seconds.labels(stage).observe(now - started)
+    tracer.add_span(stage, started, now)
+    return now
+
+def traced(view):
+    """Trace a route's requests as root spans, with the sends they make as children"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with tracer.span(f"{request.method} {request.path}", root=True):
+            return view(*args, **kwargs)
+    return wrapper
+
+def update_tracking_log(phone, message_type, content, status, error_message="", screenshot=""):
     """
     Update the tracking log with message details
+    screenshot is the id of the failure screenshot (see /screenshots/<id>)
     """
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     # Create new data entry
     new_data = {
-        'timestamp': [timestamp],
-        'phone': [phone],
-        'type': [message_type],
-        'content': [content],
-        'status': [status],
-        'error_message': [error_message]
+        'timestamp': timestamp,
+        'phone': str(phone),
+        'type': message_type,
+        'content': content,
+        'status': status,
+        'error_message': error_message,
+        'screenshot': screenshot or ''
     }
     
     try:
-        # Try to read existing log
-        if os.path.exists(MESSAGE_LOG_FILE):
-            df = pd.read_excel(MESSAGE_LOG_FILE)
-            new_df = pd.DataFrame(new_data)
-            df = pd.concat([df, new_df], ignore_index=True)
-        else:
-            df = pd.DataFrame(new_data)
-        
-        # Save to Excel file
-        df.to_excel(MESSAGE_LOG_FILE, index=False)
+        log_writer.write(new_data)
         return True
     except Exception as e:
         print(f"Error updating tracking log: {str(e)}")
         return False
 
-def read_phone_numbers(file_path, group=None):
+def read_phone_numbers(file_path=None, group=None):
     """
-    Read phone numbers from CSV/Excel file
-    If group is specified, only return numbers from that group
+    Read phone numbers from the contact store
+    A CSV/Excel file_path is merged into the store first. If group is
+    specified, only return numbers from that group (an index lookup)
     """
     try:
-        # Determine file type from extension
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file_path.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
-        else:
-            raise ValueError("Unsupported file format. Use CSV or Excel.")
-
-        # Filter by group if specified
-        if group and 'group' in df.columns:
-            df = df[df['group'] == group]
-
-        # Return list of phone numbers
-        return df['phone_number'].tolist()
+        if file_path:
+            contact_store.import_file(file_path)
+        return contact_store.phones(groups=[group] if group else None)
     except Exception as e:
         print(f"Error reading phone numbers: {str(e)}")
         return None
 
-# def send_to_clipboard(image_path):
-#     """Helper function to copy image to clipboard"""
-#     try:
-#         print(f"Opening image from: {image_path}")
-#         image = Image.open(image_path)
-#         output = BytesIO()
-#         image.convert('RGB').save(output, 'BMP')
-#         data = output.getvalue()[14:]  # Remove header
-#         output.close()
-        
-#         print("Opening clipboard...")
-#         win32clipboard.OpenClipboard()
-#         win32clipboard.EmptyClipboard()
-#         win32clipboard.SetClipboardData(win32clipboard.CF_DIB, data)
-#         win32clipboard.CloseClipboard()
-#         print("Image successfully copied to clipboard")
-#         return True
-#     except Exception as e:
-#         print(f"Error in send_to_clipboard: {str(e)}")
-#         try:
-#             win32clipboard.CloseClipboard()
-#         except:
-#             pass
-#         return False
-
-# def save_uploaded_image(file):
-#     """Save uploaded image with a unique filename"""
-#     try:
-#         if not file:
-#             print("No file provided")
-#             return None
-            
-#         # Generate unique filename
-#         original_filename = file.filename
-#         if not original_filename:
-#             print("No filename provided")
-#             return None
-            
-#         file_ext = os.path.splitext(original_filename)[1].lower()
-#         if not file_ext:
-#             print("No file extension found")
-#             return None
-            
-#         # Check if extension is allowed
-#         allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif'}
-#         if file_ext not in allowed_extensions:
-#             print(f"Invalid file extension: {file_ext}")
-#             return None
-            
-#         # Create unique filename
-#         unique_filename = f"{uuid.uuid4()}{file_ext}"
-        
-#         # Ensure upload folder exists
-#         if not os.path.exists(UPLOAD_FOLDER):
-#             os.makedirs(UPLOAD_FOLDER)
-#             print(f"Created upload folder: {UPLOAD_FOLDER}")
-        
-#         # Save in upload folder with absolute path
-#         save_path = os.path.abspath(os.path.join(UPLOAD_FOLDER, unique_filename))
-#         print(f"Attempting to save file to: {save_path}")
-        
-#         # Save the file
-#         file.save(save_path)
-        
-#         # Verify file was saved
-#         if os.path.exists(save_path):
-#             print(f"Successfully saved image as: {save_path}")
-#             return save_path
-#         else:
-#             print("File was not saved successfully")
-#             return None
-            
-#     except Exception as e:
-#         print(f"Error saving image: {str(e)}")
-#         return None
+# Fast send mode: open each chat inside the loaded WhatsApp Web app
+FAST_SEND = os.getenv('FAST_SEND', '1') == '1'
+FAST_SEND_TIMEOUT = float(os.getenv('FAST_SEND_TIMEOUT', '5'))
 
-class WhatsAppBot:
-    def __init__(self):
-        print("Initializing WhatsApp Bot...")
-        self.driver = None
+# Clicks a temporary wa.me link so WhatsApp Web routes to the chat without a page load
+OPEN_CHAT_SCRIPT = """
+const link = document.createElement('a');
+link.href = arguments[0];
+link.style.display = 'none';
+document.querySelector('#app').appendChild(link);
+link.click();
+link.remove();
+"""
+
+# Send stages: composer populated with the send button enabled, then the
+# outgoing bubble showing a clock (pending) or tick (sent)
+COMPOSE_TIMEOUT = float(os.getenv('COMPOSE_TIMEOUT', '30'))
+CONFIRM_TIMEOUT = float(os.getenv('CONFIRM_TIMEOUT', '15'))
+ACK_STATES = {
+    'msg-time': 'pending',
+    'msg-check': 'sent',
+    'msg-dblcheck': 'delivered'
+}
+
+# Returns [data-id, status icon] of the newest outgoing message bubble in the open chat
+LAST_OUTGOING_SCRIPT = """
+const bubbles = document.querySelectorAll('#main div.message-out');
+const last = bubbles[bubbles.length - 1];
+if (!last) { return [null, null]; }
+const row = last.closest('[data-id]') || last.querySelector('[data-id]');
+const icon = last.querySelector('span[data-icon^="msg-"]');
+return [row ? row.getAttribute('data-id') : null, icon ? icon.getAttribute('data-icon') : null];
+"""
+
+# Lean mode: smaller, headless (once linked) browsers that skip images and media
+LEAN_MODE = os.getenv('LEAN_MODE', '0') == '1'
+LEAN_WINDOW_SIZE = os.getenv('LEAN_WINDOW_SIZE', '1024,768')
+LEAN_RENDERER_LIMIT = int(os.getenv('LEAN_RENDERER_LIMIT', '2'))
+LEAN_BLOCKED_URLS = [
+    '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.mp4', '*.ogg', '*.mp3',
+    '*.woff', '*.woff2', '*.ttf',
+    'https://pps.whatsapp.net/*',      # profile pictures
+    'https://media*.whatsapp.net/*'    # message media
+]
+# Written to a profile directory once it has been linked by scanning the QR code
+LOGIN_MARKER = '.whatsapp_linked'
+
+# Session health probe: one round trip telling a logged-in app from a QR code or a page still loading
+SESSION_CHECK_INTERVAL = int(os.getenv('SESSION_CHECK_INTERVAL', '30'))
+SESSION_STATE_SCRIPT = """
+if (location.origin !== arguments[0]) { return 'loading'; }
+if (document.querySelector('#side')) { return 'ready'; }
+if (document.querySelector('div[data-testid="qrcode"], canvas[aria-label*="QR"]')) { return 'qr'; }
+return 'loading';
+"""
+
+# True when WhatsApp Web shows its "phone number shared via url is invalid" popup
+INVALID_NUMBER_SCRIPT = """
+const popup = document.querySelector('div[data-animate-modal-popup="true"], div[role="dialog"]');
+return !!popup && /invalid|not on WhatsApp/i.test(popup.innerText);
+"""
+
+# Image sends: the file goes into WhatsApp's hidden file input (opened from the attach button when
+# it is not in the page yet), then the caption is typed into the preview before sending
+ATTACH_BUTTON_SELECTORS = ['span[data-icon="clip"]', 'span[data-icon="plus"]', 'span[data-icon="attach-menu-plus"]']
+IMAGE_INPUT_SELECTOR = 'input[type="file"][accept*="image"]'
+CAPTION_SELECTORS = ['div[data-testid="media-caption-input"]', 'div[contenteditable="true"][data-tab="6"]']
+INSERT_TEXT_SCRIPT = """
+arguments[0].focus();
+document.execCommand('insertText', false, arguments[1]);
+"""
+
+def media_preview_ready(driver):
+    """Wait condition: the image preview is open; returns its caption box"""
+    for selector in CAPTION_SELECTORS:
+        boxes = [box for box in driver.find_elements(By.CSS_SELECTOR, selector) if box.is_displayed()]
+        if boxes:
+            return boxes[-1]
+    return False
+
+def composer_ready(driver):
+    """Wait condition: the composer has text and the send button is enabled; returns the button"""
+    if driver.execute_script(INVALID_NUMBER_SCRIPT):
+        raise SendFailure(INVALID_NUMBER, "Phone number is not on WhatsApp")
+    composers = driver.find_elements(By.CSS_SELECTOR, 'div[title="Type a message"]')
+    if not composers or not composers[0].text.strip():
+        return False
+    buttons = driver.find_elements(By.XPATH, '//span[@data-icon="send"]')
+    if buttons and buttons[0].is_displayed() and buttons[0].is_enabled():
+        return buttons[0]
+    return False
+
+def outgoing_ack(driver, previous_bubble):
+    """Wait condition: a new outgoing bubble shows a status icon; returns the icon name"""
+    bubble, icon = driver.execute_script(LAST_OUTGOING_SCRIPT)
+    if bubble and bubble != previous_bubble and icon in ACK_STATES:
+        return icon
+    return False
+
+# Where WhatsApp Web is loaded from; point it at a fake_whatsapp.py server to load-test offline.
+# SEND_TRANSPORT=http talks to that server's API directly, without Chrome.
+WHATSAPP_WEB_URL = os.getenv('WHATSAPP_WEB_URL', 'https://web.whatsapp.com')
+SEND_TRANSPORT = os.getenv('SEND_TRANSPORT', 'selenium')
+
+def phone_digits(phone):
+    """Phone number as digits only (no '+' or separators)"""
+    return ''.join(ch for ch in str(phone) if ch.isdigit())
+
+class SeleniumTransport(SendTransport):
+    """Sends through Chrome driven by Selenium, on WhatsApp Web or a page with its selectors (WHATSAPP_WEB_URL)"""
+
+    name = 'selenium'
+
+    def __init__(self, profile_dir, base_url=WHATSAPP_WEB_URL):
+        super().__init__()
+        self.profile_dir = profile_dir
+        self.base_url = base_url.rstrip('/')
+        parts = urlsplit(self.base_url)
+        self.origin = f"{parts.scheme}://{parts.netloc}"
         self.wait = None
+        # Switch chats inside the loaded app instead of reloading it per message
+        self.fast_send = FAST_SEND
+        self.fast_send_timeout = FAST_SEND_TIMEOUT
+        self.lean = LEAN_MODE
+        # Found by compose() or attach(), clicked by click()
+        self._send_button = None
+        self._previous_bubble = None
 
-    def setup_driver(self):
+    def start(self):
         try:
             print("\n1. Setting up Chrome options...")
             chrome_options = Options()
             chrome_options.add_argument('--no-sandbox')
             chrome_options.add_argument('--disable-dev-shm-usage')
             chrome_options.add_argument('--disable-gpu')
-            chrome_options.add_argument('--start-maximized')
             chrome_options.add_argument('--disable-notifications')
             chrome_options.add_argument('--disable-popup-blocking')
             
             # Create profile directory if it doesn't exist
-            profile_dir = os.path.join(os.getcwd(), 'chrome_profile')
-            os.makedirs(profile_dir, exist_ok=True)
-            chrome_options.add_argument(f'--user-data-dir={profile_dir}')
+            os.makedirs(self.profile_dir, exist_ok=True)
+            chrome_options.add_argument(f'--user-data-dir={self.profile_dir}')
+            
+            # Lean mode runs headless once the profile has been linked to WhatsApp
+            headless = self.lean and os.path.exists(os.path.join(self.profile_dir, LOGIN_MARKER))
+            if self.lean:
+                self._add_lean_options(chrome_options, headless)
+            else:
+                chrome_options.add_argument('--start-maximized')
             
             print("2. Setting up Chrome driver...")
-            try:
-                # Check Chrome installation and version
-                chrome_paths = [
-                    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
-                    r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe"
-                ]
-                
-                chrome_path = None
-                for path in chrome_paths:
-                    if os.path.exists(path):
-                        chrome_path = path
-                        break
-                
-                if not chrome_path:
-                    raise Exception("Chrome not found. Please install Google Chrome first.")
-                
-                # Get Chrome version
-                version_cmd = f'wmic datafile where name="{chrome_path.replace("\\", "\\\\")}" get Version /value'
-                version_output = subprocess.check_output(version_cmd, shell=True).decode()
-                chrome_version = version_output.strip().split("=")[1].split(".")[0]
-                print(f"Detected Chrome version: {chrome_version}")
-                
-                # Check if running in 64-bit Python
-                is_64bits = platform.architecture()[0] == '64bit'
-                
-                # Configure ChromeDriverManager
-                from webdriver_manager.chrome import ChromeDriverManager
-                driver_path = ChromeDriverManager(version=f"chrome_{chrome_version}").install()
-                
-                # Create service with specific binary location
-                service = Service(
-                    executable_path=driver_path,
-                    log_path=os.path.join("logs", "chromedriver.log")
-                )
-                
-            except Exception as e:
-                print(f"Error setting up ChromeDriver: {str(e)}")
-                print("Attempting to use local ChromeDriver...")
-                
-                # Try both chromedriver.exe and chromedriver-win64
-                driver_paths = [
-                    os.path.join(os.getcwd(), "chromedriver.exe"),
-                    os.path.join(os.getcwd(), "chromedriver-win64", "chromedriver.exe")
-                ]
-                
-                driver_found = False
-                for path in driver_paths:
-                    if os.path.exists(path):
-                        print(f"Found local ChromeDriver at: {path}")
-                        service = Service(
-                            executable_path=path,
-                            log_path=os.path.join("logs", "chromedriver.log")
-                        )
-                        driver_found = True
-                        break
-                
-                if not driver_found:
-                    raise Exception("ChromeDriver not found. Please download the correct version for your Chrome.")
+            # Cached per Chrome binary and version, so repeat starts skip probing and downloads
+            chrome_binary, driver_path, driver_info = resolve_driver()
+            print(f"Using Chrome {driver_info['chrome_version'] or '(unknown version)'} at {chrome_binary}")
+            print(f"Using ChromeDriver from {driver_info['source']}: {driver_path} ({driver_info['seconds']}s)")
+            chrome_options.binary_location = chrome_binary
+            
+            service_args = {"log_output": os.path.join(LOGS_FOLDER, "chromedriver.log")}
+            if driver_path:
+                service_args["executable_path"] = driver_path
+            service = Service(**service_args)
             
             print("3. Starting Chrome browser...")
             try:
                 self.driver = webdriver.Chrome(service=service, options=chrome_options)
                 self.wait = WebDriverWait(self.driver, 30)
+                if self.lean:
+                    self._apply_lean_network(headless)
             except Exception as e:
                 print(f"Error starting Chrome: {str(e)}")
+                forget_driver(chrome_binary)
                 print("This might be due to ChromeDriver version mismatch.")
                 print("Please download ChromeDriver that matches your Chrome version from:")
                 print("https://chromedriver.chromium.org/downloads")
                 raise
             
             print("4. Opening WhatsApp Web...")
-            self.driver.get("https://web.whatsapp.com")
+            self.driver.get(self.base_url)
             
             # Wait for WhatsApp Web to load
             print("Waiting for WhatsApp Web to load...")
@@ -275,7 +390,14 @@ class WhatsAppBot:
                 # Check which state we're in
                 if self.driver.find_elements(By.CSS_SELECTOR, 'div[title="Type a message"]'):
                     print("Already logged in!")
+                    self._mark_linked()
                     return True
+                elif headless:
+                    # A QR code cannot be scanned without a window
+                    print("Session is logged out; reopening Chrome with a window to scan the QR code")
+                    os.remove(os.path.join(self.profile_dir, LOGIN_MARKER))
+                    self.close()
+                    return self.start()
                 else:
                     print("Please scan the QR code with your WhatsApp mobile app")
                     # Wait for successful login after QR scan
@@ -283,219 +405,543 @@ class WhatsAppBot:
                         EC.presence_of_element_located((By.CSS_SELECTOR, 'div[title="Type a message"]'))
                     )
                     print("Successfully logged in!")
+                    self._mark_linked()
                     return True
                     
             except Exception as e:
                 print(f"Error waiting for WhatsApp Web: {str(e)}")
                 if self.driver:
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    self.driver.save_screenshot(os.path.join("error_images", f"init_error_{timestamp}.png"))
+                    screenshot_store.capture(self.capture_screenshot, kind='init', reason=str(e))
                 return False
             
         except Exception as e:
             print(f"Error in setup_driver: {str(e)}")
             if hasattr(self, 'driver') and self.driver:
+                screenshot_store.capture(self.capture_screenshot, kind='setup', reason=str(e))
+                self.driver.quit()
+            return False
+
+    def _add_lean_options(self, chrome_options, headless):
+        """Chrome switches and preferences of lean mode"""
+        if headless:
+            chrome_options.add_argument('--headless=new')
+        chrome_options.add_argument(f'--window-size={LEAN_WINDOW_SIZE}')
+        chrome_options.add_argument(f'--renderer-process-limit={LEAN_RENDERER_LIMIT}')
+        chrome_options.add_argument('--disable-extensions')
+        chrome_options.add_argument('--disable-background-networking')
+        chrome_options.add_argument('--disable-component-update')
+        chrome_options.add_argument('--disable-default-apps')
+        chrome_options.add_argument('--disable-sync')
+        chrome_options.add_argument('--mute-audio')
+        chrome_options.add_argument('--no-first-run')
+        chrome_options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.default_content_setting_values.media_stream': 2
+        })
+
+    def _apply_lean_network(self, headless):
+        """Block media downloads; in headless mode also hide "HeadlessChrome" from WhatsApp Web"""
+        self.driver.execute_cdp_cmd('Network.enable', {})
+        self.driver.execute_cdp_cmd('Network.setBlockedURLs', {"urls": LEAN_BLOCKED_URLS})
+        if headless:
+            user_agent = self.driver.execute_script("return navigator.userAgent")
+            self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {
+                "userAgent": user_agent.replace('HeadlessChrome', 'Chrome')
+            })
+
+    def _mark_linked(self):
+        # Later lean starts of this profile can go headless
+        with open(os.path.join(self.profile_dir, LOGIN_MARKER), 'w') as f:
+            f.write(datetime.now().isoformat())
+
+    def memory_stats(self):
+        """Resident memory of this session's chromedriver and Chrome processes"""
+        try:
+            return process_tree_memory(self.driver.service.process.pid)
+        except Exception:
+            return None
+
+    def open_chat(self, phone, message):
+        """
+        Open the chat with phone, message pre-filled in the composer
+        In fast send mode the already loaded app switches chats in-page; a full
+        page load of the /send URL is only used when that does not work.
+        Returns the navigation mode used ("in_app" or "full_load").
+        """
+        mode = 'full_load'
+        with tracer.span('probe app_loaded'):
+            in_app = self.fast_send and self.app_loaded()
+        if in_app:
+            try:
+                if self._open_chat_in_app(phone, message):
+                    mode = 'in_app'
+            except Exception as e:
+                print(f"In-app chat switch failed for {phone}: {str(e)}")
+        
+        if mode == 'full_load':
+            url = f"{self.base_url}/send?phone={quote(phone_digits(phone))}&text={quote(message)}"
+            with tracer.span('driver.get'):
+                self.driver.get(url)
+        return mode
+
+    def app_loaded(self):
+        """True when WhatsApp Web is loaded and logged in in the current tab"""
+        try:
+            return (self.driver.current_url.startswith(self.base_url) and
+                    bool(self.driver.find_elements(By.CSS_SELECTOR, '#side')))
+        except Exception:
+            return False
+
+    def _open_chat_in_app(self, phone, message):
+        # The current composer goes stale once WhatsApp renders another chat
+        old_composers = self.driver.find_elements(By.CSS_SELECTOR, 'div[title="Type a message"]')
+        
+        # WhatsApp Web handles clicks on wa.me links itself and opens the chat in-page
+        link = f"https://wa.me/{phone_digits(phone)}?text={quote(message)}"
+        with tracer.span('script open_chat'):
+            self.driver.execute_script(OPEN_CHAT_SCRIPT, link)
+        
+        def chat_switched(driver):
+            if old_composers:
                 try:
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    self.driver.save_screenshot(os.path.join("error_images", f"setup_error_{timestamp}.png"))
-                except:
+                    old_composers[0].is_enabled()
+                    return False
+                except StaleElementReferenceException:
                     pass
-                self.driver.quit()
+            composers = driver.find_elements(By.CSS_SELECTOR, 'div[title="Type a message"]')
+            # An empty composer (image sends) shows the microphone instead of the send button
+            return bool(composers) and (not message or bool(driver.find_elements(By.XPATH, '//span[@data-icon="send"]')))
+        
+        try:
+            with tracer.span('wait chat_switched', timeout=self.fast_send_timeout):
+                WebDriverWait(self.driver, self.fast_send_timeout).until(chat_switched)
+            return True
+        except TimeoutException:
             return False
 
-    def send_message(self, phone, message):
+    def compose(self, timeout):
+        # Wait until the composer holds the message and the send button is enabled
+        with tracer.span('wait composer_ready', timeout=timeout):
+            self._send_button = WebDriverWait(self.driver, timeout).until(composer_ready)
+        with tracer.span('script last_outgoing'):
+            self._previous_bubble = self.driver.execute_script(LAST_OUTGOING_SCRIPT)[0]
+
+    def attach(self, path, caption, timeout):
+        with tracer.span('script last_outgoing'):
+            self._previous_bubble = self.driver.execute_script(LAST_OUTGOING_SCRIPT)[0]
+
+        def chat_open(driver):
+            if driver.execute_script(INVALID_NUMBER_SCRIPT):
+                raise SendFailure(INVALID_NUMBER, "Phone number is not on WhatsApp")
+            return bool(driver.find_elements(By.CSS_SELECTOR, 'div[title="Type a message"]'))
+
+        with tracer.span('wait chat_open', timeout=timeout):
+            WebDriverWait(self.driver, timeout).until(chat_open)
+
+        inputs = self.driver.find_elements(By.CSS_SELECTOR, IMAGE_INPUT_SELECTOR)
+        if not inputs:
+            buttons = [button for selector in ATTACH_BUTTON_SELECTORS
+                       for button in self.driver.find_elements(By.CSS_SELECTOR, selector)]
+            if not buttons:
+                raise SendFailure(UI_CHANGED, "Attach button not found")
+            buttons[0].click()
+            with tracer.span('wait image_input', timeout=timeout):
+                inputs = WebDriverWait(self.driver, timeout).until(
+                    lambda driver: driver.find_elements(By.CSS_SELECTOR, IMAGE_INPUT_SELECTOR)
+                )
+        # The file is read by Chrome straight from disk, no clipboard involved
+        inputs[0].send_keys(os.path.abspath(path))
+
+        with tracer.span('wait media_preview', timeout=timeout):
+            caption_box = WebDriverWait(self.driver, timeout).until(media_preview_ready)
+        if caption:
+            with tracer.span('script caption'):
+                self.driver.execute_script(INSERT_TEXT_SCRIPT, caption_box, caption)
+        buttons = [button for button in self.driver.find_elements(By.XPATH, '//span[@data-icon="send"]')
+                   if button.is_displayed()]
+        if not buttons:
+            raise SendFailure(UI_CHANGED, "Send button not found in the image preview")
+        # The preview's send button is rendered above the (hidden) chat one
+        self._send_button = buttons[-1]
+
+    def click(self):
+        send_button, self._send_button = self._send_button, None
+        send_button.click()
+
+    def confirm(self, timeout):
+        # Wait for the new outgoing bubble to show a clock or tick
+        with tracer.span('wait outgoing_ack', timeout=timeout):
+            ack = WebDriverWait(self.driver, timeout).until(
+                lambda driver: outgoing_ack(driver, self._previous_bubble)
+            )
+        return ACK_STATES[ack]
+
+    def classify_failure(self, error, stage):
+        if isinstance(error, SendFailure):
+            return error.kind
+        if self.session_state() in ('dead', 'qr'):
+            return SESSION_LOST
+        if isinstance(error, (NoSuchElementException, JavascriptException)):
+            return UI_CHANGED
+        if isinstance(error, TimeoutException) and stage in ('compose', 'attach'):
+            # The chat opened but the composer was never found: the page layout changed
+            if (self.driver.find_elements(By.CSS_SELECTOR, '#main footer') and
+                    not self.driver.find_elements(By.CSS_SELECTOR, 'div[title="Type a message"]')):
+                return UI_CHANGED
+        # Anything else is taken as a transient hiccup
+        return TIMEOUT
+
+    def session_state(self):
+        """Cheap health probe: 'ready', 'qr' (logged out), 'loading' or 'dead'"""
+        if not self.driver:
+            return 'dead'
+        try:
+            return self.driver.execute_script(SESSION_STATE_SCRIPT, self.origin)
+        except Exception:
+            return 'dead'
+
+    def capture_screenshot(self):
+        # Only the grab happens here; decoding and writing are left to the ScreenshotStore thread
+        return self.driver.get_screenshot_as_png() if self.driver else None
+
+    def close(self):
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print(f"Error closing browser: {str(e)}")
+            self.driver = None
+
+class WhatsAppBot:
+    def __init__(self, profile_dir=None, transport=None):
+        print("Initializing WhatsApp Bot...")
+        self.profile_dir = profile_dir or os.path.join(os.getcwd(), 'chrome_profile')
+        self.transport = transport or SeleniumTransport(self.profile_dir)
+        # One browser can only drive one chat at a time
+        self.lock = threading.RLock()
+        self.last_navigation = None
+        self.navigation_totals = {}
+        # Per-stage timeouts of a send and the measured confirmation of the last one
+        self.compose_timeout = COMPOSE_TIMEOUT
+        self.confirm_timeout = CONFIRM_TIMEOUT
+        self.last_confirmation = None
+        self.last_failure = None
+
+    @property
+    def driver(self):
+        """The transport's browser or connection; None while the session is not started"""
+        return self.transport.driver
+
+    def setup_driver(self):
+        return self.transport.start()
+
+    def send_message(self, phone, message, media=None):
+        """Send message to phone; with media (a MediaCache entry) the image is sent with message as its caption"""
+        with tracer.span('send_message', root=True, phone=str(phone), transport=self.transport.name):
+            waiting = time.perf_counter()
+            with self.lock:
+                tracer.add_span('session_lock', waiting, time.perf_counter())
+                self.last_navigation = None
+                self.last_confirmation = None
+                self.last_failure = None
+                return self._send_message(phone, message, media)
+
+    def _send_message(self, phone, message, media=None):
+        stage = 'navigation'
+        started = time.perf_counter()
+        if media:
+            message_type, content = "image", f"Image: {media['name']}" + (f" - {message}" if message else "")
+        else:
+            message_type, content = "text", message
         try:
-            # Format the URL with the phone number and message
-            url = f"https://web.whatsapp.com/send?phone={phone}&text={message}"
-            self.driver.get(url)
+            # Open the chat with the message pre-filled (an image's caption goes into its preview instead)
+            self.open_chat(phone, '' if media else message)
+            
+            # Wait until the message can be sent
+            stage = 'attach' if media else 'compose'
+            mark = time.perf_counter()
+            if media:
+                self.transport.attach(media["path"], message, self.compose_timeout)
+            else:
+                self.transport.compose(self.compose_timeout)
+            mark = observe_stage(stage, mark)
             
-            # Wait for the send button to be clickable
-            send_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, '//span[@data-icon="send"]')))
-            time.sleep(2)  # Small delay to ensure message is ready
-            send_button.click()
-            time.sleep(2)  # Wait for message to be sent
+            # Send and wait for the first acknowledgement
+            stage = 'click'
+            self.transport.click()
+            clicked_at = observe_stage('click', mark)
+            stage = 'confirm'
+            ack = self.transport.confirm(self.confirm_timeout)
+            mark = observe_stage('confirm', clicked_at)
+            self.last_confirmation = {
+                "ack": ack,
+                "seconds": mark - clicked_at
+            }
             
             # Update tracking log
-            update_tracking_log(phone, "text", message, "success")
+            update_tracking_log(phone, message_type, content, "success")
+            send_seconds.labels('success').observe(observe_stage('log_write', mark) - started)
+            tracer.annotate(status="success", ack=ack)
             return True
             
         except Exception as e:
-            print(f"Error sending message: {str(e)}")
-            if self.driver:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                self.driver.save_screenshot(os.path.join("error_images", f"message_error_{timestamp}.png"))
+            with tracer.span('classify_failure'):
+                failure = self.classify_failure(e, stage)
+            self.last_failure = {"failure": failure, "stage": stage, "error": str(e)}
+            send_failures_total.labels(failure, stage).inc()
+            tracer.annotate(status="failed", **self.last_failure)
+            print(f"Error sending message ({stage} stage, {failure}): {str(e)}")
+            screenshot = None
+            if failure != SESSION_LOST:
+                mark = time.perf_counter()
+                screenshot = screenshot_store.capture(
+                    self.transport.capture_screenshot, kind='message', phone=str(phone), reason=failure
+                )
+                observe_stage('screenshot', mark)
+                self.last_failure["screenshot"] = screenshot
+            mark = time.perf_counter()
+            update_tracking_log(phone, message_type, content, "failed", f"{failure}: {str(e)}", screenshot)
+            send_seconds.labels('failed').observe(observe_stage('log_write', mark) - started)
             return False
 
-    # def send_image(self, phone, image_path, caption=None):
-    #     """Send an image to a WhatsApp contact with optional caption"""
-    #     try:
-    #         print(f"\nAttempting to send image to {phone}")
-            
-    #         # Open chat with the phone number
-    #         url = f"https://web.whatsapp.com/send?phone={phone}"
-    #         print(f"Opening URL: {url}")
-    #         self.driver.get(url)
-            
-    #         # Wait for chat to load
-    #         print("Waiting for chat to load...")
-    #         time.sleep(5)  # Ensure chat is fully loaded
-            
-    #         # Search for the chat (in case direct URL doesn't work)
-    #         try:
-    #             search_box = self.wait.until(
-    #                 EC.presence_of_element_located((By.XPATH, "//div[@contenteditable='true'][@data-tab='3']"))
-    #             )
-    #             search_box.click()
-    #             search_box.send_keys(phone)
-    #             time.sleep(2)
-    #             search_box.send_keys(Keys.ENTER)
-    #         except Exception as e:
-    #             print(f"Error searching for chat: {str(e)}")
-            
-    #         # Wait for chat to be ready
-    #         self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'div[title="Type a message"]')))
-    #         time.sleep(2)
-            
-    #         # Attach file
-    #         try:
-    #             # Try multiple attachment button selectors
-    #             attachment_selectors = [
-    #                 "//span[@data-icon='clip']",
-    #                 "//span[@data-testid='attach-menu']",
-    #                 "//span[@data-testid='attach-menu-plus']"
-    #             ]
-                
-    #             attachment_btn = None
-    #             for selector in attachment_selectors:
-    #                 try:
-    #                     attachment_btn = self.wait.until(
-    #                         EC.element_to_be_clickable((By.XPATH, selector))
-    #                     )
-    #                     print(f"Found attachment button with selector: {selector}")
-    #                     break
-    #                 except:
-    #                     continue
-                
-    #             if not attachment_btn:
-    #                 raise Exception("Could not find attachment button")
-                
-    #             attachment_btn.click()
-    #             time.sleep(1)
-    #         except Exception as e:
-    #             print(f"Error clicking attachment button: {str(e)}")
-    #             raise
-            
-    #         # Input image
-    #         try:
-    #             image_input = self.wait.until(
-    #                 EC.presence_of_element_located((By.XPATH, "//input[@accept='image/*,video/mp4,video/3gpp,video/quicktime']"))
-    #             )
-    #             abs_image_path = os.path.abspath(image_path)
-    #             print(f"Uploading image from: {abs_image_path}")
-    #             image_input.send_keys(abs_image_path)
-    #         except Exception as e:
-    #             print(f"Error uploading image: {str(e)}")
-    #             raise
-            
-    #         # Wait for image preview
-    #         time.sleep(3)
-            
-    #         # Add caption if provided
-    #         if caption:
-    #             try:
-    #                 # Try multiple caption box selectors
-    #                 caption_selectors = [
-    #                     "//div[@contenteditable='true'][@data-tab='6']",
-    #                     "//div[@contenteditable='true'][contains(@data-testid, 'media-caption-input')]"
-    #                 ]
-                    
-    #                 caption_box = None
-    #                 for selector in caption_selectors:
-    #                     try:
-    #                         caption_box = self.wait.until(
-    #                             EC.presence_of_element_located((By.XPATH, selector))
-    #                         )
-    #                         print(f"Found caption box with selector: {selector}")
-    #                         break
-    #                     except:
-    #                         continue
-                    
-    #                 if caption_box:
-    #                     caption_box.clear()
-    #                     caption_box.send_keys(caption)
-    #                     time.sleep(1)
-    #             except Exception as e:
-    #                 print(f"Error adding caption: {str(e)}")
-            
-    #         # Send image
-    #         try:
-    #             # Try multiple send button selectors
-    #             send_selectors = [
-    #                 "//span[@data-icon='send']",
-    #                 "//span[@data-testid='send']"
-    #             ]
-                
-    #             send_button = None
-    #             for selector in send_selectors:
-    #                 try:
-    #                     send_button = self.wait.until(
-    #                         EC.element_to_be_clickable((By.XPATH, selector))
-    #                     )
-    #                     print(f"Found send button with selector: {selector}")
-    #                     break
-    #                 except:
-    #                     continue
-                
-    #             if not send_button:
-    #                 raise Exception("Could not find send button")
-                
-    #             send_button.click()
-    #         except Exception as e:
-    #             print(f"Error sending image: {str(e)}")
-    #             raise
-            
-    #         # Wait for message to be sent
-    #         time.sleep(3)
-            
-    #         print("Image sent successfully!")
-    #         update_tracking_log(phone, "image", f"Image: {os.path.basename(image_path)}", "success")
-    #         return True
-            
-    #     except Exception as e:
-    #         print(f"Error sending image: {str(e)}")
-    #         if self.driver:
-    #             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    #             error_screenshot = os.path.join("error_images", f"image_error_{timestamp}.png")
-    #             self.driver.save_screenshot(error_screenshot)
-    #             print(f"Error screenshot saved to: {error_screenshot}")
-    #         update_tracking_log(phone, "image", f"Image: {os.path.basename(image_path)}", "failed", str(e))
-    #         return False
+    def classify_failure(self, error, stage):
+        """Failure class of a send that raised error during stage (see retry_engine)"""
+        return self.transport.classify_failure(error, stage)
+
+    def open_chat(self, phone, message):
+        """Open the chat with phone through the transport, timing it per navigation mode"""
+        start = time.perf_counter()
+        mode = self.transport.open_chat(phone, message)
+        elapsed = observe_stage('navigation', start) - start
+        chat_opens_total.labels(mode).inc()
+        self.last_navigation = {"mode": mode, "seconds": elapsed}
+        stats = self.navigation_totals.setdefault(mode, {"count": 0, "seconds": 0.0})
+        stats["count"] += 1
+        stats["seconds"] += elapsed
+        return mode
+
+    def navigation_stats(self):
+        """Count and mean latency of chat opens per navigation mode"""
+        return {
+            mode: {
+                "count": stats["count"],
+                "avg_seconds": round(stats["seconds"] / stats["count"], 3) if stats["count"] else None
+            }
+            for mode, stats in self.navigation_totals.items()
+        }
+
+    def session_state(self):
+        """Cheap health probe: 'ready', 'qr' (logged out), 'loading' or 'dead'"""
+        return self.transport.session_state()
+
+    def restart(self):
+        """Quit the browser and start it again on the same profile, keeping the WhatsApp login"""
+        with self.lock:
+            self.close()
+            return self.setup_driver()
 
     def close(self):
-        if self.driver:
-            self.driver.quit()
+        self.transport.close()
+
+    def memory_stats(self):
+        """Resident memory of this session's browser processes, if the transport has any"""
+        return self.transport.memory_stats()
+
+    def send_image(self, phone, media, caption=''):
+        """Send a prepared image (a MediaCache entry) with an optional caption"""
+        return self.send_message(phone, caption, media)
+
+    def send_message_result(self, phone, message, media=None):
+        """Send a message (or image, with message as its caption) and return the per-recipient result dict"""
+        try:
+            success = self.send_message(phone, message, media)
+            result = {
+                "phone": phone,
+                "status": "success" if success else "failed"
+            }
+            if media:
+                result["type"] = "image"
+            if self.last_navigation:
+                result["navigation"] = self.last_navigation["mode"]
+                result["navigation_ms"] = round(self.last_navigation["seconds"] * 1000, 1)
+            if self.last_confirmation:
+                result["ack"] = self.last_confirmation["ack"]
+                result["confirmation_ms"] = round(self.last_confirmation["seconds"] * 1000, 1)
+            if not success and self.last_failure:
+                result.update(self.last_failure)
+            return result
+        except Exception as e:
+            return {
+                "phone": phone,
+                "status": "failed",
+                "error": str(e),
+                "failure": TIMEOUT
+            }
 
     def send_message_to_multiple(self, phone_numbers, message):
         """Send a message to multiple phone numbers"""
-        results = []
-        for phone in phone_numbers:
-            try:
-                success = self.send_message(phone, message)
-                results.append({
-                    "phone": phone,
-                    "status": "success" if success else "failed"
-                })
-            except Exception as e:
-                results.append({
-                    "phone": phone,
-                    "status": "failed",
-                    "error": str(e)
-                })
-        return results
+        return [self.send_message_result(phone, message) for phone in phone_numbers]
 
 # Initialize WhatsApp bot
 whatsapp_bot = None
 
+# Sessions used for bulk sends; whatsapp_bot is the first of them
+bot_pool = None
+SESSION_STALL_TIMEOUT = int(os.getenv('SESSION_STALL_TIMEOUT', '120'))
+
+# Probes the pool's sessions and restarts the ones that died
+session_monitor = None
+
+# Send pacing per session: a token bucket that slows down when sends start failing or dragging.
+# SEND_RATE_PER_MINUTE and SEND_BURST may list one value per session ("30,20"); 0 disables pacing.
+SEND_RATE_PER_MINUTE = os.getenv('SEND_RATE_PER_MINUTE', '30')
+SEND_BURST = os.getenv('SEND_BURST', '3')
+SEND_SLOW_SECONDS = float(os.getenv('SEND_SLOW_SECONDS', '15'))
+SEND_MAX_FAILURE_RATIO = float(os.getenv('SEND_MAX_FAILURE_RATIO', '0.3'))
+
+def session_setting(value, index):
+    """Value for session index from a comma-separated setting; the last value applies to the rest"""
+    values = [v.strip() for v in str(value).split(',') if v.strip()]
+    return values[min(index, len(values) - 1)]
+
+def rate_limiter_for(index):
+    return AdaptiveRateLimiter(
+        rate_per_minute=float(session_setting(SEND_RATE_PER_MINUTE, index)),
+        burst=int(session_setting(SEND_BURST, index)),
+        slow_seconds=SEND_SLOW_SECONDS,
+        max_failure_ratio=SEND_MAX_FAILURE_RATIO
+    )
+
+def transport_for(index):
+    """The send transport of session index, as chosen by SEND_TRANSPORT"""
+    if SEND_TRANSPORT == 'http':
+        return HttpTransport(WHATSAPP_WEB_URL)
+    return SeleniumTransport(profile_dir_for(index), WHATSAPP_WEB_URL)
+
+def profile_dir_for(index):
+    """Chrome profile directory of session index; session 0 keeps the original profile"""
+    name = 'chrome_profile' if index == 0 else f'chrome_profile_{index + 1}'
+    return os.path.join(os.getcwd(), name)
+
+def close_sessions():
+    """Stop the health monitor and quit every browser of the current sessions"""
+    global session_monitor
+    if session_monitor:
+        session_monitor.stop()
+        session_monitor = None
+    if bot_pool:
+        bot_pool.close()
+    elif whatsapp_bot:
+        whatsapp_bot.close()
+
+atexit.register(close_sessions)
+
+# Background bulk campaigns
+job_manager = JobManager()
+
+# Retries of transient send failures (timeouts, lost sessions)
+SEND_MAX_ATTEMPTS = int(os.getenv('SEND_MAX_ATTEMPTS', '3'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '30'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '600'))
+
+# Per-recipient campaign checkpoints, so an interrupted campaign can be resumed
+campaign_store = CampaignStore(CAMPAIGN_DB)
+interrupted = campaign_store.mark_interrupted()
+if interrupted:
+    print(f"{interrupted} campaign(s) were interrupted; resume them with POST /campaigns/<id>/resume")
+
+def upload_merger():
+    """The RecipientStream on_chunk callback merging uploads into the contact store, if enabled"""
+    return contact_store.merge_chunk if CONTACTS_AUTO_MERGE else None
+
+def audience_from_form(form):
+    """
+    The saved contacts a request targets instead of an upload, or None
+    Either a saved segment's name, or groups and/or tags (comma separated)
+    Raises ValueError for an unknown segment
+    """
+    segment_name = form.get('segment', '').strip()
+    if segment_name:
+        segment = contact_store.get_segment(segment_name)
+        if not segment:
+            raise ValueError(f"Unknown segment: {segment_name}")
+        return {"segment": segment_name, "groups": segment["groups"], "tags": segment["tags"]}
+    groups = split_values(form.get('groups') or form.get('group'))
+    tags = split_values(form.get('tags') or form.get('tag'))
+    if groups or tags:
+        return {"segment": None, "groups": groups, "tags": tags}
+    return None
+
+def media_from_request(req):
+    """
+    The image a request sends: an uploaded 'image' file (prepared into the media cache), or the
+    key of one already there ('media'); None when neither is given. Raises ValueError for a bad image.
+    """
+    image = req.files.get('image')
+    if image and image.filename:
+        return media_cache.add(image.read(), os.path.basename(image.filename))
+    key = req.form.get('media', '').strip()
+    if not key:
+        return None
+    media = media_cache.get(key)
+    if not media:
+        raise ValueError(f"Unknown media: {key}")
+    return media
+
+def start_campaign_job(recipients, campaign, durable=True):
+    """
+    Start a background job sending campaign['message'] to the recipients stream
+    {column} placeholders in the message are filled from each recipient's row.
+    An image campaign sends its image to everyone, the message being the caption.
+    Recipients already sent this message and repeated numbers are skipped.
+    With durable=False (one-off sends) nothing is checkpointed or skipped.
+    Returns the job, or None if the stream has no valid numbers.
+    """
+    media = None
+    if campaign.get('media'):
+        media = media_cache.get(campaign['media'])
+        if not media:
+            raise ValueError("The campaign's image is gone from the media cache; start a new campaign")
+    
+    # Personalized messages are rendered from the upload's columns a chunk at a time
+    template = MessageTemplate(campaign['message'])
+    items = iter(recipients) if template.is_static else recipients.iter_messages(template)
+    
+    # Find the first valid recipient; the rest are read while sending
+    first_item = next(items, None)
+    if first_item is None:
+        return None
+    
+    checkpoint = CampaignCheckpoint(campaign_store, campaign) if durable else None
+    
+    def total():
+        estimate = recipients.estimated_total()
+        skipped = checkpoint.skipped if checkpoint else 0
+        return estimate - skipped if estimate is not None else None
+    
+    items = itertools.chain([first_item], items)
+    
+    # Send in the background while the rest of the file streams in;
+    # transient failures are retried with backoff after the main pass
+    dispatch = RetryingDispatch(
+        functools.partial(bot_pool.dispatch, media=media) if media else bot_pool.dispatch,
+        max_attempts=SEND_MAX_ATTEMPTS,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY
+    )
+    job = CampaignJob(
+        checkpoint.pending(items) if checkpoint else items,
+        campaign['message'],
+        total=total,
+        source=recipients,
+        dispatch=dispatch,
+        job_id=campaign['id'],
+        checkpoint=checkpoint
+    )
+    if checkpoint:
+        campaign_store.update(campaign['id'], state='running')
+    return job_manager.submit(job)
+
 @app.route('/')
 def index():
     return '''
@@ -578,6 +1024,9 @@ def index():
             <h1>WhatsApp Bulk Messenger</h1>
             
             <div class="form-group">
+                <label for="sessions">WhatsApp Web sessions:</label>
+                <input type="text" id="sessions" name="sessions" value="1">
+                <div class="info">Each session uses its own Chrome profile and has to be linked once by scanning its QR code.</div>
                 <button id="initButton" class="button" onclick="initializeBot()">Initialize WhatsApp Bot</button>
                 <div id="status"></div>
             </div>
@@ -591,7 +1040,12 @@ def index():
                 
                 <div class="form-group">
                     <label for="message">Message:</label>
-                    <textarea id="message" name="message" placeholder="Enter your message" required></textarea>
+                    <textarea id="message" name="message" placeholder="Enter your message"></textarea>
+                </div>
+                
+                <div class="form-group">
+                    <label for="image">Image (optional, the message becomes its caption):</label>
+                    <input type="file" id="image" name="image" accept="image/*">
                 </div>
                 
                 <button type="submit" id="submitButton" class="button">Send</button>
@@ -599,15 +1053,36 @@ def index():
             </form>
             
             <div class="form-group" style="margin-top: 20px;">
-                <form action="/send_message_bulk" method="post" enctype="multipart/form-data">
+                <form id="bulkForm" onsubmit="event.preventDefault(); sendBulk();">
                     <label for="file">Upload CSV/Excel file for bulk messaging:</label>
-                    <input type="file" id="file" name="file" accept=".csv,.xlsx,.xls" required>
+                    <input type="file" id="file" name="file" accept=".csv,.xlsx,.xls">
+                    <div class="form-group">
+                        <label for="segment">Or send to a saved segment:</label>
+                        <input type="text" id="segment" name="segment" placeholder="Segment name (see /segments)">
+                        <div class="info">Uploaded files are also saved as contacts; import more with POST /contacts/import.</div>
+                    </div>
+                    <div class="form-group">
+                        <label for="campaign_id">Campaign ID (optional, to resume an earlier campaign):</label>
+                        <input type="text" id="campaign_id" name="campaign_id" placeholder="Leave empty for a new campaign">
+                    </div>
                     <div class="form-group">
                         <label for="bulk_message">Message for bulk sending:</label>
-                        <textarea id="bulk_message" name="message" placeholder="Enter your message" required></textarea>
+                        <textarea id="bulk_message" name="message" placeholder="Enter your message"></textarea>
+                        <div class="info">Use {column} to insert a value from the file, e.g. "Hi {name|there}, you are in {group}". Text after | is used when the value is missing.</div>
+                    </div>
+                    <div class="form-group">
+                        <label for="bulk_image">Image for bulk sending (optional, the message becomes its caption):</label>
+                        <input type="file" id="bulk_image" name="image" accept="image/*">
+                        <div class="info">The image is resized and compressed once, then sent to every recipient.</div>
                     </div>
-                    <button type="submit" class="button">Send Bulk Messages</button>
+                    <button type="submit" id="bulkButton" class="button">Send Bulk Messages</button>
                 </form>
+                <div id="bulkStatus"></div>
+                <div id="bulkControls" style="display: none;">
+                    <button class="button" onclick="controlJob('pause')">Pause</button>
+                    <button class="button" onclick="controlJob('resume')">Resume</button>
+                    <button class="button" onclick="controlJob('cancel')">Cancel</button>
+                </div>
             </div>
         </div>
         
@@ -622,8 +1097,11 @@ def index():
                 statusDiv.className = 'status';
                 
                 try {
+                    const formData = new FormData();
+                    formData.append('sessions', document.getElementById('sessions').value);
                     const response = await fetch('/init', {
-                        method: 'POST'
+                        method: 'POST',
+                        body: formData
                     });
                     const result = await response.json();
                     
@@ -649,10 +1127,11 @@ def index():
                 const statusDiv = document.getElementById('messageStatus');
                 const submitButton = document.getElementById('submitButton');
                 const messageInput = document.getElementById('message');
+                const imageInput = document.getElementById('image');
                 
-                // Check if message is provided
-                if (!messageInput.value) {
-                    statusDiv.textContent = 'Please provide a message';
+                // Check if a message or image is provided
+                if (!messageInput.value && !imageInput.files.length) {
+                    statusDiv.textContent = 'Please provide a message or an image';
                     statusDiv.className = 'status error';
                     return;
                 }
@@ -684,27 +1163,140 @@ def index():
                 
                 submitButton.disabled = false;
             }
+            
+            let currentJobId = null;
+            
+            async function sendBulk() {
+                const form = document.getElementById('bulkForm');
+                const statusDiv = document.getElementById('bulkStatus');
+                const bulkButton = document.getElementById('bulkButton');
+                
+                bulkButton.disabled = true;
+                statusDiv.textContent = 'Uploading...';
+                statusDiv.className = 'status';
+                
+                try {
+                    const response = await fetch('/send_message_bulk', {
+                        method: 'POST',
+                        body: new FormData(form)
+                    });
+                    const result = await response.json();
+                    
+                    if (!result.success) {
+                        statusDiv.textContent = 'Failed to start: ' + result.message;
+                        statusDiv.className = 'status error';
+                        bulkButton.disabled = false;
+                        return;
+                    }
+                    
+                    currentJobId = result.job_id;
+                    document.getElementById('bulkControls').style.display = 'block';
+                    const events = new EventSource('/jobs/' + currentJobId + '/events');
+                    events.onmessage = (event) => {
+                        const job = JSON.parse(event.data);
+                        const total = job.total === null ? '?' : job.total;
+                        const eta = job.eta_seconds === null ? '-' : Math.round(job.eta_seconds) + 's';
+                        statusDiv.textContent = `${job.state}: ${job.sent} sent, ${job.failed} failed, ` +
+                            `${job.pending === null ? '?' : job.pending} pending of ${total} ` +
+                            `(${job.messages_per_minute}/min, ETA ${eta})`;
+                        statusDiv.className = job.failed ? 'status error' : 'status success';
+                        if (['completed', 'cancelled', 'failed'].includes(job.state)) {
+                            events.close();
+                            document.getElementById('bulkControls').style.display = 'none';
+                            bulkButton.disabled = false;
+                        }
+                    };
+                } catch (error) {
+                    statusDiv.textContent = 'Error: ' + error.message;
+                    statusDiv.className = 'status error';
+                    bulkButton.disabled = false;
+                }
+            }
+            
+            async function controlJob(action) {
+                if (currentJobId) {
+                    await fetch('/jobs/' + currentJobId + '/' + action, { method: 'POST' });
+                }
+            }
         </script>
     </body>
     </html>
     '''
 
+def start_sessions(sessions):
+    """
+    (Re)start the pool with the given number of WhatsApp sessions; returns how many are ready
+    Raises RuntimeError while a bulk send is still running.
+    """
+    global whatsapp_bot, bot_pool, session_monitor
+    if any(job["state"] not in FINISHED_STATES for job in job_manager.list()):
+        raise RuntimeError("A bulk send is still running. Cancel it before re-initializing.")
+    
+    # Quit the previous browsers instead of leaving them running
+    close_sessions()
+    
+    sessions = max(sessions, 1)
+    if sessions > (os.cpu_count() or 1):
+        print(f"Warning: {sessions} sessions on {os.cpu_count()} CPU cores; throughput will not scale past the core count")
+    
+    bot_pool = BotPool(
+        lambda index: WhatsAppBot(profile_dir=profile_dir_for(index), transport=transport_for(index)),
+        size=sessions,
+        stall_timeout=SESSION_STALL_TIMEOUT,
+        limiter_factory=rate_limiter_for
+    )
+    ready = bot_pool.start()
+    whatsapp_bot = bot_pool.primary
+    if ready:
+        session_monitor = SessionMonitor(bot_pool, interval=SESSION_CHECK_INTERVAL)
+        session_monitor.start()
+    return ready
+
 @app.route('/init', methods=['POST'])
 def init_bot():
-    global whatsapp_bot
     try:
-        whatsapp_bot = WhatsAppBot()
-        success = whatsapp_bot.setup_driver()
-        if success:
-            return jsonify({"success": True, "message": "WhatsApp bot initialized successfully"})
+        sessions = int(request.form.get('sessions') or request.args.get('sessions') or os.getenv('WHATSAPP_SESSIONS', '1'))
+        ready = start_sessions(sessions)
+        if ready:
+            return jsonify({
+                "success": True,
+                "message": f"WhatsApp bot initialized successfully ({ready} of {max(sessions, 1)} sessions ready)"
+            })
         else:
             return jsonify({"success": False, "message": "Failed to initialize WhatsApp bot"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
+    """Per-session state and throughput of the bot pool"""
+    if not bot_pool:
+        return jsonify({"success": True, "sessions": []})
+    sessions = bot_pool.stats()
+    return jsonify({
+        "success": True,
+        "sessions": sessions,
+        "memory_rss_mb": round(sum(session["memory"]["rss_mb"] for session in sessions if session["memory"]), 1),
+        "monitor": session_monitor.stats() if session_monitor else None
+    })
+
+@app.route('/sessions/<int:index>/rate', methods=['POST'])
+def set_session_rate(index):
+    """Change the send rate (rate_per_minute, burst) of one session"""
+    if not bot_pool or index >= len(bot_pool.workers):
+        return jsonify({"success": False, "message": "Session not found"}), 404
+    limiter = bot_pool.workers[index].limiter
+    try:
+        rate = float(request.values.get('rate_per_minute', limiter.base_rate))
+        burst = request.values.get('burst', type=int)
+    except ValueError:
+        return jsonify({"success": False, "message": "rate_per_minute must be a number"}), 400
+    limiter.configure(rate, burst)
+    return jsonify({"success": True, "message": f"Session {index} rate set", "rate": limiter.stats()})
+
 @app.route('/send_message', methods=['POST'])
+@traced
 def send_message():
-    global whatsapp_bot
     if not whatsapp_bot or whatsapp_bot.driver is None:
         return jsonify({"success": False, "message": "WhatsApp bot not initialized. Please initialize first."})
     
@@ -712,6 +1304,11 @@ def send_message():
         # Get form data
         phone = request.form.get('phone')
         message = request.form.get('message', '')
+        try:
+            media = media_from_request(request)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+        message_type = "image" if media else "text"
         
         print(f"Received request - Phone: {phone}")
         
@@ -722,11 +1319,13 @@ def send_message():
         if not phone_numbers:
             return jsonify({"success": False, "message": "Phone number(s) are required"})
             
-        if not message:
+        if not message and not media:
             return jsonify({"success": False, "message": "Message is required"})
         
         # Process each phone number
         results = []
+        worker = bot_pool.worker_for(whatsapp_bot) if bot_pool else None
+        limiter = worker.limiter if worker else None
         
         for phone in phone_numbers:
             # Remove any spaces and ensure phone number format
@@ -735,13 +1334,20 @@ def send_message():
                 phone = "+" + phone
             
             try:
-                # Send text message
-                success = whatsapp_bot.send_message(phone, message)
+                # Send the message (or image), paced like the bulk sends of this session
+                if limiter:
+                    limiter.acquire()
+                started = time.monotonic()
+                success = whatsapp_bot.send_message(phone, message, media)
+                if limiter:
+                    limiter.report(success, time.monotonic() - started)
                 results.append({
                     "phone": phone,
                     "status": "success" if success else "failed",
-                    "type": "text"
+                    "type": message_type
                 })
+                if not success and whatsapp_bot.last_failure:
+                    results[-1].update(whatsapp_bot.last_failure)
             except Exception as e:
                 error_msg = str(e)
                 print(f"Error sending to {phone}: {error_msg}")
@@ -749,7 +1355,7 @@ def send_message():
                     "phone": phone,
                     "status": "failed",
                     "error": error_msg,
-                    "type": "text"
+                    "type": message_type
                 })
         
         # Check if all messages were sent successfully
@@ -776,185 +1382,140 @@ def send_message():
             "message": f"Error: {error_msg}"
         })
 
-def find_phone_column(df):
-    """
-    Find the column containing phone numbers in the DataFrame
-    Returns the name of the column containing phone numbers
-    """
-    # Common column names for phone numbers
-    phone_columns = [
-        'phone', 'phone_number', 'mobile', 'contact', 'number', 'tel',
-        'telephone', 'cell', 'cellphone', 'phone no', 'mobile no',
-        'contact no', 'mob', 'mob_no', 'mobile_number'
-    ]
-    
-    # First, check for exact matches in column names
-    for col in df.columns:
-        if col.lower().replace(' ', '_') in phone_columns:
-            return col
-    
-    # If no exact match, try to find a column with numeric values
-    for col in df.columns:
-        # Check if the column contains numbers (allowing for scientific notation)
-        if df[col].dtype in ['int64', 'float64'] or \
-           (df[col].dtype == 'object' and df[col].str.contains(r'^\d+$|^\d+\.\d+e\+\d+$', na=True).any()):
-            return col
-    
-    # If still no match, return the first column as default
-    return df.columns[0]
-
-def format_phone_number(number):
-    """
-    Convert phone number to standard format
-    - Handles scientific notation
-    - Ensures country code is present
-    - Removes any non-digit characters
-    """
-    try:
-        # Handle NaN or empty values
-        if pd.isna(number) or str(number).strip() == '':
-            return None
-            
-        # Convert to string and handle scientific notation
-        if isinstance(number, float):
-            str_number = f"{float(number):.0f}"
-        else:
-            str_number = str(number)
-        
-        # Remove any non-digit characters
-        digits_only = ''.join(filter(str.isdigit, str_number))
-        
-        # Handle different formats
-        if len(digits_only) <= 10:  # Only local number
-            digits_only = '91' + digits_only.zfill(10)
-        elif len(digits_only) > 12:  # Too many digits
-            digits_only = digits_only[-12:]  # Take last 12 digits
-        elif len(digits_only) == 11 and digits_only.startswith('0'):  # Remove leading 0
-            digits_only = '91' + digits_only[1:]
-        elif len(digits_only) == 12 and not digits_only.startswith('91'):  # Wrong country code
-            digits_only = '91' + digits_only[-10:]
-        
-        # Validate final number
-        if len(digits_only) == 12 and digits_only.startswith('91'):
-            return digits_only
-        return None
-        
-    except Exception as e:
-        print(f"Error formatting phone number {number}: {str(e)}")
-        return None
-
 @app.route('/send_message_bulk', methods=['POST'])
+@traced
 def send_message_bulk():
-    global whatsapp_bot
     if not whatsapp_bot or whatsapp_bot.driver is None:
         return jsonify({"success": False, "message": "WhatsApp bot not initialized. Please initialize first."})
     
+    recipients = None
     try:
-        # Debug: Print all form data and files
-        print("Form Data:", request.form)
-        print("Files:", request.files)
-        
-        # Get the uploaded file
+        # Get the uploaded file, or the saved contacts to send to
         file = request.files.get('file')
-        if not file:
+        try:
+            audience = None if file else audience_from_form(request.form)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+        if not file and not audience:
             print("No file uploaded")
             return jsonify({"success": False, "message": "No file uploaded"})
         
-        # Save the file temporarily
-        temp_dir = 'temp_uploads'
-        os.makedirs(temp_dir, exist_ok=True)
-        file_path = os.path.join(temp_dir, file.filename)
-        file.save(file_path)
+        if file and not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+            print(f"Unsupported file format: {file.filename}")
+            return jsonify({"success": False, "message": "Unsupported file format"})
         
-        # Read the file
-        try:
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file_path)
-            elif file.filename.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(file_path)
-            else:
-                print(f"Unsupported file format: {file.filename}")
-                return jsonify({"success": False, "message": "Unsupported file format"})
-            
-            # Debug: Print DataFrame info
-            print("DataFrame Columns:", df.columns)
-            print("DataFrame Head:\n", df.head())
-        except Exception as e:
-            print(f"Error reading file: {str(e)}")
-            return jsonify({"success": False, "message": f"Error reading file: {str(e)}"})
-        
-        # Validate DataFrame
-        if df.empty or len(df.columns) == 0:
-            print("File is empty or has no columns")
-            return jsonify({"success": False, "message": "File is empty or has no columns"})
-        
-        # Find and extract phone numbers
-        try:
-            # Find the column containing phone numbers
-            phone_column = find_phone_column(df)
-            print(f"Using column '{phone_column}' for phone numbers")
-            
-            # Format phone numbers
-            phones = []
-            invalid_numbers = []
-            
-            for idx, number in enumerate(df[phone_column]):
-                formatted_number = format_phone_number(number)
-                if formatted_number:
-                    phones.append(formatted_number)
-                else:
-                    invalid_numbers.append(f"Row {idx + 2}: {number}")  # +2 because idx starts at 0 and we skip header
-            
-            print(f"Extracted {len(phones)} valid phone numbers")
-            if invalid_numbers:
-                print(f"Found {len(invalid_numbers)} invalid numbers:")
-                for num in invalid_numbers:
-                    print(f"  - {num}")
-            
-            if not phones:
-                print("No valid phone numbers found")
-                return jsonify({
-                    "success": False,
-                    "message": "No valid phone numbers found",
-                    "details": {
-                        "invalid_numbers": invalid_numbers
-                    }
-                })
-                
-        except Exception as e:
-            print(f"Error extracting phone numbers: {str(e)}")
-            return jsonify({"success": False, "message": f"Error extracting phone numbers: {str(e)}"})
-        
-        # Get message from form
+        # Get message from form; with an image it is the (optional) caption
         message = request.form.get('message', '').strip()
         print(f"Message from form: {message}")
+        try:
+            media = media_from_request(request)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+        
+        # Continue an earlier campaign with a re-uploaded file
+        campaign = None
+        campaign_id = request.form.get('campaign_id', '').strip()
+        if campaign_id:
+            campaign = campaign_store.get(campaign_id)
+            if not campaign:
+                return jsonify({"success": False, "message": f"Unknown campaign: {campaign_id}"})
+            if running_job(campaign_id):
+                return jsonify({"success": False, "message": "Campaign is already running"})
+            message = message or campaign['message']
+            if message != campaign['message']:
+                return jsonify({"success": False, "message": "Message differs from the campaign's message"})
+            if media and media['key'] != campaign['media']:
+                return jsonify({"success": False, "message": "Image differs from the campaign's image"})
+            media = media or (media_cache.get(campaign['media']) if campaign['media'] else None)
         
         # Validate message
-        if not message:
+        if not message and not media:
             return jsonify({"success": False, "message": "Message is required"})
         
-        print(f"Final message to be sent: {message}")
+        campaign_id = campaign_id or uuid.uuid4().hex
+        file_path = None
+        if audience:
+            recipients = contact_store.select(audience["groups"], audience["tags"]).open()
+            print(f"Sending to saved contacts: {audience}")
+        else:
+            # Keep the upload until the campaign completes, so it can be resumed
+            os.makedirs(TEMP_FOLDER, exist_ok=True)
+            file_path = os.path.join(TEMP_FOLDER, f"{campaign_id}_{uuid.uuid4().hex[:8]}_{os.path.basename(file.filename)}")
+            file.save(file_path)
+            
+            # Open the file for streaming; only the first chunk is read here
+            try:
+                recipients = RecipientStream(file_path, on_chunk=upload_merger()).open()
+                print(f"Using column '{recipients.phone_column}' for phone numbers "
+                      f"(confidence {recipients.phone_confidence})")
+            except pd.errors.EmptyDataError:
+                print("File is empty or has no columns")
+                os.remove(file_path)
+                return jsonify({"success": False, "message": "File is empty or has no columns"})
+            except ValueError as e:
+                print(f"Error reading file: {str(e)}")
+                os.remove(file_path)
+                return jsonify({"success": False, "message": str(e)})
+            except Exception as e:
+                print(f"Error reading file: {str(e)}")
+                os.remove(file_path)
+                return jsonify({"success": False, "message": f"Error reading file: {str(e)}"})
         
-        # Send messages to all phone numbers
-        results = whatsapp_bot.send_message_to_multiple(phones, message)
+        if campaign:
+            previous_file = campaign['file_path']
+            campaign_store.update(campaign_id, file_path=file_path, audience=audience)
+            campaign = campaign_store.get(campaign_id)
+            if previous_file and previous_file != file_path and os.path.exists(previous_file):
+                os.remove(previous_file)
+        else:
+            campaign = campaign_store.create(
+                message, file_path=file_path, campaign_id=campaign_id, audience=audience,
+                media=media['key'] if media else None
+            )
         
-        # Clean up
-        os.remove(file_path)
+        print(f"Final message to be sent: {message}")
+        try:
+            job = start_campaign_job(recipients, campaign)
+        except Exception as e:
+            print(f"Error extracting phone numbers: {str(e)}")
+            return jsonify({"success": False, "message": f"Error extracting phone numbers: {str(e)}"})
         
-        # Check if all messages were sent successfully
-        all_success = all(result["status"] == "success" for result in results)
+        if job is None:
+            print("No valid phone numbers found")
+            campaign_store.update(campaign_id, state=FAILED)
+            recipients.close()
+            if file_path:
+                os.remove(file_path)
+            return jsonify({
+                "success": False,
+                "message": "No valid phone numbers found",
+                "details": {
+                    "invalid_numbers": recipients.invalid_numbers
+                }
+            })
+        # The job now owns the upload
+        recipients_columns = recipients.columns
+        recipients_phone_column = recipients.phone_column
+        recipients_phone_confidence = getattr(recipients, 'phone_confidence', None)
+        recipients = None
         
-        # Include information about invalid numbers in the response
-        response = {
-            "success": all_success,
-            "message": "All messages sent successfully" if all_success else "Some messages failed to send",
+        template = MessageTemplate(message)
+        return jsonify({
+            "success": True,
+            "message": "Bulk send started",
+            "job_id": job.id,
+            "campaign_id": campaign_id,
             "details": {
-                "results": results,
-                "invalid_numbers": invalid_numbers if invalid_numbers else []
+                "media": media,
+                "status_url": f"/jobs/{job.id}",
+                "events_url": f"/jobs/{job.id}/events",
+                "campaign_url": f"/campaigns/{campaign_id}",
+                "phone_column": recipients_phone_column,
+                "phone_column_confidence": recipients_phone_confidence,
+                "template_fields": template.field_names,
+                "missing_fields": template.missing_fields(recipients_columns)
             }
-        }
-        
-        return jsonify(response)
+        })
             
     except Exception as e:
         print(f"Unexpected error in send_message_bulk: {str(e)}")
@@ -962,26 +1523,589 @@ def send_message_bulk():
             "success": False,
             "message": f"Error: {str(e)}"
         })
+    finally:
+        if recipients:
+            recipients.close()
+
+def running_job(job_id):
+    job = job_manager.get(job_id)
+    return job if job and not job.finished else None
+
+@app.route('/campaigns', methods=['GET'])
+def list_campaigns():
+    return jsonify({"success": True, "campaigns": campaign_store.list(request.args.get('limit', 50, type=int))})
+
+@app.route('/campaigns/<campaign_id>', methods=['GET'])
+def get_campaign(campaign_id):
+    campaign = campaign_store.get(campaign_id)
+    if not campaign:
+        return jsonify({"success": False, "message": "Campaign not found"}), 404
+    campaign["deliveries"] = campaign_store.counts(campaign_id)
+    campaign["resumable"] = bool(
+        campaign["audience"] or (campaign["file_path"] and os.path.exists(campaign["file_path"]))
+    ) and (not campaign["media"] or media_cache.get(campaign["media"]) is not None)
+    return jsonify({"success": True, "campaign": campaign})
+
+@app.route('/campaigns/<campaign_id>/resume', methods=['POST'])
+def resume_campaign(campaign_id):
+    """Continue a campaign from its checkpoint, skipping recipients already sent"""
+    if not bot_pool or not bot_pool.ready_workers():
+        return jsonify({"success": False, "message": "WhatsApp bot not initialized. Please initialize first."})
+    campaign = campaign_store.get(campaign_id)
+    if not campaign:
+        return jsonify({"success": False, "message": "Campaign not found"}), 404
+    if running_job(campaign_id):
+        return jsonify({"success": False, "message": "Campaign is already running"})
+    audience = campaign['audience']
+    if not audience and (not campaign['file_path'] or not os.path.exists(campaign['file_path'])):
+        return jsonify({"success": False, "message": "The campaign's upload is gone; upload the file again with campaign_id"})
+    if campaign['media'] and not media_cache.get(campaign['media']):
+        return jsonify({"success": False, "message": "The campaign's image is gone from the media cache"})
+    
+    recipients = None
+    try:
+        # A campaign to saved contacts re-reads its selection, so contacts added since are included
+        if audience:
+            recipients = contact_store.select(audience["groups"], audience["tags"]).open()
+        else:
+            recipients = RecipientStream(campaign['file_path'], on_chunk=upload_merger()).open()
+        job = start_campaign_job(recipients, campaign)
+        if job is None:
+            return jsonify({"success": False, "message": "No valid phone numbers found"})
+        recipients = None
+        return jsonify({
+            "success": True,
+            "message": "Campaign resumed",
+            "job_id": job.id,
+            "campaign_id": campaign_id,
+            "details": {
+                "status_url": f"/jobs/{job.id}",
+                "events_url": f"/jobs/{job.id}/events"
+            }
+        })
+    except Exception as e:
+        print(f"Error resuming campaign {campaign_id}: {str(e)}")
+        return jsonify({"success": False, "message": f"Error: {str(e)}"})
+    finally:
+        if recipients:
+            recipients.close()
+
+@app.route('/contacts/import', methods=['POST'])
+def import_contacts():
+    """Merge an uploaded CSV/Excel file into the contact store, optionally into groups/tags"""
+    file = request.files.get('file')
+    if not file:
+        return jsonify({"success": False, "message": "No file uploaded"})
+    if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+        return jsonify({"success": False, "message": "Unsupported file format"})
+    
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    file_path = os.path.join(TEMP_FOLDER, f"contacts_{uuid.uuid4().hex[:8]}_{os.path.basename(file.filename)}")
+    file.save(file_path)
+    try:
+        counts = contact_store.import_file(
+            file_path,
+            groups=split_values(request.form.get('groups') or request.form.get('group')),
+            tags=split_values(request.form.get('tags') or request.form.get('tag'))
+        )
+        return jsonify({
+            "success": True,
+            "message": f"Imported {counts['new']} new and updated {counts['updated']} contacts",
+            "details": counts
+        })
+    except Exception as e:
+        print(f"Error importing contacts: {str(e)}")
+        return jsonify({"success": False, "message": f"Error importing contacts: {str(e)}"})
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+@app.route('/contacts', methods=['GET'])
+def list_contacts():
+    """Saved contacts in phone order, filtered by ?group= and/or ?tag=; page with ?after=<last phone>"""
+    after = request.args.get('after')
+    # Phones are stored as 64-bit integers: anything else cannot be a page cursor
+    if after and not (after.isascii() and after.isdigit() and int(after) < 2 ** 63):
+        return jsonify({"success": False, "message": "after must be the next_after of a previous page"}), 400
+    page = contact_store.page(
+        groups=request.args.getlist('group') or None,
+        tags=request.args.getlist('tag') or None,
+        after=after,
+        limit=min(request.args.get('limit', 100, type=int), 1000)
+    )
+    contacts = page["contacts"]
+    return jsonify({
+        "success": True,
+        "total": page["total"],
+        "contacts": contacts,
+        "next_after": contacts[-1]["phone"] if len(contacts) else None
+    })
+
+@app.route('/contacts/groups', methods=['GET'])
+def list_contact_groups():
+    return jsonify({"success": True, "contacts": contact_store.count(), "groups": contact_store.groups()})
+
+@app.route('/contacts/tags', methods=['GET'])
+def list_contact_tags():
+    return jsonify({"success": True, "tags": contact_store.tags()})
+
+@app.route('/segments', methods=['GET'])
+def list_segments():
+    segments = contact_store.list_segments()
+    for segment in segments:
+        segment["contacts"] = len(contact_store.select_phones(segment["groups"], segment["tags"]))
+    return jsonify({"success": True, "segments": segments})
+
+@app.route('/segments', methods=['POST'])
+def save_segment():
+    """Save a named selection of groups and/or tags to send campaigns to (form field segment=<name>)"""
+    data = request.get_json(silent=True) or request.form
+    name = str(data.get('name', '')).strip()
+    groups = data.get('groups') or data.get('group')
+    tags = data.get('tags') or data.get('tag')
+    groups = groups if isinstance(groups, list) else split_values(groups)
+    tags = tags if isinstance(tags, list) else split_values(tags)
+    if not name:
+        return jsonify({"success": False, "message": "Segment name is required"})
+    if not groups and not tags:
+        return jsonify({"success": False, "message": "A segment needs at least one group or tag"})
+    segment = contact_store.save_segment(name, groups, tags)
+    segment["contacts"] = len(contact_store.select_phones(segment["groups"], segment["tags"]))
+    return jsonify({"success": True, "segment": segment})
+
+@app.route('/segments/<name>', methods=['DELETE'])
+def delete_segment(name):
+    if not contact_store.delete_segment(name):
+        return jsonify({"success": False, "message": "Segment not found"}), 404
+    return jsonify({"success": True, "message": f"Segment {name} deleted"})
+
+def job_status_payload(job):
+    status = job.status()
+    if isinstance(job.source, RecipientStream):
+        status["invalid_count"] = job.source.invalid_count
+        status["invalid_numbers"] = job.source.invalid_numbers
+    if job.checkpoint:
+        status.update(job.checkpoint.stats())
+    if isinstance(job.dispatch, RetryingDispatch):
+        status["retries"] = job.dispatch.stats()
+    return status
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({"success": True, "jobs": job_manager.list()})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, "job": job_status_payload(job)})
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events stream of job progress, ending when the job finishes"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    
+    def generate():
+        version = -1
+        while True:
+            new_version = job.wait_for_change(version, timeout=15)
+            if new_version == version:
+                # Keep idle connections open through proxies
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            yield f"data: {json.dumps(job_status_payload(job))}\n\n"
+            if job.finished:
+                break
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/jobs/<job_id>/<action>', methods=['POST'])
+def control_job(job_id, action):
+    """Pause, resume or cancel a bulk send"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    if action not in ('pause', 'resume', 'cancel'):
+        return jsonify({"success": False, "message": f"Unknown action: {action}"}), 400
+    
+    changed = getattr(job, action)()
+    return jsonify({
+        "success": changed,
+        "message": f"Job {action} {'requested' if changed else 'not possible in state ' + job.state}",
+        "job": job_status_payload(job)
+    })
 
 @app.route('/get_message_log', methods=['GET'])
 def get_message_log():
+    """
+    Return the message log one page at a time
+
+    Query parameters:
+    - phone, status, type: exact-match filters
+    - since, until: timestamp range ("YYYY-MM-DD HH:MM:SS", inclusive)
+    - cursor: next_cursor from the previous page
+    - limit: page size (default 100, max 1000)
+    - format=ndjson: stream every matching record as newline-delimited JSON
+    """
     try:
-        if os.path.exists(MESSAGE_LOG_FILE):
-            df = pd.read_excel(MESSAGE_LOG_FILE)
-            return jsonify({
-                "status": "success",
-                "data": df.to_dict('records')
-            })
-        else:
-            return jsonify({
-                "status": "success",
-                "data": []
-            })
+        filters = {key: request.args.get(key) for key in ('phone', 'status', 'type', 'since', 'until')}
+        cursor = request.args.get('cursor')
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+
+        # Make sure queued records are visible before reading
+        log_writer.flush()
+
+        if request.args.get('format') == 'ndjson':
+            def generate():
+                for record in tracking_store.iter_rows(filters):
+                    yield json.dumps(record) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        records, next_cursor = tracking_store.query(filters, after_id=cursor, limit=limit)
+        return jsonify({
+            "status": "success",
+            "data": records,
+            "next_cursor": next_cursor
+        })
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid parameter: {str(e)}"
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": f"Error reading message log: {str(e)}"
         }), 500
 
+@app.route('/export_message_log', methods=['GET'])
+def export_message_log():
+    """Export the message log to Excel on demand"""
+    try:
+        log_writer.flush()
+        path = tracking_store.export_excel(MESSAGE_LOG_FILE)
+        return send_file(os.path.abspath(path), as_attachment=True, download_name='message_log.xlsx')
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Error exporting message log: {str(e)}"
+        }), 500
+
+@app.route('/tracking_stats', methods=['GET'])
+def tracking_stats():
+    """Queue depth and flush latency of the background log writer"""
+    return jsonify({
+        "status": "success",
+        "data": log_writer.stats()
+    })
+
+@app.route('/screenshots', methods=['GET'])
+def list_screenshots():
+    """The most recent failure screenshots and the writer's counters"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        "status": "success",
+        "data": screenshot_store.recent_screenshots(limit),
+        "stats": screenshot_store.stats()
+    })
+
+@app.route('/screenshots/<screenshot_id>', methods=['GET'])
+def get_screenshot(screenshot_id):
+    """The image of a failure screenshot (the id is in the message log's screenshot column); ?info=1 for its record"""
+    record = screenshot_store.get(screenshot_id)
+    if not record:
+        return jsonify({"status": "error", "message": "Unknown screenshot, or not written yet"}), 404
+    if request.args.get('info'):
+        return jsonify({"status": "success", "data": record})
+    if not record["path"]:
+        return jsonify({"status": "error", "message": "Screenshot was evicted to stay within SCREENSHOT_MAX_MB"}), 410
+    return send_file(os.path.abspath(record["path"]))
+
+@app.route('/media', methods=['POST'])
+def upload_media():
+    """Prepare an uploaded image for sending; its key can then be passed as 'media' to the send routes"""
+    image = request.files.get('image')
+    if not image or not image.filename:
+        return jsonify({"success": False, "message": "No image uploaded"})
+    try:
+        media = media_cache.add(image.read(), os.path.basename(image.filename))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
+    return jsonify({"success": True, "message": "Image ready to send", "media": media})
+
+@app.route('/media', methods=['GET'])
+def list_media():
+    """The most recently prepared images and the cache's counters"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({"status": "success", "data": media_cache.list(limit), "stats": media_cache.stats()})
+
+@app.route('/media/<key>', methods=['GET'])
+def get_media(key):
+    """The prepared image as it is sent; ?info=1 for its record"""
+    media = media_cache.get(key)
+    if not media:
+        return jsonify({"status": "error", "message": "Unknown media"}), 404
+    if request.args.get('info'):
+        return jsonify({"status": "success", "data": media})
+    return send_file(media["path"])
+
+# MCP tools for agents: sends are queued as jobs and the call returns at once with the job_id;
+# job_status then pages through the per-recipient results as they arrive
+mcp = MCPServer(
+    "WhatsApp Bulk Messenger",
+    "1.0",
+    instructions="send_message and send_bulk queue the sends and return a job_id right away. Call job_status "
+                 "with that job_id and the cursor it returned to get the results of further recipients as they "
+                 "are sent (wait_seconds waits for new results instead of polling)."
+)
+MCP_MAX_WAIT_SECONDS = 30
+# Browser origins (besides localhost) allowed to call POST /mcp, comma separated
+MCP_ALLOWED_ORIGINS = split_values(os.getenv('MCP_ALLOWED_ORIGINS', ''))
+
+def mcp_require_sessions():
+    if not bot_pool or not bot_pool.ready_workers():
+        raise ToolError("WhatsApp bot not initialized. Please initialize first (POST /init).")
+
+def mcp_media(media=None, image_path=None):
+    """The MediaCache entry a tool call sends: a key from POST /media, or an image file on this machine"""
+    if image_path:
+        try:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            raise ToolError(f"Cannot read image: {str(e)}")
+        return media_cache.add(data, os.path.basename(image_path))
+    if media:
+        entry = media_cache.get(media)
+        if not entry:
+            raise ToolError(f"Unknown media: {media}")
+        return entry
+    return None
+
+def mcp_job_reply(job, recipients, message):
+    return {
+        "job_id": job.id,
+        "state": job.state,
+        "message": message,
+        "total": recipients.estimated_total(),
+        "invalid_count": recipients.invalid_count,
+        "invalid_numbers": recipients.invalid_numbers,
+        "cursor": 0
+    }
+
+MEDIA_PROPERTIES = {
+    "media": {"type": "string", "description": "Key of an image prepared with POST /media, sent with message as caption"},
+    "image_path": {"type": "string", "description": "Path of an image file on the server to send, with message as caption"}
+}
+
+@mcp.tool(
+    name="send_message",
+    description="Queue a message (or image) to one or more phone numbers and return a job_id at once. "
+                "Numbers are normalized like bulk uploads; track delivery with job_status.",
+    properties=dict({
+        "phone": {"type": "string", "description": "Phone number, or several separated by commas"},
+        "message": {"type": "string", "description": "Message text (the caption when an image is sent)"}
+    }, **MEDIA_PROPERTIES),
+    required=["phone"]
+)
+def mcp_send_message(phone, message='', media=None, image_path=None):
+    mcp_require_sessions()
+    media = mcp_media(media, image_path)
+    if not message and not media:
+        raise ToolError("Message is required")
+    recipients = RecipientList(split_values(phone)).open()
+    # A one-off send like POST /send_message: the same text can be sent again
+    job = start_campaign_job(
+        recipients, {"id": uuid.uuid4().hex, "message": message, "media": media["key"] if media else None},
+        durable=False
+    )
+    if job is None:
+        raise ToolError(f"No valid phone numbers: {', '.join(recipients.invalid_numbers)}")
+    return mcp_job_reply(job, recipients, "Send queued")
+
+@mcp.tool(
+    name="send_bulk",
+    description="Start a bulk campaign to a list of recipients or to saved contacts (a segment, groups and/or "
+                "tags) and return its job_id at once. {column} placeholders in the message are filled from each "
+                "recipient's fields. Numbers that already received the same message are skipped, so calling "
+                "again with the returned campaign_id continues the campaign. Track it with job_status.",
+    properties=dict({
+        "recipients": {
+            "type": "array",
+            "description": "Phone numbers, or objects with a phone field and fields for {placeholders}",
+            "items": {"type": ["string", "object"]}
+        },
+        "segment": {"type": "string", "description": "Name of a saved segment to send to"},
+        "groups": {"type": "array", "items": {"type": "string"}, "description": "Saved contact groups to send to"},
+        "tags": {"type": "array", "items": {"type": "string"}, "description": "Saved contact tags to send to"},
+        "message": {"type": "string", "description": "Message text (the caption when an image is sent)"},
+        "campaign_id": {"type": "string", "description": "Continue this earlier campaign"}
+    }, **MEDIA_PROPERTIES)
+)
+def mcp_send_bulk(recipients=None, segment=None, groups=None, tags=None, message='', media=None, image_path=None,
+                  campaign_id=None):
+    mcp_require_sessions()
+    audience = audience_from_form({
+        "segment": segment or '',
+        "groups": ','.join(groups or []),
+        "tags": ','.join(tags or [])
+    })
+    if bool(recipients) == bool(audience):
+        raise ToolError("Give either recipients or saved contacts (segment, groups, tags)")
+    media = mcp_media(media, image_path)
+    
+    campaign = None
+    if campaign_id:
+        campaign = campaign_store.get(campaign_id)
+        if not campaign:
+            raise ToolError(f"Unknown campaign: {campaign_id}")
+        if running_job(campaign_id):
+            raise ToolError("Campaign is already running")
+        message = message or campaign['message']
+        if message != campaign['message']:
+            raise ToolError("Message differs from the campaign's message")
+        if media and media['key'] != campaign['media']:
+            raise ToolError("Image differs from the campaign's image")
+    if not message and not media and not (campaign and campaign['media']):
+        raise ToolError("Message is required")
+    
+    stream = RecipientList(recipients).open() if recipients else \
+        contact_store.select(audience["groups"], audience["tags"]).open()
+    if campaign:
+        if audience:
+            campaign_store.update(campaign_id, audience=audience)
+        campaign = campaign_store.get(campaign_id)
+    else:
+        campaign = campaign_store.create(message, audience=audience, media=media['key'] if media else None)
+    job = start_campaign_job(stream, campaign)
+    if job is None:
+        campaign_store.update(campaign['id'], state=FAILED)
+        raise ToolError("No valid phone numbers found")
+    reply = mcp_job_reply(job, stream, "Bulk send started")
+    reply["campaign_id"] = campaign['id']
+    return reply
+
+@mcp.tool(
+    name="job_status",
+    description="Progress of a job started by send_message or send_bulk, with the per-recipient results after "
+                "cursor (pass the cursor of the previous reply to get only new ones). wait_seconds (up to 30) "
+                "waits for a new result or the end of the job before replying.",
+    properties={
+        "job_id": {"type": "string"},
+        "cursor": {"type": "integer", "description": "Number of results already seen (0 for all)"},
+        "limit": {"type": "integer", "description": "Most results to return (default 100, at most 1000)"},
+        "wait_seconds": {"type": "number", "description": "Wait up to this long for a new result"}
+    },
+    required=["job_id"]
+)
+def mcp_job_status(job_id, cursor=0, limit=100, wait_seconds=0):
+    job = job_manager.get(job_id)
+    if not job:
+        raise ToolError(f"Unknown job: {job_id}")
+    cursor = max(int(cursor), 0)
+    wait_seconds = min(max(float(wait_seconds), 0.0), MCP_MAX_WAIT_SECONDS)
+    if wait_seconds:
+        deadline = time.monotonic() + wait_seconds
+        version = job.version
+        while not job.finished and job.sent + job.failed <= cursor:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            version = job.wait_for_change(version, remaining)
+    results, next_cursor, missed = job.results_since(cursor, min(max(int(limit), 1), 1000))
+    status = job_status_payload(job)
+    del status["recent_results"]
+    status.update({
+        "results": results,
+        "cursor": next_cursor,
+        "missed_results": missed,
+        "more_results": next_cursor < status["sent"] + status["failed"],
+        "finished": job.finished
+    })
+    return status
+
+@app.route('/mcp', methods=['POST'])
+def mcp_endpoint():
+    """MCP over HTTP: a JSON-RPC message (or batch) per POST, answered with JSON"""
+    # Keep web pages other than the app's own from driving the sessions (DNS rebinding)
+    origin = request.headers.get('Origin')
+    if origin and urlsplit(origin).hostname not in ('localhost', '127.0.0.1', '::1') and origin not in MCP_ALLOWED_ORIGINS:
+        return jsonify({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "Origin not allowed"}}), 403
+    reply = mcp.handle_json(request.get_data(as_text=True))
+    if reply is None:
+        return '', 202
+    return Response(reply, content_type='application/json')
+
+def campaign_gauges():
+    """Unfinished campaigns by state, their pending recipients and those waiting for a retry"""
+    with job_manager.lock:
+        jobs = [job for job in job_manager.jobs.values() if not job.finished]
+    states = {}
+    pending = 0
+    waiting = 0
+    for job in jobs:
+        states[job.state] = states.get(job.state, 0) + 1
+        status = job.status()
+        pending += status["pending"] or 0
+        waiting += getattr(job.dispatch, 'waiting', 0)
+    return {"states": states, "pending": pending, "waiting": waiting}
+
+# Gauges of sessions and queues are computed when /metrics is scraped
+metrics.gauge('whatsapp_sessions', 'Configured WhatsApp sessions',
+              callback=lambda: len(bot_pool.workers) if bot_pool else 0)
+metrics.gauge('whatsapp_sessions_active', 'Sessions ready to send',
+              callback=lambda: len(bot_pool.ready_workers()) if bot_pool else 0)
+metrics.gauge('whatsapp_sessions_busy', 'Sessions in the middle of a send',
+              callback=lambda: sum(1 for w in bot_pool.workers if w.current is not None) if bot_pool else 0)
+metrics.gauge('whatsapp_send_queue_depth', 'Recipients queued for a session and not yet taken',
+              callback=lambda: bot_pool.queue_depth() if bot_pool else 0)
+metrics.gauge('whatsapp_campaigns', 'Unfinished campaigns, by state', ['state'],
+              callback=lambda: campaign_gauges()["states"])
+metrics.gauge('whatsapp_campaign_pending_recipients', 'Recipients of unfinished campaigns not processed yet',
+              callback=lambda: campaign_gauges()["pending"])
+metrics.gauge('whatsapp_retry_waiting', 'Recipients waiting for their retry backoff to expire',
+              callback=lambda: campaign_gauges()["waiting"])
+metrics.gauge('whatsapp_tracking_log_queue_depth', 'Tracking log records queued for the writer',
+              callback=lambda: log_writer.queue.qsize())
+metrics.counter('whatsapp_tracking_log_records_written_total', 'Tracking log records written to SQLite',
+                callback=lambda: log_writer.records_written)
+metrics.counter('whatsapp_tracking_log_records_failed_total', 'Tracking log records that could not be written',
+                callback=lambda: log_writer.records_failed)
+metrics.counter('whatsapp_tracking_log_flush_seconds_total', 'Time the writer spent writing batches to SQLite',
+                callback=lambda: log_writer.total_flush_ms / 1000)
+metrics.counter('whatsapp_tracking_log_backpressure_waits_total', 'Writes that blocked on a full log queue',
+                callback=lambda: log_writer.backpressure_waits)
+metrics.gauge('whatsapp_screenshot_queue_depth', 'Failure screenshots waiting to be written',
+              callback=lambda: screenshot_store.queue.qsize())
+metrics.gauge('whatsapp_screenshot_disk_bytes', 'Size of the failure screenshot folder',
+              callback=lambda: screenshot_store.total_bytes)
+metrics.counter('whatsapp_screenshots_total', 'Failure screenshots, by what became of them', ['outcome'],
+                callback=lambda: {
+                    ('written',): screenshot_store.written,
+                    ('deduplicated',): screenshot_store.deduplicated,
+                    ('dropped',): screenshot_store.dropped,
+                    ('evicted',): screenshot_store.evicted
+                })
+metrics.counter('whatsapp_media_cache_requests_total', 'Images added to the media cache, by whether they were ready',
+                ['result'],
+                callback=lambda: {('hit',): media_cache.hits, ('miss',): media_cache.misses})
+metrics.counter('whatsapp_mcp_tool_calls_total', 'MCP tool calls, by tool', ['tool'],
+                callback=lambda: {(name,): count for name, count in mcp.tool_calls.items()})
+metrics.counter('whatsapp_traces_written_total', 'Send traces written to TRACE_FILE',
+                callback=lambda: tracer.traces_written)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Send latency per stage, failures per class, sessions and queue depths in Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000) 
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""
+Benchmark suite: end-to-end sends and the stages around them, as JSON
+
+Runs the Flask app in-process against a local fake WhatsApp Web
+(fake_whatsapp.py, through the browserless HTTP transport) in a scratch
+directory, and measures:
+- bulk: /send_message_bulk throughput (messages per minute) and per-message latency
+- single: /send_message request latency
+- ingest: CSV and xlsx rows per second through the upload reader
+- phone_format: format_phone_number calls and normalize_phone_series rows per second
+- tracking_log: update_tracking_log cost per record as the log grows
+
+App output goes to stderr; the results are printed to stdout as one JSON
+document (and written to --output), so runs can be compared across releases.
+
+Usage: python benchmarks/bench_end_to_end.py [--messages 500] [--sessions 2] [--output results.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from fake_whatsapp import FakeWhatsAppServer  # noqa: E402
+from phone_utils import format_phone_number, normalize_phone_series  # noqa: E402
+from recipient_reader import RecipientStream  # noqa: E402
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    values = np.array(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2)
+    }
+
+
+def phone_values(rows, seed=0):
+    # Numbers in the formats uploads contain, a few of them invalid
+    rng = np.random.default_rng(seed)
+    local = rng.integers(6000000000, 9999999999, rows).tolist()
+    formats = ['{}', '91{}', '+91 {}', '0{}', '91-{}']
+    values = [formats[i % len(formats)].format(n) for i, n in enumerate(local)]
+    for i in range(0, rows, 97):
+        values[i] = 'n/a'
+    return values
+
+
+def wait_for_job(client, job_id, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").get_json()["job"]
+        if job["state"] in ('completed', 'failed', 'cancelled'):
+            return job
+        time.sleep(0.05)
+    raise RuntimeError(f"Job {job_id} did not finish within {timeout}s")
+
+
+def record_send_latency(bot_pool):
+    """Time every send of every session; returns the list the durations are appended to"""
+    durations = []
+    lock = threading.Lock()
+    for worker in bot_pool.workers:
+        send = worker.bot.send_message_result
+
+        def timed(phone, message, *args, send=send, **kwargs):
+            start = time.perf_counter()
+            try:
+                return send(phone, message, *args, **kwargs)
+            finally:
+                with lock:
+                    durations.append(time.perf_counter() - start)
+        worker.bot.send_message_result = timed
+    return durations
+
+
+def bench_bulk(client, durations, messages, timeout):
+    csv = "phone,name\n" + "\n".join(f"98{i:08d},Customer {i}" for i in range(messages))
+    durations.clear()
+    start = time.perf_counter()
+    reply = client.post('/send_message_bulk', data={
+        'message': 'Hello {name}, this is a benchmark message',
+        'file': (io.BytesIO(csv.encode()), 'bench.csv')
+    }).get_json()
+    if not reply.get("success"):
+        raise RuntimeError(f"Bulk send did not start: {reply}")
+    job = wait_for_job(client, reply["job_id"], timeout)
+    elapsed = time.perf_counter() - start
+    return dict({
+        "recipients": messages,
+        "sent": job["sent"],
+        "failed": job["failed"],
+        "seconds": round(elapsed, 3),
+        "messages_per_minute": round(job["sent"] / elapsed * 60, 1)
+    }, **percentiles(durations))
+
+
+def bench_single(client, requests):
+    latencies = []
+    sent = 0
+    start = time.perf_counter()
+    for i in range(requests):
+        request_start = time.perf_counter()
+        reply = client.post('/send_message', data={'phone': f"97{i:08d}", 'message': 'Single benchmark message'})
+        latencies.append(time.perf_counter() - request_start)
+        sent += bool(reply.get_json().get("success"))
+    elapsed = time.perf_counter() - start
+    return dict({
+        "requests": requests,
+        "sent": sent,
+        "messages_per_minute": round(sent / elapsed * 60, 1)
+    }, **percentiles(latencies))
+
+
+def bench_ingest(workdir, csv_rows, xlsx_rows):
+    results = {}
+    csv_path = os.path.join(workdir, 'ingest.csv')
+    pd.DataFrame({
+        'phone': phone_values(csv_rows),
+        'name': [f"Customer {i}" for i in range(csv_rows)],
+        'group': ['Group A', 'Group B'] * (csv_rows // 2) + ['Group A'] * (csv_rows % 2)
+    }).to_csv(csv_path, index=False)
+
+    xlsx_path = os.path.join(workdir, 'ingest.xlsx')
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet()
+    sheet.append(['phone', 'name', 'group'])
+    for i, phone in enumerate(phone_values(xlsx_rows, seed=1)):
+        sheet.append([phone, f"Customer {i}", 'Group A'])
+    wb.save(xlsx_path)
+
+    for kind, path, rows in (('csv', csv_path, csv_rows), ('xlsx', xlsx_path, xlsx_rows)):
+        start = time.perf_counter()
+        stream = RecipientStream(path).open()
+        valid = sum(1 for _ in stream)
+        elapsed = time.perf_counter() - start
+        results[kind] = {
+            "rows": rows,
+            "valid": valid,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(rows / elapsed)
+        }
+    return results
+
+
+def bench_phone_format(rows):
+    values = phone_values(rows, seed=2)
+    start = time.perf_counter()
+    for value in values:
+        format_phone_number(value)
+    scalar = time.perf_counter() - start
+
+    series = pd.Series(values, dtype=object)
+    start = time.perf_counter()
+    normalize_phone_series(series)
+    vectorized = time.perf_counter() - start
+    return {
+        "values": rows,
+        "format_phone_number_per_second": round(rows / scalar),
+        "normalize_phone_series_rows_per_second": round(rows / vectorized)
+    }
+
+
+def bench_tracking_log(app, total, steps):
+    # Appends in steps, each drained to SQLite before the next, so the cost can be read against the log size.
+    # The caller pays for queueing; the writer thread pays for the SQLite inserts (batching waits excluded).
+    step = max(total // steps, 1)
+    writer = app.log_writer
+    points = []
+    for _ in range(steps):
+        size = app.tracking_store.count()
+        written, flush_ms = writer.records_written, writer.total_flush_ms
+        start = time.perf_counter()
+        for i in range(step):
+            app.update_tracking_log(f"91{i:010d}", "text", "Tracking log benchmark", "success")
+        enqueued = time.perf_counter() - start
+        writer.flush(timeout=60)
+        stored = writer.records_written - written
+        points.append({
+            "log_records": size,
+            "appended": step,
+            "enqueue_us_per_record": round(enqueued / step * 1e6, 2),
+            "insert_us_per_record": round((writer.total_flush_ms - flush_ms) * 1000 / stored, 2) if stored else None
+        })
+    return {"points": points}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=500, help="recipients of the bulk send")
+    parser.add_argument('--sessions', type=int, default=2)
+    parser.add_argument('--single', type=int, default=100, help="/send_message requests")
+    parser.add_argument('--latency-ms', type=float, default=20, help="fake WhatsApp acknowledgement delay")
+    parser.add_argument('--jitter-ms', type=float, default=5)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--invalid-rate', type=float, default=0.0)
+    parser.add_argument('--csv-rows', type=int, default=200000)
+    parser.add_argument('--xlsx-rows', type=int, default=20000)
+    parser.add_argument('--format-rows', type=int, default=200000)
+    parser.add_argument('--log-records', type=int, default=50000)
+    parser.add_argument('--log-steps', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=600, help="seconds to wait for the bulk send")
+    parser.add_argument('--output', help="also write the JSON results to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    fake = FakeWhatsAppServer(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, timeout_rate=args.timeout_rate,
+        invalid_rate=args.invalid_rate, seed=0
+    ).start()
+    workdir = tempfile.mkdtemp(prefix='whatsapp-bench-')
+    os.environ.update({
+        'SEND_TRANSPORT': 'http',
+        'WHATSAPP_WEB_URL': fake.url,
+        'SEND_RATE_PER_MINUTE': '0',
+        'RETRY_BASE_DELAY': '0.5'
+    })
+    results = {}
+    started_at = datetime.now().isoformat(timespec='seconds')
+    try:
+        # The app keeps its databases and folders in the working directory
+        os.chdir(workdir)
+        with contextlib.redirect_stdout(sys.stderr):
+            import app
+
+            client = app.app.test_client()
+            reply = client.post('/init', data={'sessions': args.sessions}).get_json()
+            if not reply.get("success"):
+                raise RuntimeError(f"Sessions did not start: {reply}")
+            durations = record_send_latency(app.bot_pool)
+
+            results["bulk"] = bench_bulk(client, durations, args.messages, args.timeout)
+            results["single"] = bench_single(client, args.single)
+            results["ingest"] = bench_ingest(workdir, args.csv_rows, args.xlsx_rows)
+            results["phone_format"] = bench_phone_format(args.format_rows)
+            results["tracking_log"] = bench_tracking_log(app, args.log_records, args.log_steps)
+            results["fake_whatsapp"] = fake.stats()
+
+            app.close_sessions()
+            app.log_writer.close()
+    finally:
+        fake.stop()
+        os.chdir(REPO)
+        if args.keep:
+            print(f"Scratch directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": vars(args)
+        },
+        "results": results
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark: full-column regex scan vs sampled scoring for phone column detection
+
+Builds a wide synthetic upload (text, date, SKU, order and amount columns
+with one formatted phone column near the end and no recognizable header),
+then times the previous find_phone_column, which runs a regex over every
+full text column until one matches, against detect_phone_column, which
+scores a bounded sample of each column. Reports the column each picks and the
+confidence of the sampled detection.
+
+Usage: python benchmarks/bench_phone_column_detection.py [--rows 1000000] [--columns 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from phone_utils import PHONE_COLUMN_NAMES, detect_phone_column  # noqa: E402
+
+PHONE_COLUMN = 'whatsapp_contact'
+
+
+def make_frame(rows, columns, seed=0):
+    rng = np.random.default_rng(seed)
+    words = np.array(['alpha', 'bravo delta', 'Pune', 'Mumbai', 'pending', 'shipped', 'N/A'], dtype=object)
+    dates = np.array([f"2024-{m:02d}-{d:02d}" for m in range(1, 13) for d in range(1, 29)], dtype=object)
+    skus = np.array([f"SKU-{i:05d}" for i in range(500)], dtype=object)
+    orders = np.array([f"ORD-{i}" for i in range(100000, 200000)], dtype=object)
+    amounts = np.array([f"{i / 100:.2f}" for i in range(100000)], dtype=object)
+
+    # Values are drawn from small pools so the frame holds references, not 200M strings
+    data = {}
+    for i in range(columns - 1):
+        kind = i % 5
+        if kind == 0:
+            data[f"note_{i}"] = words[rng.integers(0, len(words), rows)]
+        elif kind == 1:
+            data[f"date_{i}"] = dates[rng.integers(0, len(dates), rows)]
+        elif kind == 2:
+            data[f"sku_{i}"] = skus[rng.integers(0, len(skus), rows)]
+        elif kind == 3:
+            data[f"order_{i}"] = orders[rng.integers(0, len(orders), rows)]
+        else:
+            data[f"amount_{i}"] = amounts[rng.integers(0, len(amounts), rows)]
+
+    local = rng.integers(6000000000, 9999999999, rows)
+    formats = rng.integers(0, 3, rows)
+    phones = np.array([
+        f"+91 {n // 100000} {n % 100000:05d}" if f == 0 else (f"0{n}" if f == 1 else str(n))
+        for n, f in zip(local.tolist(), formats.tolist())
+    ], dtype=object)
+    # The phone column sits near the end, as in exports with many leading fields
+    names = list(data)
+    position = len(names) - 5
+    frame = {name: data[name] for name in names[:position]}
+    frame[PHONE_COLUMN] = phones
+    frame.update({name: data[name] for name in names[position:]})
+    return pd.DataFrame(frame)
+
+
+def legacy_find_phone_column(df):
+    # find_phone_column before sampling: header match, then full-column scans
+    for col in df.columns:
+        if col.lower().replace(' ', '_') in PHONE_COLUMN_NAMES:
+            return col
+    for col in df.columns:
+        if df[col].dtype in ['int64', 'float64'] or \
+           (df[col].dtype == 'object' and df[col].str.contains(r'^\d+$|^\d+\.\d+e\+\d+$', na=True).any()):
+            return col
+    return df.columns[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--columns', type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = make_frame(args.rows, args.columns)
+    print(f"Built {args.rows:,} x {len(df.columns)} frame in {time.perf_counter() - start:.1f}s "
+          f"(phone column: {PHONE_COLUMN})")
+
+    start = time.perf_counter()
+    legacy = legacy_find_phone_column(df)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    column, confidence = detect_phone_column(df)
+    sampled_time = time.perf_counter() - start
+
+    print(f"{'method':<10}{'seconds':>10}  column")
+    print(f"{'legacy':<10}{legacy_time:>10.3f}  {legacy}")
+    print(f"{'sampled':<10}{sampled_time:>10.3f}  {column} (confidence {confidence})")
+    print(f"Speedup: {legacy_time / sampled_time:.1f}x")
+    if column != PHONE_COLUMN:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
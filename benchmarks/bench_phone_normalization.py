@@ -0,0 +1,87 @@
+"""
+Benchmark: scalar format_phone_number loop vs normalize_phone_series
+
+Builds synthetic phone columns in the shapes pandas produces for uploads
+(float64 with scientific notation and NaN, int64, and mixed-format strings),
+checks that both implementations agree row for row, and reports the speedup.
+
+Usage: python benchmarks/bench_phone_normalization.py [--rows 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from phone_utils import format_phone_number, normalize_phone_series  # noqa: E402
+
+
+def make_columns(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    local = rng.integers(6000000000, 9999999999, rows)
+
+    # float64: full numbers, local numbers, some garbage and missing values
+    floats = np.where(rng.random(rows) < 0.5, 910000000000 + local, local).astype(float)
+    floats[rng.random(rows) < 0.02] = np.nan
+    floats[rng.random(rows) < 0.01] = 12345678901.0
+
+    ints = np.where(rng.random(rows) < 0.5, 910000000000 + local, local)
+
+    # Strings in the formats the README lists
+    formats = np.array([
+        '{}', '91{}', '+91{}', '0{}', '+91 {} ', '91-{}', '{}.0'
+    ], dtype=object)
+    picks = formats[rng.integers(0, len(formats), rows)]
+    strings = [fmt.format(n) for fmt, n in zip(picks, local.tolist())]
+    for i in rng.integers(0, rows, rows // 50):
+        strings[i] = ''
+    for i in rng.integers(0, rows, rows // 100):
+        strings[i] = 'n/a'
+
+    return {
+        'float64': pd.Series(floats),
+        'int64': pd.Series(ints),
+        'object': pd.Series(strings, dtype=object),
+    }
+
+
+def scalar_normalize(series):
+    # The loop send_message_bulk used before normalize_phone_series
+    phones = []
+    invalid_numbers = []
+    for idx, number in enumerate(series):
+        formatted_number = format_phone_number(number)
+        phones.append(formatted_number)
+        if not formatted_number:
+            invalid_numbers.append(f"Row {idx + 2}: {number}")
+    return phones, invalid_numbers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(f"Rows per column: {args.rows:,}")
+    print(f"{'dtype':<10}{'scalar s':>12}{'vector s':>12}{'speedup':>10}{'invalid':>10}  match")
+    for name, series in make_columns(args.rows).items():
+        start = time.perf_counter()
+        expected, expected_invalid = scalar_normalize(series)
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        formatted, invalid_numbers = normalize_phone_series(series)
+        vector_time = time.perf_counter() - start
+
+        match = formatted.tolist() == expected and invalid_numbers == expected_invalid
+        print(f"{name:<10}{scalar_time:>12.3f}{vector_time:>12.3f}{scalar_time / vector_time:>9.1f}x"
+              f"{len(invalid_numbers):>10}  {'yes' if match else 'NO'}")
+        if not match:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
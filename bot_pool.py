@@ -0,0 +1,339 @@
+import contextlib
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class PoolWorker:
+    """One WhatsAppBot session in the pool, with its in-flight sends and counters"""
+
+    def __init__(self, index, bot, limiter=None):
+        self.index = index
+        self.bot = bot
+        self.limiter = limiter
+        self.ready = False
+        # In-flight sends of every dispatch using this session (owned by the dispatches)
+        self.sends = []
+        self.sent = 0
+        self.failed = 0
+        self.reassigned = 0
+        self.busy_seconds = 0.0
+        self.requeued = 0
+        # Session health, maintained by a SessionMonitor
+        self.health = None
+        self.last_probe_at = None
+        self.loading_probes = 0
+        self.down_since = None
+        self.restarts = 0
+        self.restart_failures = 0
+        self.last_restart_reason = None
+        self.recoveries = 0
+        self.last_recovery_seconds = None
+        self.total_recovery_seconds = 0.0
+
+    @property
+    def current(self):
+        """The number this session is sending to (holding its lock), if any"""
+        return next((send["phone"] for send in list(self.sends) if send["started"] is not None), None)
+
+    @property
+    def stalled(self):
+        return any(send["stalled"] for send in list(self.sends))
+
+    def stats(self):
+        processed = self.sent + self.failed
+        return {
+            "worker": self.index,
+            "profile_dir": getattr(self.bot, 'profile_dir', None),
+            "transport": getattr(getattr(self.bot, 'transport', None), 'name', None),
+            "ready": self.ready,
+            "stalled": self.stalled,
+            "current": self.current,
+            "sent": self.sent,
+            "failed": self.failed,
+            "reassigned": self.reassigned,
+            "avg_send_seconds": round(self.busy_seconds / processed, 3) if processed else None,
+            "requeued": self.requeued,
+            "health": {
+                "state": self.health,
+                "last_probe_at": datetime.fromtimestamp(self.last_probe_at).isoformat() if self.last_probe_at else None,
+                "down_seconds": round(time.monotonic() - self.down_since, 1) if self.down_since is not None else None,
+                "restarts": self.restarts,
+                "restart_failures": self.restart_failures,
+                "last_restart_reason": self.last_restart_reason,
+                "recoveries": self.recoveries,
+                "last_recovery_seconds": round(self.last_recovery_seconds, 1) if self.last_recovery_seconds is not None else None,
+                "avg_recovery_seconds": round(self.total_recovery_seconds / self.recoveries, 1) if self.recoveries else None
+            },
+            "navigation": self.bot.navigation_stats() if hasattr(self.bot, 'navigation_stats') else {},
+            "memory": self.bot.memory_stats() if hasattr(self.bot, 'memory_stats') else None,
+            "rate": self.limiter.stats() if self.limiter else None
+        }
+
+
+class BotPool:
+    """
+    A pool of WhatsAppBot sessions sharing campaign work
+
+    Each worker has its own Chrome profile directory (and so its own linked
+    WhatsApp Web session). dispatch() feeds recipients into a shared queue
+    that idle workers pull from, so faster sessions naturally take more
+    work. A worker whose current send runs longer than stall_timeout (counted
+    from when it holds the session's lock) is taken out of rotation and its
+    recipient handed to another worker; it rejoins once its send returns,
+    and if that send succeeded it stands and the hand-over is dropped. With
+    a SessionMonitor attached, a worker whose browser died or was logged out
+    puts its recipient back and waits until the monitor has brought the
+    session back, and a dispatch started while every session is down waits
+    for one rather than failing. limiter_factory, if given, returns the
+    AdaptiveRateLimiter pacing each worker's sends.
+    """
+
+    def __init__(self, bot_factory, size=1, stall_timeout=120, limiter_factory=None):
+        self.bot_factory = bot_factory
+        self.size = size
+        self.stall_timeout = stall_timeout
+        self.limiter_factory = limiter_factory
+        self.workers = []
+        self.monitor = None
+        # (work queue, retry deque) of each dispatch in progress
+        self.backlogs = []
+
+    def start(self):
+        """Start every session in parallel; returns the number of sessions that came up"""
+        self.workers = [
+            PoolWorker(i, self.bot_factory(i), self.limiter_factory(i) if self.limiter_factory else None)
+            for i in range(self.size)
+        ]
+
+        def setup(worker):
+            try:
+                worker.ready = bool(worker.bot.setup_driver())
+            except Exception as e:
+                print(f"Error starting session {worker.index}: {str(e)}")
+                worker.ready = False
+
+        threads = [threading.Thread(target=setup, args=(worker,), daemon=True) for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ready = self.ready_workers()
+        print(f"{len(ready)} of {self.size} WhatsApp sessions ready")
+        return len(ready)
+
+    def ready_workers(self):
+        return [worker for worker in self.workers if worker.ready]
+
+    @property
+    def primary(self):
+        """The first ready session, used for single sends"""
+        ready = self.ready_workers()
+        return ready[0].bot if ready else None
+
+    def worker_for(self, bot):
+        return next((worker for worker in self.workers if worker.bot is bot), None)
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker.bot.close()
+            except Exception as e:
+                print(f"Error closing session {worker.index}: {str(e)}")
+            worker.ready = False
+
+    def stats(self):
+        return [worker.stats() for worker in self.workers]
+
+    def queue_depth(self):
+        """Recipients queued for a session across the dispatches in progress (not yet taken by a worker)"""
+        return sum(work.qsize() + len(retry) for work, retry in list(self.backlogs))
+
+    def dispatch(self, recipients, message, gate=None, media=None):
+        """
+        Send message to every recipient across the ready workers
+        A recipient is a phone number or a (phone, message) pair carrying its
+        own (personalized) message; with media (a MediaCache entry) every
+        recipient gets that image, the message being its caption. Yields
+        result dicts as sends complete (not in input order). gate() is called
+        before each recipient is queued, and polled while recipients wait for
+        a session; it may block (pause) and returns False to cancel:
+        recipients not taken by a session yet are dropped, and the sends in
+        progress are reported before dispatch() returns.
+        """
+        if not self.ready_workers() and not self.monitor:
+            raise RuntimeError("No WhatsApp sessions are ready")
+        # Sessions that are down now may be recovered while the campaign runs: with a monitor,
+        # recipients wait for one even if none is ready yet (e.g. a retry pass after an outage)
+        workers = self.workers if self.monitor else self.ready_workers()
+
+        # Work items are (ticket, phone) so repeated numbers stay distinct
+        work = queue.Queue(maxsize=len(workers) * 2)
+        retry = deque()
+        results = queue.Queue()
+        # Worker responsible for each ticket not settled yet (None while it waits in retry)
+        owners = {}
+        # This dispatch's sends in progress
+        active = []
+        lock = threading.Lock()
+        state = {"feeding": True, "outstanding": 0, "stop": False}
+        backlog = (work, retry)
+        self.backlogs.append(backlog)
+
+        def cancelled():
+            # Sets the stop flag the workers' waits check, so a cancel does not wait for a session
+            if gate and not state["stop"] and not gate():
+                state["stop"] = True
+            return state["stop"]
+
+        def feed():
+            try:
+                for ticket, recipient in enumerate(recipients):
+                    if cancelled():
+                        break
+                    with lock:
+                        state["outstanding"] += 1
+                    while True:
+                        try:
+                            work.put((ticket, recipient), timeout=0.5)
+                            break
+                        except queue.Full:
+                            if cancelled():
+                                break
+                    if state["stop"]:
+                        break
+            except Exception as e:
+                results.put(e)
+            finally:
+                with lock:
+                    state["feeding"] = False
+            # Queued recipients may still be waiting for a session that is down
+            while not cancelled():
+                with lock:
+                    if state["outstanding"] == 0:
+                        return
+                time.sleep(0.5)
+
+        def next_item(worker):
+            while not state["stop"]:
+                with lock:
+                    if retry:
+                        item = retry.popleft()
+                        owners[item[0]] = worker
+                        return item
+                    if not state["feeding"] and state["outstanding"] == 0:
+                        return None
+                try:
+                    item = work.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                with lock:
+                    owners[item[0]] = worker
+                return item
+            return None
+
+        def run(worker):
+            session_lock = getattr(worker.bot, 'lock', None) or contextlib.nullcontext()
+            while True:
+                while not worker.ready and not state["stop"]:
+                    time.sleep(0.5)
+                # Wait for a send slot before taking a recipient, so it stays available to idle workers
+                if worker.limiter:
+                    while not state["stop"] and not worker.limiter.acquire(timeout=0.5):
+                        pass
+                item = next_item(worker)
+                if item is None:
+                    return
+                ticket, recipient = item
+                phone, text = recipient if isinstance(recipient, tuple) else (recipient, message)
+                send = {"worker": worker, "ticket": ticket, "item": item, "phone": phone, "started": None,
+                        "stalled": False}
+                with lock:
+                    if state["stop"]:
+                        return
+                    active.append(send)
+                    worker.sends.append(send)
+
+                with session_lock:
+                    # Time spent waiting for another dispatch's send does not count towards a stall
+                    send["started"] = started = time.monotonic()
+                    result = worker.bot.send_message_result(phone, text, **({"media": media} if media else {}))
+                elapsed = time.monotonic() - started
+                lost = result.get("status") != "success" and self.monitor is not None and self.monitor.session_lost(worker)
+                if worker.limiter and not lost:
+                    worker.limiter.report(result.get("status") == "success", elapsed)
+
+                with lock:
+                    worker.busy_seconds += elapsed
+                    active.remove(send)
+                    worker.sends.remove(send)
+                    if ticket not in owners:
+                        # The other attempt at a reassigned recipient already settled it
+                        continue
+                    if owners[ticket] is not worker:
+                        # Reassigned while stalled: a late success stands and the hand-over is dropped
+                        # (or its result ignored, if another worker is already sending it)
+                        if result.get("status") != "success":
+                            continue
+                        if item in retry:
+                            retry.remove(item)
+                    elif lost:
+                        # The session went away, not the recipient: send it again
+                        worker.requeued += 1
+                        owners[ticket] = None
+                        retry.appendleft(item)
+                        continue
+                    del owners[ticket]
+                    if result.get("status") == "success":
+                        worker.sent += 1
+                    else:
+                        worker.failed += 1
+                    result["worker"] = worker.index
+                    results.put(result)
+                    state["outstanding"] -= 1
+
+        feeder = threading.Thread(target=feed, name='pool-feeder', daemon=True)
+        feeder.start()
+        for worker in workers:
+            threading.Thread(target=run, args=(worker,), name=f'pool-worker-{worker.index}', daemon=True).start()
+
+        try:
+            while True:
+                try:
+                    item = results.get(timeout=min(1.0, self.stall_timeout / 4))
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+                except queue.Empty:
+                    pass
+
+                with lock:
+                    self._reassign_stalled(active, owners, retry)
+                    if state["stop"]:
+                        # Cancelled: report the sends in progress, leaving the stalled ones behind
+                        done = all(send["stalled"] for send in active)
+                    else:
+                        done = not state["feeding"] and state["outstanding"] == 0
+                if done and results.empty():
+                    break
+        finally:
+            state["stop"] = True
+            self.backlogs.remove(backlog)
+
+    def _reassign_stalled(self, active, owners, retry):
+        # Caller holds the dispatch lock
+        now = time.monotonic()
+        for send in active:
+            if send["stalled"] or send["started"] is None or now - send["started"] <= self.stall_timeout:
+                continue
+            worker = send["worker"]
+            if owners.get(send["ticket"]) is not worker:
+                continue
+            print(f"Session {worker.index} stalled on {send['phone']}; reassigning")
+            send["stalled"] = True
+            worker.reassigned += 1
+            owners[send["ticket"]] = None
+            retry.append(send["item"])
@@ -0,0 +1,249 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+COMPLETED = 'completed'
+FAILED = 'failed'
+FINISHED_STATES = (CANCELLED, COMPLETED, FAILED)
+
+# Per-recipient results kept for results_since(); older ones are only counted
+RESULT_HISTORY = 10000
+
+
+class CampaignJob:
+    """
+    A bulk send running in a background thread
+
+    recipients is any iterable of phone numbers (it may still be reading the
+    upload while the job sends), send_func(phone, message) returns a result
+    dict with at least "phone" and "status". total is an int or a callable
+    returning the current estimate of the number of recipients, or None.
+    source is the object the recipients are read from (e.g. a RecipientStream);
+    its close() is called when the job ends. dispatch, if given, replaces the
+    one-at-a-time loop over send_func: dispatch(recipients, message, gate)
+    yields result dicts and calls gate() before taking each recipient
+    (see BotPool.dispatch). checkpoint, if given, has record(result) called
+    for every result and finish(state) once the job ends (see
+    CampaignCheckpoint). results_since() pages through the results in
+    the order they arrived, for clients polling the job.
+    """
+
+    def __init__(self, recipients, message, send_func=None, total=None, source=None, dispatch=None, job_id=None,
+                 checkpoint=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.recipients = recipients
+        self.source = source
+        self.checkpoint = checkpoint
+        self.message = message
+        self.send_func = send_func
+        self.dispatch = dispatch or self._send_each
+        self.total = total
+        self.state = QUEUED
+        self.error = None
+
+        self.sent = 0
+        self.failed = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.paused_seconds = 0.0
+        self.paused_at = None
+        self.recent_results = deque(maxlen=50)
+        self.results = deque(maxlen=RESULT_HISTORY)
+
+        self.cond = threading.Condition()
+        self.version = 0
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+        self.cancel_requested = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f'campaign-{self.id[:8]}', daemon=True)
+        self.thread.start()
+        return self
+
+    def pause(self):
+        with self.cond:
+            if self.state not in (QUEUED, RUNNING):
+                return False
+            self.resume_event.clear()
+            self.state = PAUSED
+            self.paused_at = time.time()
+            self._changed()
+        return True
+
+    def resume(self):
+        with self.cond:
+            if self.state != PAUSED:
+                return False
+            self.paused_seconds += time.time() - self.paused_at
+            self.paused_at = None
+            self.state = RUNNING if self.started_at else QUEUED
+            self.resume_event.set()
+            self._changed()
+        return True
+
+    def cancel(self):
+        """Stop after the recipient currently being sent"""
+        with self.cond:
+            if self.state in FINISHED_STATES:
+                return False
+            self.cancel_requested = True
+            self.resume_event.set()
+            self._changed()
+        return True
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def status(self):
+        with self.cond:
+            processed = self.sent + self.failed
+            total = self.total() if callable(self.total) else self.total
+            if self.finished and self.state == COMPLETED:
+                total = processed
+            pending = max(total - processed, 0) if total is not None else None
+
+            elapsed = 0.0
+            if self.started_at:
+                end = self.finished_at or time.time()
+                paused = self.paused_seconds + (time.time() - self.paused_at if self.paused_at else 0.0)
+                elapsed = max(end - self.started_at - paused, 0.0)
+            per_minute = processed / elapsed * 60 if elapsed > 0 else 0.0
+            eta = pending / (per_minute / 60) if pending is not None and per_minute > 0 else None
+
+            return {
+                "job_id": self.id,
+                "state": self.state,
+                "total": total,
+                "sent": self.sent,
+                "failed": self.failed,
+                "pending": pending,
+                "messages_per_minute": round(per_minute, 2),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+                "elapsed_seconds": round(elapsed, 1),
+                "error": self.error,
+                "recent_results": list(self.recent_results)
+            }
+
+    def results_since(self, cursor=0, limit=100):
+        """
+        Results after the first cursor ones (in arrival order), at most limit
+        Returns (results, next cursor, number of results after cursor no longer kept).
+        """
+        with self.cond:
+            processed = self.sent + self.failed
+            oldest = processed - len(self.results)
+            start = min(max(cursor, oldest), processed)
+            results = list(itertools.islice(self.results, start - oldest, start - oldest + limit))
+            return results, start + len(results), start - min(cursor, start)
+
+    def wait_for_change(self, version, timeout):
+        """Block until the job changes past version or timeout expires; returns the new version"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def _gate(self):
+        # Blocks while paused; False once cancelled
+        self.resume_event.wait()
+        return not self.cancel_requested
+
+    def _send_each(self, recipients, message, gate):
+        for phone in recipients:
+            if not gate():
+                break
+            yield self.send_func(phone, message)
+
+    def _changed(self):
+        # Caller must hold self.cond
+        self.version += 1
+        self.cond.notify_all()
+
+    def _run(self):
+        with self.cond:
+            if not self.cancel_requested and self.state == QUEUED:
+                self.state = RUNNING
+            self.started_at = time.time()
+            self._changed()
+        try:
+            results = self.dispatch(self.recipients, self.message, self._gate)
+            try:
+                for result in results:
+                    with self.cond:
+                        if result.get("status") == "success":
+                            self.sent += 1
+                        else:
+                            self.failed += 1
+                        self.recent_results.append(result)
+                        self.results.append(result)
+                        self._changed()
+                    if self.checkpoint:
+                        self.checkpoint.record(result)
+                    if self.cancel_requested:
+                        break
+            finally:
+                close = getattr(results, 'close', None)
+                if close:
+                    close()
+            final_state = CANCELLED if self.cancel_requested else COMPLETED
+        except Exception as e:
+            print(f"Error in campaign {self.id}: {str(e)}")
+            self.error = str(e)
+            final_state = FAILED
+        finally:
+            for owner in (self.recipients, self.source):
+                close = getattr(owner, 'close', None)
+                if close:
+                    close()
+            if self.checkpoint:
+                try:
+                    self.checkpoint.finish(final_state)
+                except Exception as e:
+                    print(f"Error saving campaign {self.id}: {str(e)}")
+
+        with self.cond:
+            if self.paused_at:
+                self.paused_seconds += time.time() - self.paused_at
+                self.paused_at = None
+            self.state = final_state
+            self.finished_at = time.time()
+            self._changed()
+
+
+class JobManager:
+    """Registry of campaign jobs, keeping the most recent max_jobs"""
+
+    def __init__(self, max_jobs=100):
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            # Forget the oldest finished jobs
+            for job_id in list(self.jobs):
+                if len(self.jobs) <= self.max_jobs:
+                    break
+                if self.jobs[job_id].finished:
+                    del self.jobs[job_id]
+        return job.start()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.status() for job in jobs]
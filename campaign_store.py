@@ -0,0 +1,326 @@
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+from campaign_jobs import COMPLETED
+from retry_engine import INVALID_NUMBER
+
+# Campaign states; a campaign that was still running when the process died is
+# marked interrupted on the next start
+RUNNING = 'running'
+INTERRUPTED = 'interrupted'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    message TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    file_path TEXT,
+    state TEXT NOT NULL,
+    audience TEXT,
+    media TEXT
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    idempotency_key TEXT PRIMARY KEY,
+    campaign_id TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_deliveries_campaign ON deliveries (campaign_id, status);
+"""
+
+CAMPAIGN_COLUMNS = [
+    'id', 'created_at', 'updated_at', 'message', 'content_hash', 'file_path', 'state', 'audience', 'media'
+]
+
+
+def content_hash(message, media=None):
+    """Short digest of a message text (and the key of its image, if any), part of every idempotency key"""
+    content = f"{message}\nmedia:{media}" if media else message
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+
+def idempotency_key(phone, digest):
+    """
+    The same normalized number and the same message always give the same key
+    Keys are not scoped to a campaign: a number that already received exactly
+    this text (and image) from any campaign is not sent it again, while a
+    later campaign with the same template but different fields is.
+    """
+    return f"{phone}:{digest}"
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CampaignStore:
+    """
+    Durable campaign checkpoints in SQLite (WAL mode)
+
+    deliveries holds one row per idempotency key (normalized phone plus
+    message hash) with the outcome of its last attempt. Whether a recipient
+    is already done is a primary key lookup, so skipping completed
+    recipients costs the same per row however large the history is.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        # Databases created before campaigns could target saved contacts
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(campaigns)')}
+        if 'audience' not in columns:
+            self.conn.execute('ALTER TABLE campaigns ADD COLUMN audience TEXT')
+        # ... or before image campaigns
+        if 'media' not in columns:
+            self.conn.execute('ALTER TABLE campaigns ADD COLUMN media TEXT')
+
+    def create(self, message, file_path=None, campaign_id=None, audience=None, media=None):
+        """
+        audience is the contact store selection ({"segment", "groups", "tags"}) sent to instead of an upload
+        media is the MediaCache key of the image sent to every recipient, message being its caption.
+        """
+        campaign_id = campaign_id or uuid.uuid4().hex
+        now = _now()
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO campaigns (id, created_at, updated_at, message, content_hash, file_path, state, audience, '
+                'media) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (campaign_id, now, now, message, content_hash(message, media), file_path, RUNNING,
+                 json.dumps(audience) if audience else None, media)
+            )
+        return self.get(campaign_id)
+
+    def get(self, campaign_id):
+        with self.lock:
+            row = self.conn.execute(
+                f'SELECT {", ".join(CAMPAIGN_COLUMNS)} FROM campaigns WHERE id = ?', (campaign_id,)
+            ).fetchone()
+        return self._campaign(row) if row else None
+
+    def list(self, limit=50):
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT {", ".join(CAMPAIGN_COLUMNS)} FROM campaigns ORDER BY created_at DESC LIMIT ?', (int(limit),)
+            ).fetchall()
+        return [self._campaign(row) for row in rows]
+
+    def update(self, campaign_id, **fields):
+        """Set state, file_path and/or audience of a campaign"""
+        fields = {key: value for key, value in fields.items() if key in ('state', 'file_path', 'audience')}
+        if fields.get('audience'):
+            fields['audience'] = json.dumps(fields['audience'])
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self.lock:
+            self.conn.execute(
+                f'UPDATE campaigns SET {assignments}, updated_at = ? WHERE id = ?',
+                list(fields.values()) + [_now(), campaign_id]
+            )
+
+    def mark_interrupted(self):
+        """Flag campaigns left running by a previous process; returns how many there were"""
+        with self.lock:
+            return self.conn.execute(
+                'UPDATE campaigns SET state = ?, updated_at = ? WHERE state = ?', (INTERRUPTED, _now(), RUNNING)
+            ).rowcount
+
+    def completed_keys(self, keys):
+        """The subset of keys already sent successfully (or whose number is not on WhatsApp)"""
+        done = set()
+        keys = list(keys)
+        with self.lock:
+            # Stay below SQLite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                done.update(key for (key,) in self.conn.execute(
+                    f"SELECT idempotency_key FROM deliveries "
+                    f"WHERE idempotency_key IN ({placeholders}) AND status IN ('success', 'invalid_number')",
+                    batch
+                ))
+        return done
+
+    def begin_run(self):
+        """
+        Start tracking the numbers taken by one run of a campaign; returns the run's table
+        A temporary table keeps them (with their idempotency keys) on disk, so
+        deduplicating a run costs no memory per recipient.
+        """
+        table = f"run_{uuid.uuid4().hex}"
+        with self.lock:
+            self.conn.execute(
+                f'CREATE TEMP TABLE {table} (phone TEXT PRIMARY KEY, idempotency_key TEXT NOT NULL) WITHOUT ROWID'
+            )
+        return table
+
+    def claim(self, table, pairs):
+        """Add (phone, key) pairs to a run; returns, per pair, whether the number was new to the run"""
+        claimed = []
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                for phone, key in pairs:
+                    cursor = self.conn.execute(f'INSERT OR IGNORE INTO {table} VALUES (?, ?)', (phone, key))
+                    claimed.append(cursor.rowcount == 1)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return claimed
+
+    def run_key(self, table, phone):
+        """The idempotency key a run claimed phone with, or None"""
+        with self.lock:
+            row = self.conn.execute(f'SELECT idempotency_key FROM {table} WHERE phone = ?', (phone,)).fetchone()
+        return row[0] if row else None
+
+    def end_run(self, table):
+        with self.lock:
+            self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+    def record(self, campaign_id, phone, key, status):
+        """Checkpoint the outcome of one send; committed before returning"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO deliveries (idempotency_key, campaign_id, phone, status, attempts, updated_at) '
+                'VALUES (?, ?, ?, ?, 1, ?) '
+                'ON CONFLICT (idempotency_key) DO UPDATE SET '
+                'campaign_id = excluded.campaign_id, status = excluded.status, '
+                'attempts = attempts + 1, updated_at = excluded.updated_at',
+                (key, campaign_id, phone, status, _now())
+            )
+
+    def counts(self, campaign_id):
+        """Recipients checkpointed by a campaign, per status"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT status, COUNT(*) FROM deliveries WHERE campaign_id = ? GROUP BY status', (campaign_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def _campaign(row):
+        campaign = dict(zip(CAMPAIGN_COLUMNS, row))
+        campaign['audience'] = json.loads(campaign['audience']) if campaign['audience'] else None
+        return campaign
+
+
+class CampaignCheckpoint:
+    """
+    One run of a campaign, as seen by a CampaignJob
+
+    pending() filters the recipient stream: numbers repeated within the run
+    and numbers already sent this message (by this or an earlier campaign)
+    are skipped. A personalized message is keyed by the text rendered for
+    each recipient, not by its template. The run's numbers are kept in a
+    temporary table created when pending() first reads the stream, so a
+    job that never starts leaves none behind. record() checkpoints each
+    result as it arrives, and finish() drops the table and stores the final
+    state, removing the upload once every recipient was sent (otherwise it
+    is kept so the campaign can be resumed).
+    """
+
+    def __init__(self, store, campaign, batch_size=500):
+        self.store = store
+        self.campaign = campaign
+        self.id = campaign['id']
+        self.digest = campaign['content_hash']
+        self.media = campaign.get('media')
+        self.batch_size = batch_size
+        # Numbers taken by this run, in SQLite rather than memory; the lock keeps the
+        # feeding thread from claiming into the table while finish() drops it
+        self.run = None
+        self.finished = False
+        self.lock = threading.Lock()
+        self.skipped_done = 0
+        self.skipped_duplicates = 0
+        self.failed = 0
+
+    @property
+    def skipped(self):
+        return self.skipped_done + self.skipped_duplicates
+
+    def pending(self, recipients):
+        """Recipients (phones or (phone, message) pairs) that still need this campaign's message"""
+        recipients = iter(recipients)
+        while True:
+            batch = list(itertools.islice(recipients, self.batch_size))
+            if not batch:
+                return
+            phones = [item[0] if isinstance(item, tuple) else item for item in batch]
+            keys = [self._key(phone, item) for phone, item in zip(phones, batch)]
+            claimed = self._claim(phones, keys)
+            if claimed is None:
+                # The job has finished (cancelled) while the stream was still being read
+                return
+            done = self.store.completed_keys(key for key, new in zip(keys, claimed) if new)
+            for item, key, new in zip(batch, keys, claimed):
+                if not new:
+                    self.skipped_duplicates += 1
+                    continue
+                if key in done:
+                    self.skipped_done += 1
+                    continue
+                yield item
+
+    def record(self, result):
+        phone = result.get("phone")
+        status = result.get("status")
+        if status != "success":
+            # A number that is not on WhatsApp is final; anything else is tried again on resume
+            if result.get("failure") == INVALID_NUMBER:
+                status = INVALID_NUMBER
+            else:
+                self.failed += 1
+        with self.lock:
+            key = self.store.run_key(self.run, phone) if self.run else None
+        self.store.record(self.id, phone, key or idempotency_key(phone, self.digest), status)
+
+    def _claim(self, phones, keys):
+        with self.lock:
+            if self.finished:
+                return None
+            if self.run is None:
+                self.run = self.store.begin_run()
+            return self.store.claim(self.run, zip(phones, keys))
+
+    def _key(self, phone, item):
+        if isinstance(item, tuple):
+            return idempotency_key(phone, content_hash(item[1], self.media))
+        return idempotency_key(phone, self.digest)
+
+    def finish(self, state):
+        with self.lock:
+            self.finished = True
+            if self.run:
+                self.store.end_run(self.run)
+                self.run = None
+        self.store.update(self.id, state=state)
+        file_path = self.campaign.get('file_path')
+        if state == COMPLETED and not self.failed and file_path and os.path.exists(file_path):
+            os.remove(file_path)
+
+    def stats(self):
+        return {
+            "campaign_id": self.id,
+            "skipped_already_sent": self.skipped_done,
+            "skipped_duplicates": self.skipped_duplicates
+        }
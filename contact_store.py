@@ -0,0 +1,393 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from message_template import normalize_field
+from recipient_reader import CHUNK_SIZE, RecipientStream
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    phone TEXT PRIMARY KEY,
+    name TEXT,
+    attributes TEXT NOT NULL DEFAULT '{}',
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS contact_groups (
+    group_name TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    PRIMARY KEY (group_name, phone)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_contact_groups_phone ON contact_groups (phone);
+CREATE TABLE IF NOT EXISTS contact_tags (
+    tag TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    PRIMARY KEY (tag, phone)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_contact_tags_phone ON contact_tags (phone);
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    groups TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+# Upload columns with a meaning in the store (compared as normalize_field does);
+# every other column is kept as a contact attribute for message templates
+NAME_COLUMNS = ('name', 'full_name', 'contact_name', 'customer_name')
+GROUP_COLUMNS = ('group', 'groups')
+TAG_COLUMNS = ('tag', 'tags', 'labels')
+# Stay below SQLite's bound parameter limit
+_BATCH = 500
+
+
+def split_values(text):
+    """Group/tag names from a cell or form field: "VIP; Group A" -> ['VIP', 'Group A']"""
+    if text is None or (not isinstance(text, str) and pd.isna(text)):
+        return []
+    if isinstance(text, float) and text.is_integer():
+        text = int(text)
+    return list(dict.fromkeys(value.strip() for value in re.split(r'[,;]', str(text)) if value.strip()))
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _cell_text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+
+def _json_value(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ContactStore:
+    """
+    Saved contacts in SQLite (WAL mode), keyed by normalized phone number
+
+    Group and tag memberships live in their own tables whose primary key
+    starts with the group (tag) name, so the members of a group are one
+    index range scan however many contacts the store holds. Uploads are
+    merged chunk by chunk: new numbers are added, known ones get their name
+    and attributes updated, and memberships only ever accumulate.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def merge_chunk(self, phones, rows, phone_column=None, groups=None, tags=None):
+        """
+        Merge one chunk of an upload: phones are the valid formatted numbers,
+        rows their source rows; groups/tags are added to every contact on top
+        of the upload's own group/tag columns. Returns counts of new and
+        updated contacts and of memberships added
+        """
+        lookup = {}
+        for column in rows.columns:
+            lookup.setdefault(normalize_field(column), column)
+        name_column = next((lookup[name] for name in NAME_COLUMNS if name in lookup), None)
+        group_column = next((lookup[name] for name in GROUP_COLUMNS if name in lookup), None)
+        tag_column = next((lookup[name] for name in TAG_COLUMNS if name in lookup), None)
+        attribute_columns = [
+            column for column in rows.columns
+            if column not in (phone_column, name_column, group_column, tag_column)
+        ]
+
+        phone_list = phones.tolist()
+        names = [_cell_text(value) for value in rows[name_column].tolist()] if name_column else [None] * len(rows)
+        if attribute_columns:
+            attributes = [
+                json.dumps({
+                    normalize_field(key): _json_value(value) for key, value in record.items()
+                    if _cell_text(value) is not None
+                }, default=str)
+                for record in rows[attribute_columns].to_dict('records')
+            ]
+        else:
+            attributes = ['{}'] * len(rows)
+
+        extra_groups = list(groups or [])
+        extra_tags = list(tags or [])
+        group_cells = rows[group_column].tolist() if group_column else [None] * len(rows)
+        tag_cells = rows[tag_column].tolist() if tag_column else [None] * len(rows)
+        group_rows = [
+            (group, phone) for phone, cell in zip(phone_list, group_cells)
+            for group in split_values(cell) + extra_groups
+        ]
+        tag_rows = [
+            (tag, phone) for phone, cell in zip(phone_list, tag_cells)
+            for tag in split_values(cell) + extra_tags
+        ]
+
+        now = _now()
+        unique_phones = list(dict.fromkeys(phone_list))
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                existing = set()
+                for start in range(0, len(unique_phones), _BATCH):
+                    batch = unique_phones[start:start + _BATCH]
+                    existing.update(phone for (phone,) in self.conn.execute(
+                        f"SELECT phone FROM contacts WHERE phone IN ({', '.join('?' * len(batch))})", batch
+                    ))
+                self.conn.executemany(
+                    'INSERT INTO contacts (phone, name, attributes, created_at, updated_at) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (phone) DO UPDATE SET '
+                    'name = COALESCE(excluded.name, contacts.name), '
+                    'attributes = json_patch(contacts.attributes, excluded.attributes), '
+                    'updated_at = excluded.updated_at',
+                    [(phone, name, attrs, now, now) for phone, name, attrs in zip(phone_list, names, attributes)]
+                )
+                before = self.conn.total_changes
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO contact_groups (group_name, phone) VALUES (?, ?)', group_rows
+                )
+                self.conn.executemany('INSERT OR IGNORE INTO contact_tags (tag, phone) VALUES (?, ?)', tag_rows)
+                memberships = self.conn.total_changes - before
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return {
+            "new": len(unique_phones) - len(existing),
+            "updated": len(existing),
+            "memberships_added": memberships
+        }
+
+    def import_file(self, file_path, groups=None, tags=None):
+        """Merge a whole CSV/Excel file, streaming it chunk by chunk; returns merge counts"""
+        stream = RecipientStream(file_path).open()
+        totals = {"new": 0, "updated": 0, "memberships_added": 0}
+        for phones, rows in stream.chunks():
+            counts = self.merge_chunk(phones, rows, stream.phone_column, groups, tags)
+            for key, value in counts.items():
+                totals[key] += value
+        totals.update({
+            "rows": stream.rows_read,
+            "phone_column": stream.phone_column,
+            "phone_column_confidence": stream.phone_confidence,
+            "invalid_count": stream.invalid_count,
+            "invalid_numbers": stream.invalid_numbers
+        })
+        return totals
+
+    def select_phones(self, groups=None, tags=None):
+        """
+        Sorted phone numbers (as int64) in any of groups and, when tags are
+        given, carrying any of tags; with neither, every contact
+        """
+        with self.lock:
+            if groups:
+                selected = self._members('contact_groups', 'group_name', groups)
+                if tags:
+                    selected = np.intersect1d(selected, self._members('contact_tags', 'tag', tags))
+            elif tags:
+                selected = self._members('contact_tags', 'tag', tags)
+            else:
+                selected = self._phone_array(self.conn.execute('SELECT phone FROM contacts'))
+        return selected
+
+    def phones(self, groups=None, tags=None):
+        return [str(phone) for phone in self.select_phones(groups, tags).tolist()]
+
+    def contacts(self, phones):
+        """Contact records (phone, name, groups, tags, attributes) for phones, in the given order"""
+        phones = [str(phone) for phone in phones]
+        found = {}
+        with self.lock:
+            for start in range(0, len(phones), _BATCH):
+                batch = phones[start:start + _BATCH]
+                for phone, name, attributes, groups, tags in self.conn.execute(
+                    'SELECT c.phone, c.name, c.attributes, '
+                    '(SELECT json_group_array(group_name) FROM contact_groups g WHERE g.phone = c.phone), '
+                    '(SELECT json_group_array(tag) FROM contact_tags t WHERE t.phone = c.phone) '
+                    f"FROM contacts c WHERE c.phone IN ({', '.join('?' * len(batch))})",
+                    batch
+                ):
+                    found[phone] = {
+                        "phone": phone,
+                        "name": name,
+                        "groups": json.loads(groups),
+                        "tags": json.loads(tags),
+                        "attributes": json.loads(attributes)
+                    }
+        return [found[phone] for phone in phones if phone in found]
+
+    def page(self, groups=None, tags=None, after=None, limit=100):
+        """One page of a selection, in phone order, starting after the phone number after"""
+        selected = self.select_phones(groups, tags)
+        start = int(np.searchsorted(selected, int(after), side='right')) if after else 0
+        return {
+            "total": len(selected),
+            "contacts": self.contacts(selected[start:start + limit].tolist())
+        }
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM contacts').fetchone()[0]
+
+    def groups(self):
+        """Group names with their number of contacts"""
+        with self.lock:
+            rows = self.conn.execute('SELECT group_name, COUNT(*) FROM contact_groups GROUP BY group_name').fetchall()
+        return [{"group": name, "contacts": count} for name, count in rows]
+
+    def tags(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT tag, COUNT(*) FROM contact_tags GROUP BY tag').fetchall()
+        return [{"tag": name, "contacts": count} for name, count in rows]
+
+    def save_segment(self, name, groups=None, tags=None):
+        """Save (or replace) a named selection of groups and tags"""
+        now = _now()
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO segments (name, groups, tags, created_at, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET groups = excluded.groups, tags = excluded.tags, '
+                'updated_at = excluded.updated_at',
+                (name, json.dumps(list(groups or [])), json.dumps(list(tags or [])), now, now)
+            )
+        return self.get_segment(name)
+
+    def get_segment(self, name):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT name, groups, tags, created_at, updated_at FROM segments WHERE name = ?', (name,)
+            ).fetchone()
+        return self._segment(row) if row else None
+
+    def list_segments(self):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT name, groups, tags, created_at, updated_at FROM segments ORDER BY name'
+            ).fetchall()
+        return [self._segment(row) for row in rows]
+
+    def delete_segment(self, name):
+        with self.lock:
+            return self.conn.execute('DELETE FROM segments WHERE name = ?', (name,)).rowcount > 0
+
+    def select(self, groups=None, tags=None):
+        """The contacts of a selection as campaign recipients (see ContactSelection)"""
+        return ContactSelection(self, groups, tags)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _members(self, table, column, values):
+        # Caller must hold self.lock; one primary key range scan per value
+        arrays = [
+            self._phone_array(self.conn.execute(f'SELECT phone FROM {table} WHERE {column} = ?', (value,)))
+            for value in values
+        ]
+        return np.unique(np.concatenate(arrays)) if arrays else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _phone_array(cursor):
+        # Stored numbers are 12 digits, so they fit an int64 and sort the same way
+        return np.unique(np.fromiter((int(phone) for (phone,) in cursor), dtype=np.int64))
+
+    @staticmethod
+    def _segment(row):
+        name, groups, tags, created_at, updated_at = row
+        return {
+            "name": name,
+            "groups": json.loads(groups),
+            "tags": json.loads(tags),
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+
+class ContactSelection:
+    """
+    Saved contacts as the recipients of a campaign, in place of an upload
+
+    Offers the RecipientStream interface used by start_campaign_job. open()
+    resolves the selection to its phone numbers through the group and tag
+    indexes; chunks() then loads the contacts a chunk at a time, with name,
+    group, tags and every saved attribute as columns for message templates.
+    """
+
+    def __init__(self, store, groups=None, tags=None, chunk_size=CHUNK_SIZE):
+        self.store = store
+        self.groups = list(groups or [])
+        self.tags = list(tags or [])
+        self.chunk_size = chunk_size
+        self.phone_column = 'phone'
+        self.columns = []
+        self.invalid_count = 0
+        self.invalid_numbers = []
+        self.selected = None
+        self._first = None
+
+    def open(self):
+        self.selected = self.store.select_phones(self.groups, self.tags)
+        self._first = self._load(0)
+        self.columns = list(self._first.columns)
+        return self
+
+    def chunks(self):
+        """Yield (phones, rows) per chunk of the selection"""
+        if self.selected is None:
+            self.open()
+        for start in range(0, len(self.selected), self.chunk_size):
+            rows = self._first if start == 0 else self._load(start)
+            self._first = None
+            if len(rows):
+                yield rows['phone'], rows
+
+    def estimated_total(self):
+        return len(self.selected) if self.selected is not None else None
+
+    def __iter__(self):
+        for phones, _ in self.chunks():
+            yield from phones.tolist()
+
+    def iter_messages(self, template):
+        """Yield (phone, message) pairs, rendering template (a MessageTemplate) a chunk at a time"""
+        for phones, rows in self.chunks():
+            yield from zip(phones.tolist(), template.render(rows))
+
+    def close(self):
+        self._first = None
+
+    def _load(self, start):
+        records = []
+        for contact in self.store.contacts(self.selected[start:start + self.chunk_size].tolist()):
+            record = dict(contact["attributes"])
+            record.update({
+                "phone": contact["phone"],
+                "name": contact["name"],
+                "group": ', '.join(contact["groups"]),
+                "tags": ', '.join(contact["tags"])
+            })
+            records.append(record)
+        rows = pd.DataFrame.from_records(records)
+        if rows.empty:
+            rows = pd.DataFrame(columns=['phone', 'name', 'group', 'tags'])
+        return rows
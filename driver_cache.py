@@ -0,0 +1,166 @@
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+# Where resolved browser/driver pairs are remembered between starts
+DRIVER_CACHE_FILE = os.getenv('DRIVER_CACHE_FILE', os.path.join('.driver_cache', 'drivers.json'))
+
+_lock = threading.Lock()
+
+
+def chrome_candidates():
+    """Likely Chrome/Chromium binary locations for this platform, CHROME_BINARY first"""
+    candidates = []
+    if os.getenv('CHROME_BINARY'):
+        candidates.append(os.getenv('CHROME_BINARY'))
+
+    system = platform.system()
+    if system == 'Windows':
+        for root in (os.getenv('PROGRAMFILES', r"C:\Program Files"),
+                     os.getenv('PROGRAMFILES(X86)', r"C:\Program Files (x86)"),
+                     os.getenv('LOCALAPPDATA', '')):
+            if root:
+                candidates.append(os.path.join(root, 'Google', 'Chrome', 'Application', 'chrome.exe'))
+    elif system == 'Darwin':
+        candidates += [
+            '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome',
+            '/Applications/Chromium.app/Contents/MacOS/Chromium'
+        ]
+    else:
+        for name in ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser'):
+            found = shutil.which(name)
+            if found:
+                candidates.append(found)
+        candidates += ['/opt/google/chrome/chrome', '/usr/bin/google-chrome', '/usr/bin/chromium', '/snap/bin/chromium']
+    return candidates
+
+
+def find_chrome():
+    for path in chrome_candidates():
+        if path and os.path.exists(path):
+            return os.path.realpath(path)
+    return None
+
+
+def chrome_version(binary):
+    """Full version string of a Chrome binary, e.g. "120.0.6099.109", or None"""
+    if platform.system() == 'Windows':
+        # The installer keeps each version in a directory next to chrome.exe
+        versions = [name for name in os.listdir(os.path.dirname(binary)) if re.match(r'^\d+\.\d+\.\d+\.\d+$', name)]
+        if versions:
+            return max(versions, key=lambda v: tuple(int(part) for part in v.split('.')))
+        return None
+    output = subprocess.run([binary, '--version'], capture_output=True, text=True, timeout=10).stdout
+    match = re.search(r'(\d+\.\d+\.\d+\.\d+)', output)
+    return match.group(1) if match else None
+
+
+def driver_version(path):
+    try:
+        output = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=10).stdout
+    except Exception:
+        return None
+    match = re.search(r'(\d+\.\d+\.\d+\.\d+)', output)
+    return match.group(1) if match else None
+
+
+def local_driver_candidates():
+    """chromedriver binaries that may already be on this machine, CHROMEDRIVER_PATH first"""
+    exe = 'chromedriver.exe' if platform.system() == 'Windows' else 'chromedriver'
+    candidates = []
+    if os.getenv('CHROMEDRIVER_PATH'):
+        candidates.append(os.getenv('CHROMEDRIVER_PATH'))
+    candidates.append(os.path.join(os.getcwd(), exe))
+    candidates += glob.glob(os.path.join(os.getcwd(), 'chromedriver-*', exe))
+    if shutil.which(exe):
+        candidates.append(shutil.which(exe))
+    # Drivers downloaded earlier by webdriver-manager
+    candidates += glob.glob(os.path.join(os.path.expanduser('~'), '.wdm', 'drivers', 'chromedriver', '*', '*', '*', exe))
+    return candidates
+
+
+def _load_cache():
+    try:
+        with open(DRIVER_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    os.makedirs(os.path.dirname(os.path.abspath(DRIVER_CACHE_FILE)), exist_ok=True)
+    tmp_path = DRIVER_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, DRIVER_CACHE_FILE)
+
+
+def _cache_key(binary):
+    # A Chrome update replaces the binary, which changes its size/mtime
+    stat = os.stat(binary)
+    return f"{binary}|{stat.st_size}|{int(stat.st_mtime)}"
+
+
+def resolve_driver():
+    """
+    Return (chrome_binary, chromedriver_path, info) for starting Chrome
+
+    Repeat starts are served from DRIVER_CACHE_FILE without probing versions
+    or touching the network. On a cache miss the Chrome version is read,
+    a matching local chromedriver is preferred, and webdriver-manager's
+    download is the last resort. chromedriver_path is None when nothing was
+    found, leaving the choice to Selenium Manager.
+    """
+    start = time.perf_counter()
+    binary = find_chrome()
+    if not binary:
+        raise Exception("Chrome not found. Please install Google Chrome (or set CHROME_BINARY).")
+
+    key = _cache_key(binary)
+    with _lock:
+        cached = _load_cache().get(key)
+    if cached and cached.get('driver_path') and os.path.exists(cached['driver_path']):
+        info = dict(cached, source='cache', seconds=round(time.perf_counter() - start, 3))
+        return binary, cached['driver_path'], info
+
+    version = chrome_version(binary)
+    major = version.split('.')[0] if version else None
+
+    driver_path = None
+    source = None
+    for path in local_driver_candidates():
+        if path and os.path.exists(path):
+            found = driver_version(path)
+            if found and (major is None or found.split('.')[0] == major):
+                driver_path, source = path, 'local'
+                break
+
+    if not driver_path:
+        try:
+            from webdriver_manager.chrome import ChromeDriverManager
+            driver_path, source = ChromeDriverManager().install(), 'download'
+        except Exception as e:
+            print(f"Error downloading ChromeDriver: {str(e)}")
+
+    entry = {"chrome_binary": binary, "chrome_version": version, "driver_path": driver_path}
+    if driver_path:
+        with _lock:
+            cache = _load_cache()
+            cache[key] = entry
+            _save_cache(cache)
+    info = dict(entry, source=source or 'selenium-manager', seconds=round(time.perf_counter() - start, 3))
+    return binary, driver_path, info
+
+
+def forget_driver(binary):
+    """Drop the cached driver for a Chrome binary, e.g. after it failed to start"""
+    with _lock:
+        cache = _load_cache()
+        if cache.pop(_cache_key(binary), None) is not None:
+            _save_cache(cache)
@@ -0,0 +1,406 @@
+"""
+Local stand-in for WhatsApp Web, for offline load testing
+
+Serves a mock page with the selectors the bot relies on (#side, the
+composer div[title="Type a message"], span[data-icon="send"], outgoing
+bubbles with msg-* status icons, the invalid number popup), so the
+Selenium transport can be pointed at it with WHATSAPP_WEB_URL, and a JSON
+API used both by the page and by the browserless HttpTransport
+(SEND_TRANSPORT=http). Latency and failures are injected by the server.
+
+Usage: python fake_whatsapp.py [--port 8765] [--latency-ms 300] [--timeout-rate 0.02] ...
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image, ImageDraw
+
+from retry_engine import INVALID_NUMBER, UI_CHANGED
+
+MOCK_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>WhatsApp</title>
+<style>
+body { font-family: sans-serif; margin: 0; }
+#app { display: flex; height: 100vh; }
+#side { width: 240px; border-right: 1px solid #ddd; padding: 10px; }
+#main { flex: 1; display: flex; flex-direction: column; }
+#messages { flex: 1; overflow: auto; padding: 10px; }
+.message-out { background: #dcf8c6; margin: 4px 0; padding: 6px; }
+footer { display: flex; padding: 10px; border-top: 1px solid #ddd; }
+footer [contenteditable] { flex: 1; border: 1px solid #ccc; padding: 6px; min-height: 20px; }
+span[data-icon="send"] { cursor: pointer; padding: 6px 12px; background: #25d366; color: white; }
+div[role="dialog"] { position: fixed; top: 40%; left: 30%; background: white; border: 1px solid #999; padding: 20px; }
+#media-preview { position: fixed; top: 10%; left: 30%; width: 40%; background: #eee; padding: 10px; }
+#media-preview img { max-width: 100%; max-height: 300px; }
+.message-out img { max-width: 200px; display: block; }
+</style>
+</head>
+<body>
+<div id="app"></div>
+<script>
+const app = document.getElementById('app');
+let counter = 0;
+
+function el(tag, attrs, text) {
+    const node = document.createElement(tag);
+    Object.entries(attrs || {}).forEach(([key, value]) => node.setAttribute(key, value));
+    if (text) { node.textContent = text; }
+    return node;
+}
+
+async function render(phone, text) {
+    const state = await (await fetch('/api/state')).json();
+    app.innerHTML = '';
+    if (!state.logged_in) {
+        app.appendChild(el('div', {'data-testid': 'qrcode'}, 'Scan the QR code (POST /api/state {"logged_in": true})'));
+        return;
+    }
+    app.appendChild(el('div', {id: 'side'}, 'Chats'));
+    const main = el('div', {id: 'main'});
+    main.appendChild(el('div', {id: 'messages'}));
+    app.appendChild(main);
+    let outcome = 'ok';
+    if (phone) {
+        const query = new URLSearchParams({phone: phone, text: text || ''});
+        outcome = (await (await fetch('/api/chat?' + query)).json()).outcome;
+    }
+    if (outcome === '""" + INVALID_NUMBER + """') {
+        app.appendChild(el('div', {role: 'dialog', 'data-animate-modal-popup': 'true'},
+                           'Phone number shared via url is invalid.'));
+        return;
+    }
+    const footer = el('footer');
+    // A changed layout: the footer is there but the composer is not where the bot looks
+    const composer = el('div', outcome === '""" + UI_CHANGED + """'
+        ? {contenteditable: 'true', title: 'Message'}
+        : {contenteditable: 'true', title: 'Type a message'}, text || '');
+    // Attaching: the clip opens a file input; choosing an image shows a preview with a caption box
+    const clip = el('span', {'data-icon': 'clip'}, 'Attach');
+    clip.addEventListener('click', () => {
+        if (footer.querySelector('input[type="file"]')) { return; }
+        const input = el('input', {type: 'file', accept: 'image/*,video/mp4,video/3gpp,video/quicktime'});
+        input.style.display = 'none';
+        input.addEventListener('change', () => preview(phone, input.files[0]));
+        footer.appendChild(input);
+    });
+    footer.appendChild(clip);
+    const send = el('span', {'data-icon': 'send'}, 'Send');
+    send.addEventListener('click', async () => {
+        const message = composer.textContent;
+        composer.textContent = '';
+        const reply = await (await fetch('/api/send', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({phone: phone, text: message})
+        })).json();
+        if (reply.status !== 'sent') { return; }
+        const row = el('div', {'data-id': 'true_' + phone + '_' + (++counter)});
+        const bubble = el('div', {class: 'message-out'}, message);
+        bubble.appendChild(el('span', {'data-icon': 'msg-check'}));
+        row.appendChild(bubble);
+        document.getElementById('messages').appendChild(row);
+    });
+    footer.appendChild(composer);
+    footer.appendChild(send);
+    main.appendChild(footer);
+}
+
+async function preview(phone, file) {
+    const overlay = el('div', {id: 'media-preview'});
+    const image = el('img');
+    image.src = URL.createObjectURL(file);
+    const caption = el('div', {contenteditable: 'true', 'data-testid': 'media-caption-input', title: 'Add a caption'});
+    const send = el('span', {'data-icon': 'send'}, 'Send');
+    send.addEventListener('click', async () => {
+        const data = await file.arrayBuffer();
+        const digest = Array.from(new Uint8Array(await crypto.subtle.digest('SHA-256', data)))
+            .map((b) => b.toString(16).padStart(2, '0')).join('');
+        await fetch('/api/media/' + digest, {method: 'PUT', body: data});
+        const text = caption.textContent;
+        overlay.remove();
+        document.querySelectorAll('footer input[type="file"]').forEach((input) => input.remove());
+        const reply = await (await fetch('/api/send', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({phone: phone, text: text, media: digest})
+        })).json();
+        if (reply.status !== 'sent') { return; }
+        const row = el('div', {'data-id': 'true_' + phone + '_' + (++counter)});
+        const bubble = el('div', {class: 'message-out'}, text);
+        const shown = el('img');
+        shown.src = image.src;
+        bubble.prepend(shown);
+        bubble.appendChild(el('span', {'data-icon': 'msg-check'}));
+        row.appendChild(bubble);
+        document.getElementById('messages').appendChild(row);
+    });
+    overlay.appendChild(image);
+    overlay.appendChild(caption);
+    overlay.appendChild(send);
+    document.body.appendChild(overlay);
+}
+
+// Like WhatsApp Web, clicks on wa.me links open the chat in-page
+document.addEventListener('click', (event) => {
+    const link = event.target.closest && event.target.closest('a[href^="https://wa.me/"]');
+    if (!link) { return; }
+    event.preventDefault();
+    const url = new URL(link.href);
+    render(url.pathname.slice(1), url.searchParams.get('text'));
+}, true);
+
+const params = new URLSearchParams(location.search);
+render(params.get('phone'), params.get('text'));
+</script>
+</body>
+</html>
+"""
+
+
+class FakeWhatsAppServer:
+    """
+    The mock WhatsApp Web page and its JSON API, served from a background thread
+
+    Opening a chat (GET /api/chat) waits chat_latency_ms and then decides
+    whether the number is invalid (invalid_rate, or listed in
+    invalid_numbers) or the page comes up without the composer
+    (ui_change_rate). Sending (POST /api/send) waits latency_ms +- jitter_ms
+    and is dropped, never acknowledged, with timeout_rate. GET/POST
+    /api/state reads or sets the login, /api/config changes these settings
+    while running, /api/stats counts outcomes and /api/messages lists the
+    last messages received. GET /api/screenshot renders a PNG of the last
+    chat opened, as the browser would show it. Images are uploaded with
+    PUT /api/media/<sha256> and sent by referring to that key; the page
+    does the same from its attach button and preview.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, chat_latency_ms=0, invalid_rate=0.0,
+                 timeout_rate=0.0, ui_change_rate=0.0, invalid_numbers=None, logged_in=True, seed=None,
+                 max_messages=10000):
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.settings = {}
+        self.configure(
+            latency_ms=latency_ms, jitter_ms=jitter_ms, chat_latency_ms=chat_latency_ms, invalid_rate=invalid_rate,
+            timeout_rate=timeout_rate, ui_change_rate=ui_change_rate, invalid_numbers=invalid_numbers or [],
+            logged_in=logged_in
+        )
+        self.messages = deque(maxlen=max_messages)
+        self.counts = {"chats": 0, "sent": 0, "dropped": 0, INVALID_NUMBER: 0, UI_CHANGED: 0,
+                       "media_uploads": 0, "media_bytes": 0, "media_sent": 0}
+        self.media = {}
+        self.last_chat = {"phone": None, "outcome": None}
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def configure(self, **settings):
+        with self.lock:
+            for key, value in settings.items():
+                if key == 'invalid_numbers':
+                    value = {''.join(ch for ch in str(phone) if ch.isdigit()) for phone in value}
+                self.settings[key] = value
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-whatsapp", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def open_chat(self, phone):
+        with self.lock:
+            settings = dict(self.settings)
+            draw = self.random.random()
+            self.counts["chats"] += 1
+        _sleep_ms(settings["chat_latency_ms"])
+        digits = ''.join(ch for ch in str(phone) if ch.isdigit())
+        outcome = 'ok'
+        if digits in settings["invalid_numbers"] or draw < settings["invalid_rate"]:
+            outcome = INVALID_NUMBER
+        elif draw < settings["invalid_rate"] + settings["ui_change_rate"]:
+            outcome = UI_CHANGED
+        with self.lock:
+            if outcome != 'ok':
+                self.counts[outcome] += 1
+            self.last_chat = {"phone": digits, "outcome": outcome}
+        return {"outcome": outcome}
+
+    def upload_media(self, key, data):
+        with self.lock:
+            self.media[key] = len(data)
+            self.counts["media_uploads"] += 1
+            self.counts["media_bytes"] += len(data)
+        return {"key": key, "bytes": len(data)}
+
+    def send(self, phone, text, media=None):
+        with self.lock:
+            settings = dict(self.settings)
+            dropped = self.random.random() < settings["timeout_rate"]
+            jitter = self.random.uniform(-settings["jitter_ms"], settings["jitter_ms"])
+            if media and media not in self.media:
+                return {"status": "error", "error": "unknown media"}
+        _sleep_ms(settings["latency_ms"] + jitter)
+        with self.lock:
+            if dropped:
+                self.counts["dropped"] += 1
+                return {"status": "dropped"}
+            self.counts["sent"] += 1
+            if media:
+                self.counts["media_sent"] += 1
+            self.messages.append({"phone": phone, "text": text, "media": media, "at": time.time()})
+        return {"status": "sent"}
+
+
+    def screenshot(self, width=1366, height=768):
+        """PNG of the mock page showing the last chat opened, popup or missing composer included"""
+        with self.lock:
+            chat = dict(self.last_chat)
+        image = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(image)
+        draw.rectangle([0, 0, 240, height], fill=(240, 242, 245))
+        draw.text((10, 10), 'Chats', fill='black')
+        draw.text((260, 10), f"+{chat['phone']}" if chat['phone'] else '', fill='black')
+        draw.rectangle([240, height - 60, width, height], fill=(240, 242, 245))
+        if chat['outcome'] != UI_CHANGED:
+            draw.rectangle([260, height - 45, width - 100, height - 15], fill='white', outline=(200, 200, 200))
+            draw.rectangle([width - 80, height - 45, width - 20, height - 15], fill=(37, 211, 102))
+        if chat['outcome'] == INVALID_NUMBER:
+            draw.rectangle([width // 3, height // 3, width * 2 // 3, height // 2], fill='white', outline='gray')
+            draw.text((width // 3 + 20, height // 3 + 20), 'Phone number shared via url is invalid.', fill='black')
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+def _sleep_ms(milliseconds):
+    if milliseconds > 0:
+        time.sleep(milliseconds / 1000)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if parts.path in ('/', '/send'):
+            self._reply(MOCK_PAGE.encode('utf-8'), 'text/html; charset=utf-8')
+        elif parts.path == '/api/chat':
+            self._json(fake.open_chat(query.get('phone', '')))
+        elif parts.path == '/api/state':
+            self._json({"logged_in": fake.settings["logged_in"]})
+        elif parts.path == '/api/screenshot':
+            self._reply(fake.screenshot(), 'image/png')
+        elif parts.path == '/api/stats':
+            self._json(fake.stats())
+        elif parts.path == '/api/messages':
+            with fake.lock:
+                self._json(list(fake.messages)[-int(query.get('limit', 100)):])
+        elif parts.path == '/api/config':
+            with fake.lock:
+                settings = dict(fake.settings, invalid_numbers=sorted(fake.settings["invalid_numbers"]))
+            self._json(settings)
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._json({"error": "invalid JSON"}, status=400)
+            return
+        path = urlsplit(self.path).path
+        if path == '/api/send':
+            self._json(fake.send(body.get('phone'), body.get('text'), body.get('media')))
+        elif path == '/api/state':
+            fake.configure(logged_in=bool(body.get('logged_in', True)))
+            self._json({"logged_in": fake.settings["logged_in"]})
+        elif path == '/api/config':
+            fake.configure(**{key: value for key, value in body.items() if key in fake.settings})
+            self._json({"success": True})
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def do_PUT(self):
+        fake = self.server.fake
+        path = urlsplit(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length)
+        if path.startswith('/api/media/') and data:
+            self._json(fake.upload_media(path[len('/api/media/'):], data))
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def _json(self, payload, status=200):
+        self._reply(json.dumps(payload).encode('utf-8'), 'application/json', status)
+
+    def _reply(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One line per request would drown the load being measured
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=300, help="delay before a send is acknowledged")
+    parser.add_argument('--jitter-ms', type=float, default=100)
+    parser.add_argument('--chat-latency-ms', type=float, default=50, help="delay before a chat opens")
+    parser.add_argument('--invalid-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--ui-change-rate', type=float, default=0.0)
+    parser.add_argument('--invalid-numbers', default='', help="comma-separated numbers that are never on WhatsApp")
+    parser.add_argument('--logged-out', action='store_true', help="start on the QR code screen")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeWhatsAppServer(
+        host=args.host, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        chat_latency_ms=args.chat_latency_ms, invalid_rate=args.invalid_rate, timeout_rate=args.timeout_rate,
+        ui_change_rate=args.ui_change_rate,
+        invalid_numbers=[n for n in args.invalid_numbers.split(',') if n.strip()],
+        logged_in=not args.logged_out, seed=args.seed
+    )
+    print(f"Fake WhatsApp Web on {server.url}")
+    print(f"Run the app with WHATSAPP_WEB_URL={server.url} (Chrome) or also SEND_TRANSPORT=http (no browser)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+
+# Sentinel pushed on the queue to stop the writer thread
+_STOP = object()
+
+
+class TrackingLogWriter:
+    """
+    Background writer that batches tracking log records into a TrackingStore
+
+    Records are pushed onto a bounded queue and written by a single thread,
+    either when batch_size records are waiting or flush_interval seconds have
+    passed since the first record of the batch. When the queue is full,
+    write() blocks the caller until the writer catches up (backpressure).
+    """
+
+    def __init__(self, store, batch_size=200, flush_interval=0.25, max_queue=10000):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.cond = threading.Condition()
+        self.pending = 0
+        self.thread = None
+
+        # Monitoring counters
+        self.records_written = 0
+        self.records_failed = 0
+        self.batches_written = 0
+        self.backpressure_waits = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, name='tracking-log-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, record, timeout=None):
+        """
+        Queue a record for writing
+        Blocks while the queue is full; raises queue.Full if timeout expires
+        """
+        with self.cond:
+            self.pending += 1
+        try:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.backpressure_waits += 1
+                self.queue.put(record, timeout=timeout)
+        except queue.Full:
+            self._done(1)
+            raise
+
+    def flush(self, timeout=5.0):
+        """Wait until every queued record has been written; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.pending > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """Flush outstanding records and stop the writer thread"""
+        if not self.thread or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "pending_records": self.pending,
+            "records_written": self.records_written,
+            "records_failed": self.records_failed,
+            "batches_written": self.batches_written,
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.batches_written, 3) if self.batches_written else 0.0,
+            "running": bool(self.thread and self.thread.is_alive())
+        }
+
+    def _done(self, count):
+        with self.cond:
+            self.pending -= count
+            self.cond.notify_all()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            # Collect a batch until it is full or the flush interval expires
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+
+        # Drain anything queued after the stop request
+        leftover = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._write_batch(leftover)
+
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            self.store.append_many(batch)
+            self.records_written += len(batch)
+            self.batches_written += 1
+        except Exception as e:
+            print(f"Error writing {len(batch)} tracking log records: {str(e)}")
+            self.records_failed += len(batch)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            self._done(len(batch))
@@ -0,0 +1,225 @@
+import json
+import os
+import sys
+import threading
+
+# MCP revisions this server speaks, newest first; a client asking for another one gets the newest
+PROTOCOL_VERSIONS = ('2025-06-18', '2025-03-26', '2024-11-05')
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class ToolError(Exception):
+    """Raised by a tool for a failure the calling agent should see (returned as an isError result)"""
+
+
+class MCPServer:
+    """
+    A Model Context Protocol server: JSON-RPC 2.0 requests in, replies out
+
+    Tools are plain functions registered with @server.tool(...), called
+    with the tool call's arguments as keyword arguments; whatever they
+    return (a dict) is sent back as JSON text and structured content. A
+    ToolError or ValueError they raise becomes an isError result, so the
+    agent sees the message. handle_json() serves one request (or batch)
+    and is all a transport needs: serve_stdio() reads newline-delimited
+    messages from stdin, and app.py serves POST /mcp with it. Tools are
+    expected to return quickly; long work is queued and polled.
+    """
+
+    def __init__(self, name, version, instructions=None):
+        self.name = name
+        self.version = version
+        self.instructions = instructions
+        self.tools = {}
+        self.lock = threading.Lock()
+
+        # Monitoring counters
+        self.requests = 0
+        self.tool_calls = {}
+        self.tool_errors = 0
+
+    def tool(self, name=None, description=None, properties=None, required=()):
+        """Register the decorated function as a tool; properties are the JSON Schema of its arguments"""
+        def register(func):
+            tool_name = name or func.__name__
+            self.tools[tool_name] = {
+                "func": func,
+                "definition": {
+                    "name": tool_name,
+                    "description": description or (func.__doc__ or '').strip(),
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": properties or {},
+                        "required": list(required)
+                    }
+                }
+            }
+            return func
+        return register
+
+    def handle_json(self, text):
+        """Serve a JSON-RPC message (or batch) given as text; returns the reply as text, or None for notifications"""
+        try:
+            message = json.loads(text)
+        except ValueError as e:
+            return json.dumps(_error(None, PARSE_ERROR, f"Parse error: {str(e)}"))
+        if isinstance(message, list):
+            replies = [reply for reply in (self.handle(item) for item in message) if reply is not None]
+            if not message:
+                replies = _error(None, INVALID_REQUEST, "Empty batch")
+            return json.dumps(replies, default=str) if replies else None
+        reply = self.handle(message)
+        return json.dumps(reply, default=str) if reply is not None else None
+
+    def handle(self, message):
+        """Serve one JSON-RPC message (a dict); returns the reply dict, or None for a notification"""
+        if not isinstance(message, dict) or message.get("jsonrpc") != '2.0' or not isinstance(message.get("method"), str):
+            if isinstance(message, dict) and "method" not in message and ("result" in message or "error" in message):
+                # A reply to a request of ours; this server sends none
+                return None
+            return _error(message.get("id") if isinstance(message, dict) else None, INVALID_REQUEST, "Invalid request")
+        request_id = message.get("id")
+        method = message["method"]
+        params = message.get("params")
+        if "id" not in message:
+            # Notifications (initialized, cancelled, ...) need no reply
+            return None
+        if params is None:
+            params = {}
+        elif not isinstance(params, dict):
+            return _error(request_id, INVALID_PARAMS, "params must be an object")
+
+        with self.lock:
+            self.requests += 1
+        try:
+            if method == 'initialize':
+                result = self._initialize(params)
+            elif method == 'ping':
+                result = {}
+            elif method == 'tools/list':
+                result = {"tools": [tool["definition"] for tool in self.tools.values()]}
+            elif method == 'tools/call':
+                return self._call_tool(request_id, params)
+            else:
+                return _error(request_id, METHOD_NOT_FOUND, f"Method not found: {method}")
+        except Exception as e:
+            print(f"Error serving MCP request {method}: {str(e)}")
+            return _error(request_id, INTERNAL_ERROR, str(e))
+        return {"jsonrpc": '2.0', "id": request_id, "result": result}
+
+    def serve_stdio(self, stdin=None, stdout=None):
+        """
+        Serve newline-delimited JSON-RPC on stdin/stdout until stdin closes
+        Each request is served on its own thread, so a tool that waits does
+        not hold up the requests behind it.
+        """
+        stdin = stdin or sys.stdin
+        stdout = stdout or sys.stdout
+        write_lock = threading.Lock()
+
+        def serve(line):
+            reply = self.handle_json(line)
+            if reply is not None:
+                with write_lock:
+                    stdout.write(reply + '\n')
+                    stdout.flush()
+
+        threads = []
+        for line in stdin:
+            line = line.strip()
+            if line:
+                thread = threading.Thread(target=serve, args=(line,), name='mcp-request', daemon=True)
+                thread.start()
+                threads = [t for t in threads if t.is_alive()] + [thread]
+        # Let the requests still being served reply before the client's pipe is gone
+        for thread in threads:
+            thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "tool_calls": dict(self.tool_calls),
+            "tool_errors": self.tool_errors
+        }
+
+    def _initialize(self, params):
+        requested = params.get("protocolVersion")
+        return {
+            "protocolVersion": requested if requested in PROTOCOL_VERSIONS else PROTOCOL_VERSIONS[0],
+            "capabilities": {"tools": {"listChanged": False}},
+            "serverInfo": {"name": self.name, "version": self.version},
+            "instructions": self.instructions or ''
+        }
+
+    def _call_tool(self, request_id, params):
+        name = params.get("name")
+        arguments = params.get("arguments") or {}
+        tool = self.tools.get(name)
+        if tool is None:
+            return _error(request_id, INVALID_PARAMS, f"Unknown tool: {name}")
+        schema = tool["definition"]["inputSchema"]
+        if not isinstance(arguments, dict):
+            return _error(request_id, INVALID_PARAMS, "Tool arguments must be an object")
+        unknown = [key for key in arguments if key not in schema["properties"]]
+        missing = [key for key in schema["required"] if arguments.get(key) is None]
+        if unknown or missing:
+            problems = ([f"unknown arguments: {', '.join(unknown)}"] if unknown else []) + \
+                       ([f"missing arguments: {', '.join(missing)}"] if missing else [])
+            return _error(request_id, INVALID_PARAMS, f"{name}: {'; '.join(problems)}")
+
+        with self.lock:
+            self.tool_calls[name] = self.tool_calls.get(name, 0) + 1
+        try:
+            result = tool["func"](**arguments)
+            is_error = False
+        except (ToolError, ValueError) as e:
+            result = {"error": str(e)}
+            is_error = True
+        except Exception as e:
+            print(f"Error in MCP tool {name}: {str(e)}")
+            result = {"error": f"Error: {str(e)}"}
+            is_error = True
+        if is_error:
+            with self.lock:
+                self.tool_errors += 1
+        return {
+            "jsonrpc": '2.0',
+            "id": request_id,
+            "result": {
+                "content": [{"type": "text", "text": json.dumps(result, default=str)}],
+                "structuredContent": result,
+                "isError": is_error
+            }
+        }
+
+
+def _error(request_id, code, message):
+    return {"jsonrpc": '2.0', "id": request_id, "error": {"code": code, "message": message}}
+
+
+def main():
+    """Serve the app's MCP tools over stdio, starting WHATSAPP_SESSIONS sessions in the background"""
+    # stdout carries the protocol: the app's progress prints go to stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+    import app
+
+    def start():
+        try:
+            ready = app.start_sessions(int(os.getenv('WHATSAPP_SESSIONS', '1')))
+            print(f"MCP server: {ready} WhatsApp session(s) ready")
+        except Exception as e:
+            print(f"MCP server: could not start WhatsApp sessions: {str(e)}")
+
+    threading.Thread(target=start, name='mcp-sessions', daemon=True).start()
+    app.mcp.serve_stdio(sys.stdin, protocol_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Image types accepted for sending (as detected by Pillow, not by file extension)
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP', 'BMP'}
+
+# Part of every cache key: bump it when the preprocessing changes so older results are not reused
+PIPELINE_VERSION = 1
+
+MEDIA_EXTENSION = '.jpg'
+
+
+class MediaCache:
+    """
+    Images prepared for sending once and stored under a hash of their content
+
+    add() validates an upload with Pillow, applies its EXIF orientation,
+    downsizes it to max_dimension and recompresses it as JPEG (what
+    WhatsApp sends anyway). The result is stored as <key>.jpg, the key
+    being a SHA-256 of the uploaded bytes and the processing settings, so
+    the same image uploaded again, for another campaign or after a restart,
+    is found by a stat and never decoded again. Recipients of a campaign
+    all send the same prepared file from its path. The most recently used
+    entries are kept in memory.
+    """
+
+    def __init__(self, folder, max_dimension=1600, quality=80, max_source_bytes=16 * 1024 * 1024,
+                 max_pixels=50000000, memory_items=256):
+        self.folder = folder
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.max_source_bytes = max_source_bytes
+        self.max_pixels = max_pixels
+        self.memory_items = memory_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        # One lock per key being processed, so concurrent uploads of the same image process it once
+        self.key_locks = {}
+        os.makedirs(folder, exist_ok=True)
+
+        # Monitoring counters
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.process_seconds = 0.0
+
+    def key_for(self, data):
+        settings = f"v{PIPELINE_VERSION}:{self.max_dimension}:{self.quality}\n".encode('ascii')
+        return hashlib.sha256(settings + data).hexdigest()
+
+    def add(self, data, filename=None):
+        """
+        Prepare the image in data (the uploaded bytes) unless it already was; returns its media dict
+        Raises ValueError when data is not an acceptable image.
+        """
+        if not data:
+            raise ValueError("Image is empty")
+        if len(data) > self.max_source_bytes:
+            self.rejected += 1
+            raise ValueError(f"Image is larger than {self.max_source_bytes // (1024 * 1024)} MB")
+
+        key = self.key_for(data)
+        media = self.get(key)
+        if media:
+            self.hits += 1
+            return media
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another thread may have prepared it while this one waited
+            media = self.get(key)
+            if media:
+                self.hits += 1
+                return media
+            try:
+                media = self._process(key, data, filename)
+            finally:
+                with self.lock:
+                    self.key_locks.pop(key, None)
+        self.misses += 1
+        return media
+
+    def get(self, key):
+        """The media dict of a prepared image, or None if key is not in the cache"""
+        with self.lock:
+            media = self.items.get(key)
+            if media:
+                self.items.move_to_end(key)
+                return media
+        if not key or len(key) != 64 or not all(ch in '0123456789abcdef' for ch in key):
+            return None
+        path = os.path.join(self.folder, key + MEDIA_EXTENSION)
+        try:
+            size = os.path.getsize(path)
+            with Image.open(path) as image:
+                width, height = image.size
+        except (OSError, UnidentifiedImageError):
+            return None
+        media = self._media(key, path, width, height, size)
+        self._remember(media)
+        return media
+
+    def list(self, limit=50):
+        """The most recently prepared images on disk"""
+        entries = sorted(
+            (entry for entry in os.scandir(self.folder) if entry.name.endswith(MEDIA_EXTENSION)),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True
+        )[:limit]
+        return [media for media in (self.get(entry.name[:-len(MEDIA_EXTENSION)]) for entry in entries) if media]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "avg_process_ms": round(self.process_seconds / self.misses * 1000, 1) if self.misses else None,
+            "in_memory": len(self.items)
+        }
+
+    def _process(self, key, data, filename):
+        start = time.perf_counter()
+        try:
+            with Image.open(io.BytesIO(data)) as probe:
+                image_format = probe.format
+                width, height = probe.size
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+            self.rejected += 1
+            raise ValueError("File is not a readable image")
+        if image_format not in ALLOWED_FORMATS:
+            self.rejected += 1
+            raise ValueError(f"Unsupported image type: {image_format}")
+        if width * height > self.max_pixels:
+            self.rejected += 1
+            raise ValueError(f"Image is too large ({width}x{height})")
+
+        image = Image.open(io.BytesIO(data))
+        # Animated images are sent as their first frame
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no transparency: flatten onto white as WhatsApp shows it
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=self.quality, optimize=True, progressive=True)
+        output = buffer.getvalue()
+
+        path = os.path.join(self.folder, key + MEDIA_EXTENSION)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(output)
+        os.replace(path + '.tmp', path)
+
+        self.bytes_in += len(data)
+        self.bytes_out += len(output)
+        self.process_seconds += time.perf_counter() - start
+        media = self._media(key, path, image.width, image.height, len(output), filename, image_format, len(data))
+        print(f"Prepared image {filename or key[:12]}: {width}x{height} {image_format}, {len(data)} bytes -> "
+              f"{image.width}x{image.height} JPEG, {len(output)} bytes")
+        self._remember(media)
+        return media
+
+    def _media(self, key, path, width, height, size, filename=None, source_format=None, source_bytes=None):
+        return {
+            "key": key,
+            "path": os.path.abspath(path),
+            "name": filename or key[:12] + MEDIA_EXTENSION,
+            "width": width,
+            "height": height,
+            "bytes": size,
+            "source_format": source_format,
+            "source_bytes": source_bytes
+        }
+
+    def _remember(self, media):
+        with self.lock:
+            self.items[media["key"]] = media
+            self.items.move_to_end(media["key"])
+            while len(self.items) > self.memory_items:
+                self.items.popitem(last=False)
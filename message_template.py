@@ -0,0 +1,160 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Text used for a placeholder whose column is missing, or empty in a row,
+# unless the template gives its own: {name|there}
+DEFAULT_FALLBACK = ''
+# A placeholder: {column} or {column|fallback}. Any other braces ({a b}, {amount:.2f},
+# {name!r}, JSON) are not placeholders and are sent as typed
+PLACEHOLDER = re.compile(r'\{(?P<name>[^\W\d]\w*)(?:\|(?P<fallback>[^{}]*))?\}')
+# Uploads whose sampled placeholder values repeat this much are rendered
+# once per distinct combination of values
+_SAMPLE_ROWS = 1024
+_DISTINCT_RATIO = 0.25
+
+
+def normalize_field(name):
+    """Placeholder/column name as matched: case-insensitive, spaces as underscores"""
+    return str(name).strip().lower().replace(' ', '_')
+
+
+class MessageTemplate:
+    """
+    A bulk message with {column} placeholders, compiled once per campaign
+
+    Placeholders name upload columns ("Hi {name}, you are in {group}"),
+    matched case-insensitively with spaces and underscores interchangeable.
+    {name|there} gives a fallback for rows where the column is empty (and
+    for uploads without it); fallbacks passes defaults per field. A
+    placeholder is a column name (letters, digits, underscores) in braces;
+    any other text, braces included ({limited time}, {amount:.2f}, JSON),
+    is sent as typed.
+
+    Compiling turns the text into a positional format string, so rendering
+    a chunk is one column conversion per placeholder and one str.format
+    call per row. When the placeholder values repeat a lot (groups, cities,
+    a few first names), each distinct combination is formatted once and
+    the messages are gathered by index. Measured on 1M rows with three
+    placeholders (benchmarks/bench_message_templates.py): about 0.4 s when
+    the values repeat, about 1 s when every row is distinct; the latter
+    is bound by the one str.format per row.
+    """
+
+    def __init__(self, text, fallbacks=None):
+        self.text = text
+        self.fallbacks = {normalize_field(k): v for k, v in (fallbacks or {}).items()}
+        self.fields = []
+        self.format_string = None
+        # Rendering strategy per set of columns, decided on the first large chunk
+        self._distinct = {}
+        pieces = []
+        position = 0
+        for match in PLACEHOLDER.finditer(text):
+            pieces.append(self._escape(text[position:match.start()]))
+            name = normalize_field(match.group('name'))
+            fallback = match.group('fallback')
+            if fallback is None:
+                fallback = self.fallbacks.get(name, DEFAULT_FALLBACK)
+            self.fields.append((name, fallback))
+            pieces.append('{}')
+            position = match.end()
+        if self.fields:
+            pieces.append(self._escape(text[position:]))
+            self.format_string = ''.join(pieces)
+
+    @property
+    def is_static(self):
+        return self.format_string is None
+
+    @property
+    def field_names(self):
+        return list(dict.fromkeys(name for name, _ in self.fields))
+
+    def missing_fields(self, columns):
+        """Placeholders with no matching column; they render as their fallback"""
+        available = {normalize_field(column) for column in columns}
+        return [name for name in self.field_names if name not in available]
+
+    def render(self, df):
+        """The message for every row of df, as a list in row order"""
+        if self.is_static:
+            return [self.text] * len(df)
+        lookup = {}
+        for column in df.columns:
+            lookup.setdefault(normalize_field(column), column)
+        fields = [(lookup.get(name), fallback) for name, fallback in self.fields]
+        present = [column for column, _ in fields if column is not None]
+        if present and len(df) > _SAMPLE_ROWS:
+            key = tuple(present)
+            if key not in self._distinct:
+                sample = df[present].head(_SAMPLE_ROWS)
+                self._distinct[key] = len(sample.drop_duplicates()) < _SAMPLE_ROWS * _DISTINCT_RATIO
+            if self._distinct[key]:
+                rendered = self._render_distinct(df, fields)
+                if rendered is not None:
+                    return rendered
+                # The values stopped repeating (a later chunk): format per row from now on
+                self._distinct[key] = False
+
+        values = []
+        for column, fallback in fields:
+            if column is None:
+                values.append([fallback] * len(df))
+            else:
+                values.append(self._column_text(df[column], fallback))
+        return list(map(self.format_string.format, *values))
+
+    def _render_distinct(self, df, fields):
+        # Number every row by its combination of placeholder values; None when they hardly repeat
+        combined = np.zeros(len(df), dtype=np.int64)
+        labels = []
+        for column, fallback in fields:
+            if column is None:
+                labels.append(None)
+                continue
+            codes, uniques = pd.factorize(df[column])
+            # Missing cells have code -1, which picks the fallback appended last
+            text = self._column_text(pd.Series(uniques), fallback) + [fallback]
+            codes = np.where(codes < 0, len(text) - 1, codes)
+            labels.append((codes, np.array(text, dtype=object)))
+            combined, uniques = pd.factorize(combined * len(text) + codes)
+            if len(uniques) > len(df) * _DISTINCT_RATIO:
+                return None
+            combined = combined.astype(np.int64)
+
+        _, first_rows = np.unique(combined, return_index=True)
+        values = []
+        for (column, fallback), label in zip(fields, labels):
+            if label is None:
+                values.append([fallback] * len(first_rows))
+            else:
+                codes, text = label
+                values.append(text[codes[first_rows]].tolist())
+        rendered = np.array(list(map(self.format_string.format, *values)), dtype=object)
+        return rendered[combined].tolist()
+
+    @staticmethod
+    def _escape(text):
+        return text.replace('{', '{{').replace('}', '}}')
+
+    @staticmethod
+    def _column_text(series, fallback):
+        # Column values as text, with the fallback for missing or blank cells
+        dtype = series.dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in 'fiub':
+            missing = series.isna().to_numpy()
+            present = series.to_numpy()[~missing]
+            if dtype.kind == 'f' and np.all(np.mod(present, 1) == 0) and np.all(np.abs(present) < 2 ** 63):
+                # Whole numbers read as floats (because of blank cells) print without ".0"
+                text = series.fillna(0).astype(np.int64).astype(str).to_numpy(dtype=object)
+            else:
+                text = series.astype(str).to_numpy(dtype=object)
+            text[missing] = fallback
+            return text.tolist()
+        return [
+            (value.strip() or fallback) if value.__class__ is str
+            else (fallback if value is None or pd.isna(value) else str(value).strip() or fallback)
+            for value in series.tolist()
+        ]
@@ -0,0 +1,290 @@
+import numpy as np
+import pandas as pd
+
+COUNTRY_CODE = 91
+_LOCAL_RANGE = 10 ** 10
+_FULL_RANGE = 10 ** 12
+_PREFIX = COUNTRY_CODE * _LOCAL_RANGE
+_INT64_MIN = np.iinfo(np.int64).min
+_INT64_LIMIT = 2.0 ** 63
+# Vectorized string scan: rows wider than this use the scalar function,
+# and the scan works on blocks of _CHUNK_ROWS rows to bound memory
+_MAX_WIDTH = 48
+_CHUNK_ROWS = 65536
+# Lookup tables indexed by ASCII code (128 = non-ASCII): characters str.strip()
+# removes plus the array padding, and the value of each digit (-1 otherwise)
+_BLANK = np.zeros(129, dtype=bool)
+_BLANK[[0, 9, 10, 11, 12, 13, 28, 29, 30, 31, 32]] = True
+_DIGIT_VALUE = np.full(129, -1, dtype=np.int8)
+_DIGIT_VALUE[48:58] = np.arange(10)
+
+
+def format_phone_number(number):
+    """
+    Convert phone number to standard format
+    - Handles scientific notation
+    - Ensures country code is present
+    - Removes any non-digit characters
+    """
+    try:
+        # Handle NaN or empty values
+        if pd.isna(number) or str(number).strip() == '':
+            return None
+
+        # Convert to string and handle scientific notation
+        if isinstance(number, float):
+            str_number = f"{float(number):.0f}"
+        else:
+            str_number = str(number)
+
+        # Remove any non-digit characters
+        digits_only = ''.join(filter(str.isdigit, str_number))
+
+        # Handle different formats
+        if len(digits_only) <= 10:  # Only local number
+            digits_only = '91' + digits_only.zfill(10)
+        elif len(digits_only) > 12:  # Too many digits
+            digits_only = digits_only[-12:]  # Take last 12 digits
+        elif len(digits_only) == 11 and digits_only.startswith('0'):  # Remove leading 0
+            digits_only = '91' + digits_only[1:]
+        elif len(digits_only) == 12 and not digits_only.startswith('91'):  # Wrong country code
+            digits_only = '91' + digits_only[-10:]
+
+        # Validate final number
+        if len(digits_only) == 12 and digits_only.startswith('91'):
+            return digits_only
+        return None
+
+    except Exception as e:
+        print(f"Error formatting phone number {number}: {str(e)}")
+        return None
+
+
+# Column names that mark a phone column (compared lowercase, spaces as underscores)
+PHONE_COLUMN_NAMES = [
+    'phone', 'phone_number', 'mobile', 'contact', 'number', 'tel',
+    'telephone', 'cell', 'cellphone', 'phone_no', 'mobile_no',
+    'contact_no', 'mob', 'mob_no', 'mobile_number'
+]
+# Values sampled per column when detecting the phone column
+PHONE_SAMPLE_ROWS = 1000
+# Added to the score of a column whose name is a phone column name
+_NAME_BONUS = 0.5
+# Digits a phone number has with or without country code / trunk prefix
+_MIN_DIGITS = 10
+_MAX_DIGITS = 13
+_DROP_DIGITS = str.maketrans('', '', '0123456789')
+
+
+def find_phone_column(df):
+    """
+    Find the column containing phone numbers in the DataFrame
+    Returns the name of the column containing phone numbers
+    """
+    return detect_phone_column(df)[0]
+
+
+def detect_phone_column(df, sample_rows=PHONE_SAMPLE_ROWS):
+    """
+    Pick the phone number column by scoring a bounded sample of every column
+    Returns (column, confidence), confidence between 0 and 1. A column named
+    like a phone column wins unless another column's values look clearly
+    more like phone numbers; with nothing resembling one, the first column
+    is returned with confidence 0
+    """
+    best_column, best_score, best_confidence = df.columns[0], 0.0, 0.0
+    for column in df.columns:
+        score = phone_column_score(df[column], sample_rows)
+        named = str(column).strip().lower().replace(' ', '_') in PHONE_COLUMN_NAMES
+        ranked = score + (_NAME_BONUS if named else 0.0)
+        if ranked > best_score:
+            best_column, best_score = column, ranked
+            best_confidence = min(score + (_NAME_BONUS / 2 if named else 0.0), 1.0)
+    return best_column, round(best_confidence, 3)
+
+
+def phone_column_score(series, sample_rows=PHONE_SAMPLE_ROWS):
+    """
+    How much a column looks like phone numbers (0 to 1), from at most
+    sample_rows values spread over the column: the share of digits in the
+    values, the share with a phone number's digit count, and the share that
+    normalizes to a valid number, weighted by how many values are present
+    """
+    if len(series) == 0:
+        return 0.0
+    positions = np.linspace(0, len(series) - 1, min(len(series), sample_rows)).astype(np.int64)
+    sample = series.iloc[np.unique(positions)]
+    present = sample[sample.notna()]
+    if present.empty:
+        return 0.0
+
+    if pd.api.types.is_float_dtype(present.dtype):
+        text = [f"{value:.0f}" for value in present.tolist()]
+    else:
+        text = [
+            f"{value:.0f}" if isinstance(value, float) else str(value).strip()
+            for value in present.tolist()
+        ]
+    # Long free text is not a phone number; the first characters are enough to tell
+    text = [value[:4 * _MAX_DIGITS] for value in text]
+    lengths = np.fromiter(map(len, text), dtype=np.int64, count=len(text))
+    digits = lengths - np.fromiter((len(value.translate(_DROP_DIGITS)) for value in text),
+                                   dtype=np.int64, count=len(text))
+    density = float(np.mean(digits / np.maximum(lengths, 1)))
+    phone_length = (digits >= _MIN_DIGITS) & (digits <= _MAX_DIGITS)
+
+    formatted, _ = normalize_phone_series(present)
+    normalized = formatted.notna().to_numpy() & phone_length
+
+    coverage = len(present) / len(sample)
+    score = 0.2 * density + 0.3 * float(phone_length.mean()) + 0.5 * float(normalized.mean())
+    return score * (0.5 + 0.5 * coverage)
+
+
+def normalize_phone_series(series, first_row=2):
+    """
+    Vectorized format_phone_number for a whole column
+    Returns (formatted, invalid_numbers): formatted is aligned with the input
+    and holds None for invalid rows, invalid_numbers is the "Row N: value"
+    report send_message_bulk returns, numbering the first value first_row
+    (row 2 by default, the header being row 1)
+    """
+    values = series.reset_index(drop=True)
+    dtype = values.dtype
+
+    numeric = pd.api.types.is_float_dtype(dtype) or pd.api.types.is_signed_integer_dtype(dtype)
+    if numeric and isinstance(dtype, np.dtype):
+        formatted = _normalize_numeric(values)
+    elif dtype == object or pd.api.types.is_string_dtype(dtype):
+        formatted = _normalize_strings(values.astype(object))
+    else:
+        formatted = pd.Series([format_phone_number(v) for v in values], dtype=object)
+
+    invalid_positions = np.flatnonzero(formatted.isna().to_numpy())
+    invalid_values = values.iloc[invalid_positions].tolist()
+    invalid_numbers = [f"Row {pos + first_row}: {number}" for pos, number in zip(invalid_positions, invalid_values)]
+
+    formatted.index = series.index
+    return formatted, invalid_numbers
+
+
+def _normalize_numeric(values):
+    # An integer's decimal string never has a leading zero, so only the
+    # length rules of format_phone_number apply and they reduce to arithmetic
+    if pd.api.types.is_float_dtype(values.dtype):
+        floats = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = np.isnan(floats)
+        fast = ~missing & (np.abs(floats) < _INT64_LIMIT)
+        ints = np.zeros(len(floats), dtype=np.int64)
+        # f"{x:.0f}" rounds half to even, as does rint
+        ints[fast] = np.rint(floats[fast]).astype(np.int64)
+    else:
+        ints = values.to_numpy(dtype=np.int64)
+        missing = np.zeros(len(ints), dtype=bool)
+        fast = ints != _INT64_MIN
+        ints = np.where(fast, ints, 0)
+
+    digits = np.abs(ints)
+    local = digits < _LOCAL_RANGE                                        # 10 digits or fewer
+    twelve = (digits >= _FULL_RANGE // 10) & (digits < _FULL_RANGE)      # exactly 12 digits
+    too_long = digits >= _FULL_RANGE                                     # last 12 must start with 91
+    valid = fast & (local | twelve | (too_long & ((digits % _FULL_RANGE) // _LOCAL_RANGE == COUNTRY_CODE)))
+
+    formatted = _assemble(digits % _LOCAL_RANGE, valid)
+
+    # Values outside int64 (or inf) keep the exact scalar behaviour
+    slow = ~fast & ~missing
+    if slow.any():
+        formatted[slow] = [format_phone_number(v) for v in values[slow]]
+    return formatted
+
+
+def _normalize_strings(values):
+    missing = values.isna().to_numpy()
+    if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        text = values.where(~missing, '').tolist()
+        slow = np.zeros(len(text), dtype=bool)
+    else:
+        # Mixed column: floats need the scientific notation handling, anything
+        # that is not a plain str/int goes through the scalar function
+        kinds = values.map(_value_kind).to_numpy()
+        slow = kinds == 'other'
+        text = [
+            '' if skip else (f"{v:.0f}" if kind == 'float' else str(v))
+            for v, kind, skip in zip(values.tolist(), kinds, missing | slow)
+        ]
+
+    lengths = np.fromiter(map(len, text), dtype=np.int64, count=len(text))
+    width = int(min(max(lengths.max(initial=0), 1), _MAX_WIDTH))
+    codes = np.array(text, dtype=f'U{width}')
+
+    last10 = np.zeros(len(text), dtype=np.int64)
+    valid = np.zeros(len(text), dtype=bool)
+    for start in range(0, len(text), _CHUNK_ROWS):
+        rows = slice(start, start + _CHUNK_ROWS)
+        chars = codes[rows].view(np.uint32).reshape(-1, width)
+        last10[rows], valid[rows], chunk_blank, chunk_slow = _scan_digits(chars, lengths[rows])
+        missing[rows] |= chunk_blank
+        slow[rows] |= chunk_slow
+
+    formatted = _assemble(last10, valid & ~missing & ~slow)
+    if slow.any():
+        formatted[slow] = [format_phone_number(v) for v in values[slow]]
+    return formatted
+
+
+def _scan_digits(chars, lengths):
+    """
+    Apply the format_phone_number rules to a block of fixed-width code points
+    Returns (last 10 digits as int, valid, blank, needs scalar fallback) per row
+    """
+    # Column-major ASCII codes, with 128 standing in for any non-ASCII character
+    codes = np.ascontiguousarray(np.minimum(chars, 128).astype(np.uint8).T)
+    rows = codes.shape[1]
+
+    blank = _BLANK[codes].all(axis=0)
+
+    # Rows longer than the array width or ending in NUL characters do not
+    # survive the fixed-width array intact; non-ASCII digits need str.isdigit
+    filled = codes != 0
+    stored = np.where(filled.any(axis=0), codes.shape[0] - filled[::-1].argmax(axis=0), 0)
+    needs_scalar = (stored != lengths) | (codes == 128).any(axis=0)
+
+    digit = _DIGIT_VALUE[codes]
+    is_digit = digit >= 0
+    # rank = number of digits at or right of each position, so the last digit has rank 1
+    rank = np.cumsum(is_digit[::-1], axis=0, dtype=np.int8)[::-1]
+    length = rank[0].astype(np.int64)
+    first = digit[is_digit.argmax(axis=0), np.arange(rows)]
+
+    # Horner's rule column by column over the last 10 and the 2 digits before them
+    last10 = np.zeros(rows, dtype=np.int64)
+    country = np.zeros(rows, dtype=np.int64)
+    for col_digit, col_rank in zip(digit, rank):
+        in_last10 = (col_digit >= 0) & (col_rank <= 10)
+        in_country = (col_digit >= 0) & ((col_rank == 11) | (col_rank == 12))
+        last10 = np.where(in_last10, last10 * 10 + col_digit, last10)
+        country = np.where(in_country, country * 10 + col_digit, country)
+
+    valid = (
+        (length <= 10) |
+        (length == 12) |
+        ((length == 11) & (first == 0)) |
+        ((length > 12) & (country == COUNTRY_CODE))
+    )
+    return last10, valid, blank, needs_scalar
+
+
+def _assemble(last10, valid):
+    # Every valid result is the country code followed by the last 10 digits
+    formatted = np.full(len(last10), None, dtype=object)
+    formatted[valid] = [str(_PREFIX + n) for n in last10[valid].tolist()]
+    return pd.Series(formatted, dtype=object)
+
+
+def _value_kind(value):
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, (str, int, np.integer)) and not isinstance(value, bool):
+        return 'plain'
+    return 'other'
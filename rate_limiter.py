@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import deque
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket pacing the sends of one WhatsApp session
+
+    Tokens refill continuously at the current rate, so sends are spread
+    evenly; up to burst tokens can accumulate while the session is idle.
+    report() feeds back the outcome of each send: once min_samples sends
+    have come back, whenever the failure ratio or the mean latency of the
+    recent sends (up to window of them) crosses its threshold, or as soon
+    as max_consecutive_failures sends in a row failed, the rate is halved
+    (down to min_fraction of the configured rate). After each further window
+    of healthy sends it climbs back by recovery_step of the configured rate.
+    rate_per_minute of 0 disables pacing.
+    """
+
+    def __init__(self, rate_per_minute=30, burst=3, window=20, max_failure_ratio=0.3, slow_seconds=15,
+                 min_fraction=0.1, recovery_step=0.1, min_samples=5, max_consecutive_failures=3):
+        self.cond = threading.Condition()
+        self.window = window
+        self.min_samples = min(min_samples, window)
+        self.max_consecutive_failures = max_consecutive_failures
+        self.consecutive_failures = 0
+        self.max_failure_ratio = max_failure_ratio
+        self.slow_seconds = slow_seconds
+        self.min_fraction = min_fraction
+        self.recovery_step = recovery_step
+        self.outcomes = deque(maxlen=window)
+        self.configure(rate_per_minute, burst)
+
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.backoffs = 0
+        self.recoveries = 0
+
+    def configure(self, rate_per_minute, burst=None):
+        """Set the target rate (and burst); resets any backoff"""
+        with self.cond:
+            self.base_rate = max(float(rate_per_minute), 0.0)
+            self.rate = self.base_rate
+            if burst is not None:
+                self.burst = max(int(burst), 1)
+            self.tokens = float(self.burst)
+            self.updated_at = time.monotonic()
+            self.outcomes.clear()
+            self.consecutive_failures = 0
+            self.cond.notify_all()
+
+    def acquire(self, timeout=None):
+        """Take one send slot, waiting for it; returns False if timeout expires first"""
+        start = time.monotonic()
+        with self.cond:
+            while True:
+                if self.rate <= 0:
+                    break
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                wait = (1 - self.tokens) * 60 / self.rate
+                if timeout is not None:
+                    remaining = start + timeout - time.monotonic()
+                    if remaining <= 0:
+                        self.waited_seconds += time.monotonic() - start
+                        return False
+                    wait = min(wait, remaining)
+                self.cond.wait(wait)
+            self.acquired += 1
+            self.waited_seconds += time.monotonic() - start
+        return True
+
+    def report(self, success, latency):
+        """Record the outcome of a send and adapt the rate"""
+        with self.cond:
+            if self.base_rate <= 0:
+                return
+            self.outcomes.append((bool(success), latency))
+            self.consecutive_failures = 0 if success else self.consecutive_failures + 1
+            # A throttled session is slowed down after a few sends, not a whole window
+            throttled = self.consecutive_failures >= self.max_consecutive_failures
+            if len(self.outcomes) < self.min_samples and not throttled:
+                return
+            failures = sum(1 for ok, _ in self.outcomes if not ok)
+            mean_latency = sum(seconds for _, seconds in self.outcomes) / len(self.outcomes)
+
+            if throttled or failures / len(self.outcomes) > self.max_failure_ratio or mean_latency > self.slow_seconds:
+                floor = self.base_rate * self.min_fraction
+                if self.rate > floor:
+                    self._set_rate(max(self.rate / 2, floor))
+                    self.backoffs += 1
+                    print(f"Send rate backed off to {self.rate:.1f}/min "
+                          f"({failures} of {len(self.outcomes)} failed, mean {mean_latency:.1f}s)")
+            elif len(self.outcomes) < self.window:
+                # Recovering takes a whole window of healthy sends
+                return
+            elif self.rate < self.base_rate:
+                self._set_rate(min(self.rate + self.base_rate * self.recovery_step, self.base_rate))
+                self.recoveries += 1
+            # Judge the new rate on fresh sends only
+            self.outcomes.clear()
+            self.consecutive_failures = 0
+
+    def stats(self):
+        with self.cond:
+            self._refill()
+            return {
+                "rate_per_minute": round(self.rate, 2),
+                "configured_rate_per_minute": self.base_rate,
+                "burst": self.burst,
+                "tokens": round(self.tokens, 2),
+                "acquired": self.acquired,
+                "waited_seconds": round(self.waited_seconds, 1),
+                "backoffs": self.backoffs,
+                "recoveries": self.recoveries
+            }
+
+    def _refill(self):
+        # Caller must hold self.cond
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate / 60)
+        self.updated_at = now
+
+    def _set_rate(self, rate):
+        # Caller must hold self.cond
+        self._refill()
+        self.rate = rate
+        self.cond.notify_all()
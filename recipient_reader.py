@@ -0,0 +1,229 @@
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from phone_utils import detect_phone_column, normalize_phone_series
+
+# Rows read per chunk when streaming an upload
+CHUNK_SIZE = 5000
+# Invalid rows kept for the response; the rest are only counted
+MAX_INVALID_REPORT = 1000
+
+
+def iter_file_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Yield an uploaded CSV/Excel file as DataFrames of at most chunk_size rows
+    CSV is read with the pandas chunked reader, xlsx through openpyxl's
+    read-only row iterator, so only one chunk is in memory at a time
+    """
+    if file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=chunk_size)
+    elif file_path.endswith('.xlsx'):
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+            batch = []
+            for row in rows:
+                batch.append(row[:len(columns)])
+                if len(batch) >= chunk_size:
+                    yield pd.DataFrame(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=columns)
+        finally:
+            wb.close()
+    elif file_path.endswith('.xls'):
+        # Legacy .xls has no streaming reader
+        yield pd.read_excel(file_path)
+    else:
+        raise ValueError("Unsupported file format. Use CSV or Excel.")
+
+
+def count_data_rows(file_path):
+    """
+    Cheap estimate of the number of data rows in an upload, or None
+    CSV counts line breaks without parsing; xlsx uses the sheet dimensions
+    """
+    try:
+        if file_path.endswith('.csv'):
+            lines = 0
+            last = b''
+            with open(file_path, 'rb') as f:
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        break
+                    lines += block.count(b'\n')
+                    last = block[-1:]
+            if last and last != b'\n':
+                lines += 1
+            return max(lines - 1, 0)
+        if file_path.endswith('.xlsx'):
+            wb = load_workbook(file_path, read_only=True)
+            try:
+                max_row = wb.active.max_row
+            finally:
+                wb.close()
+            return max(max_row - 1, 0) if max_row else None
+    except Exception as e:
+        print(f"Error counting rows in {file_path}: {str(e)}")
+    return None
+
+
+class RecipientStream:
+    """
+    Normalized recipients from an uploaded file, produced chunk by chunk
+
+    open() reads the first chunk and picks the phone column; iterating then
+    yields formatted phone numbers as the file is read, so sending can start
+    before the rest of the file has been parsed. Invalid rows are counted
+    (and the first MAX_INVALID_REPORT kept) as they are encountered.
+    on_chunk, if given, is called with (phones, rows, phone_column) for
+    every chunk with valid numbers, e.g. to merge them into the contact store.
+    """
+
+    def __init__(self, file_path, chunk_size=CHUNK_SIZE, cleanup=False, on_chunk=None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.cleanup = cleanup
+        self.on_chunk = on_chunk
+        self.columns = []
+        self.phone_column = None
+        self.phone_confidence = None
+        self.total_rows = None
+        self.rows_read = 0
+        self.valid_count = 0
+        self.invalid_count = 0
+        self.invalid_numbers = []
+        self.finished = False
+        self._chunks = None
+        self._first = None
+
+    def open(self):
+        """Read the first chunk and detect the phone column; raises ValueError for empty files"""
+        try:
+            self._chunks = iter_file_chunks(self.file_path, self.chunk_size)
+            self._first = next(self._chunks, None)
+            if self._first is None or self._first.empty or len(self._first.columns) == 0:
+                raise ValueError("File is empty or has no columns")
+            self.columns = list(self._first.columns)
+            self.phone_column, self.phone_confidence = detect_phone_column(self._first)
+            self.total_rows = count_data_rows(self.file_path)
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def chunks(self):
+        """Yield (phones, rows) per chunk: the valid formatted numbers and their source rows"""
+        if self._chunks is None:
+            self.open()
+        try:
+            chunk = self._first
+            self._first = None
+            while chunk is not None:
+                formatted, invalid_numbers = normalize_phone_series(
+                    chunk[self.phone_column], first_row=self.rows_read + 2
+                )
+                self.rows_read += len(chunk)
+                self.invalid_count += len(invalid_numbers)
+                room = MAX_INVALID_REPORT - len(self.invalid_numbers)
+                if room > 0:
+                    self.invalid_numbers.extend(invalid_numbers[:room])
+
+                valid = formatted.notna()
+                self.valid_count += int(valid.sum())
+                if valid.any():
+                    if self.on_chunk:
+                        try:
+                            self.on_chunk(formatted[valid], chunk[valid], self.phone_column)
+                        except Exception as e:
+                            print(f"Error merging rows from {self.file_path}: {str(e)}")
+                    yield formatted[valid], chunk[valid]
+                chunk = next(self._chunks, None)
+            self.finished = True
+        finally:
+            self.close()
+
+    def estimated_total(self):
+        """Valid recipients found so far plus the rows not read yet, or None if unknown"""
+        if self.finished:
+            return self.valid_count
+        if self.total_rows is None:
+            return None
+        return self.valid_count + max(self.total_rows - self.rows_read, 0)
+
+    def __iter__(self):
+        for phones, _ in self.chunks():
+            yield from phones.tolist()
+
+    def iter_messages(self, template):
+        """Yield (phone, message) pairs, rendering template (a MessageTemplate) a chunk at a time"""
+        for phones, rows in self.chunks():
+            yield from zip(phones.tolist(), template.render(rows))
+
+    def close(self):
+        if self._chunks is not None:
+            self._chunks.close()
+        if self.cleanup and os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+
+class RecipientList:
+    """
+    Recipients given as a list (e.g. by an MCP tool call) instead of an upload
+
+    Offers the RecipientStream interface. Items are phone numbers, or dicts
+    with a "phone" key whose other keys are columns for message templates.
+    open() formats every number at once; invalid items are reported by
+    position ("Row 1" is the first item).
+    """
+
+    def __init__(self, items, chunk_size=CHUNK_SIZE):
+        records = [
+            dict(item, phone=str(item.get("phone") or '')) if isinstance(item, dict) else {"phone": str(item)}
+            for item in items
+        ]
+        self.rows = pd.DataFrame.from_records(records) if records else pd.DataFrame(columns=['phone'])
+        self.chunk_size = chunk_size
+        self.columns = list(self.rows.columns)
+        self.phone_column = 'phone'
+        self.invalid_count = 0
+        self.invalid_numbers = []
+        self.phones = None
+
+    def open(self):
+        formatted, invalid_numbers = normalize_phone_series(self.rows['phone'], first_row=1)
+        self.invalid_count = len(invalid_numbers)
+        self.invalid_numbers = invalid_numbers[:MAX_INVALID_REPORT]
+        valid = formatted.notna().to_numpy()
+        self.phones = formatted[valid].reset_index(drop=True)
+        self.rows = self.rows[valid].reset_index(drop=True)
+        return self
+
+    def chunks(self):
+        """Yield (phones, rows) per chunk of the valid recipients"""
+        if self.phones is None:
+            self.open()
+        for start in range(0, len(self.phones), self.chunk_size):
+            yield self.phones[start:start + self.chunk_size], self.rows[start:start + self.chunk_size]
+
+    def estimated_total(self):
+        return len(self.phones) if self.phones is not None else None
+
+    def __iter__(self):
+        for phones, _ in self.chunks():
+            yield from phones.tolist()
+
+    def iter_messages(self, template):
+        """Yield (phone, message) pairs, rendering template (a MessageTemplate) a chunk at a time"""
+        for phones, rows in self.chunks():
+            yield from zip(phones.tolist(), template.render(rows))
+
+    def close(self):
+        pass
@@ -0,0 +1,26 @@
+import psutil
+
+
+def process_tree_memory(pid):
+    """
+    Resident memory of a process and all of its descendants
+    For a chromedriver pid this covers the Chrome browser, GPU/utility and
+    renderer processes it started. Returns {"rss_mb", "processes", "renderers"}.
+    """
+    root = psutil.Process(pid)
+    rss = 0
+    processes = 0
+    renderers = 0
+    for proc in [root] + root.children(recursive=True):
+        try:
+            rss += proc.memory_info().rss
+            processes += 1
+            if '--type=renderer' in proc.cmdline():
+                renderers += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return {
+        "rss_mb": round(rss / (1024 * 1024), 1),
+        "processes": processes,
+        "renderers": renderers
+    }
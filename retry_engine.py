@@ -0,0 +1,143 @@
+import random
+import time
+
+# Failure classes reported in send results ("failure")
+TIMEOUT = 'timeout'
+INVALID_NUMBER = 'invalid_number'
+SESSION_LOST = 'session_lost'
+UI_CHANGED = 'ui_changed'
+# Retrying cannot help: the number is not on WhatsApp, or the page no longer
+# has the elements the bot looks for
+PERMANENT_FAILURES = (INVALID_NUMBER, UI_CHANGED)
+
+
+class SendFailure(Exception):
+    """A send failure whose class is already known"""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+class RetryingDispatch:
+    """
+    Wraps a dispatch function (see BotPool.dispatch) with a retry queue
+
+    The main pass goes through every recipient once. Transient failures
+    (timeouts, lost sessions) are queued and retried after it, each one
+    waiting base_delay * 2 ** (attempt - 1) seconds (at most max_delay),
+    scaled by a random factor in [1 - jitter, 1] so retries do not arrive
+    in lockstep. Permanent failures are reported at once and never retried,
+    and so are failures after the send button was clicked (stage "confirm"),
+    since the message may have gone out. Only final results are yielded;
+    each carries the number of attempts made.
+    """
+
+    def __init__(self, dispatch, max_attempts=3, base_delay=30, max_delay=600, jitter=0.5):
+        self.dispatch = dispatch
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+        self.scheduled = 0
+        self.retried = 0
+        self.recovered = 0
+        self.permanent = 0
+        self.exhausted = 0
+        self.waiting = 0
+        self.failures = {}
+
+    def retryable(self, result):
+        if result.get("status") == "success" or result.get("stage") == 'confirm':
+            return False
+        return result.get("failure") not in PERMANENT_FAILURES
+
+    def delay(self, attempt):
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1)
+
+    def __call__(self, recipients, message, gate=None):
+        attempts = {}
+        retry = []
+        for result in self._pass(recipients, message, gate, attempts, retry):
+            yield result
+
+        while retry:
+            # Recipients are handed to the dispatcher as their backoff expires
+            due = sorted(
+                ((time.monotonic() + self.delay(attempts[self._phone(item)]), item) for item in retry),
+                key=lambda entry: entry[0]
+            )
+            retry = []
+            self.waiting = len(due)
+            for result in self._pass(self._when_due(due, gate), message, gate, attempts, retry):
+                yield result
+            self.waiting = 0
+
+    def stats(self):
+        return {
+            "retries_scheduled": self.scheduled,
+            "retries_sent": self.retried,
+            "recovered_by_retry": self.recovered,
+            "waiting_for_retry": self.waiting,
+            "dropped_permanent": self.permanent,
+            "retries_exhausted": self.exhausted,
+            "failures_by_class": dict(self.failures)
+        }
+
+    def _pass(self, recipients, message, gate, attempts, retry):
+        # Recipients handed out and not reported yet, so a retry resends the same item
+        in_flight = {}
+
+        def track(items):
+            for item in items:
+                in_flight[self._phone(item)] = item
+                yield item
+
+        results = self.dispatch(track(recipients), message, gate)
+        try:
+            for result in results:
+                phone = result.get("phone")
+                item = in_flight.pop(phone, phone)
+                attempts[phone] = attempts.get(phone, 0) + 1
+                result["attempts"] = attempts[phone]
+                if result.get("status") == "success":
+                    if attempts[phone] > 1:
+                        self.recovered += 1
+                    yield result
+                    continue
+
+                kind = result.get("failure") or 'unknown'
+                self.failures[kind] = self.failures.get(kind, 0) + 1
+                if not self.retryable(result):
+                    if kind in PERMANENT_FAILURES:
+                        self.permanent += 1
+                    yield result
+                elif attempts[phone] >= self.max_attempts:
+                    self.exhausted += 1
+                    yield result
+                else:
+                    self.scheduled += 1
+                    retry.append(item)
+        finally:
+            close = getattr(results, 'close', None)
+            if close:
+                close()
+
+    @staticmethod
+    def _phone(item):
+        return item[0] if isinstance(item, tuple) else item
+
+    def _when_due(self, due, gate):
+        for when, item in due:
+            while True:
+                remaining = when - time.monotonic()
+                if gate and not gate():
+                    return
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, 0.5))
+            self.waiting -= 1
+            self.retried += 1
+            yield item
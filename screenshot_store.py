@@ -0,0 +1,315 @@
+import io
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from PIL import Image, features
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS screenshot_files (
+    name TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    dhash INTEGER,
+    reason TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_screenshot_files_created ON screenshot_files (created_at);
+CREATE TABLE IF NOT EXISTS screenshots (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    kind TEXT,
+    phone TEXT,
+    reason TEXT,
+    file TEXT,
+    duplicate_of TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_screenshots_file ON screenshots (file);
+"""
+
+# Image types kept in the folder, counted towards the disk cap
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Sentinel pushed on the queue to stop the worker thread
+_STOP = object()
+
+
+def dhash(image, size=8):
+    """64-bit difference hash: which neighbouring pixels of a 9x8 grayscale thumbnail get brighter"""
+    pixels = list(image.convert('L').resize((size + 1, size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            offset = row * (size + 1) + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hash_distance(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count('1')
+
+
+class ScreenshotStore:
+    """
+    Failure screenshots, encoded and written off the send thread into a capped folder
+
+    capture() only grabs the raw PNG from the browser and queues it; it
+    returns the screenshot id at once, so the caller can link it to its log
+    record. A single worker thread decodes each image and compares its
+    difference hash with the last images kept for the same reason (failure
+    class): one within dedupe_distance bits of an earlier image is recorded
+    as a duplicate pointing at that file instead of being written again. Others are downscaled to max_width
+    and recompressed (WebP, or JPEG when Pillow has no WebP support). Once
+    the folder holds more than max_bytes the oldest files are deleted;
+    their ids are kept, marked evicted. When the queue is full the capture
+    is skipped, so a burst of failures never blocks the sends.
+    """
+
+    def __init__(self, folder, db_path, max_bytes=200 * 1024 * 1024, max_queue=32, max_width=1280, quality=60,
+                 dedupe_distance=4, dedupe_window=256, image_format='webp'):
+        self.folder = folder
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_width = max_width
+        self.quality = quality
+        self.dedupe_distance = dedupe_distance
+        if image_format == 'webp' and not features.check('webp'):
+            print("Pillow has no WebP support; failure screenshots are stored as JPEG")
+            image_format = 'jpeg'
+        self.image_format = image_format
+        self.extension = '.jpg' if image_format == 'jpeg' else f'.{image_format}'
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.recent = deque(maxlen=dedupe_window)
+        self.lock = threading.Lock()
+        self.thread = None
+
+        # Monitoring counters
+        self.captured = 0
+        self.written = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.errors = 0
+        self.total_bytes = 0
+        self.capture_seconds = 0.0
+        self.encode_seconds = 0.0
+
+        os.makedirs(folder, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._scan_folder()
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, name='screenshot-writer', daemon=True)
+        self.thread.start()
+
+    def capture(self, grab, kind='message', phone=None, reason=None):
+        """
+        Grab a screenshot with grab() (returning PNG bytes or None) and queue it for writing
+        Returns the screenshot id, or None when nothing was captured or the queue is full.
+        """
+        if self.queue.full():
+            self.dropped += 1
+            return None
+        start = time.perf_counter()
+        try:
+            png = grab()
+        except Exception as e:
+            print(f"Error capturing screenshot: {str(e)}")
+            png = None
+        self.capture_seconds += time.perf_counter() - start
+        if not png:
+            return None
+
+        screenshot_id = f"{kind}_error_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        try:
+            self.queue.put_nowait((screenshot_id, png, kind, phone, reason, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        self.captured += 1
+        return screenshot_id
+
+    def get(self, screenshot_id):
+        """The screenshot's record with the path of its image (None once evicted), or None if unknown"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT id, created_at, kind, phone, reason, file, duplicate_of FROM screenshots WHERE id = ?',
+                (screenshot_id,)
+            ).fetchone()
+        if not row:
+            return None
+        record = dict(zip(['id', 'created_at', 'kind', 'phone', 'reason', 'file', 'duplicate_of'], row))
+        record['created_at'] = datetime.fromtimestamp(record['created_at']).isoformat(timespec='seconds')
+        record['path'] = os.path.join(self.folder, record['file']) if record['file'] else None
+        return record
+
+    def recent_screenshots(self, limit=50):
+        with self.lock:
+            ids = [row[0] for row in self.conn.execute(
+                'SELECT id FROM screenshots ORDER BY created_at DESC LIMIT ?', (int(limit),)
+            )]
+        return [self.get(screenshot_id) for screenshot_id in ids]
+
+    def flush(self, timeout=10.0):
+        """Wait until every queued screenshot has been processed; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=10.0):
+        """Process the queued screenshots and stop the worker thread"""
+        if not self.thread or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "captured": self.captured,
+            "written": self.written,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "errors": self.errors,
+            "disk_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "avg_capture_ms": round(self.capture_seconds / self.captured * 1000, 1) if self.captured else None,
+            "avg_encode_ms": round(self.encode_seconds / self.written * 1000, 1) if self.written else None
+        }
+
+    def _scan_folder(self):
+        # Count files already in the folder (earlier runs, or screenshots from before the cap) towards it
+        with self.lock:
+            known = {row[0] for row in self.conn.execute('SELECT name FROM screenshot_files')}
+            rows = []
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.name not in known:
+                    stat = entry.stat()
+                    rows.append((entry.name, stat.st_size, stat.st_mtime))
+            if rows:
+                self.conn.executemany(
+                    'INSERT INTO screenshot_files (name, bytes, created_at) VALUES (?, ?, ?)', rows
+                )
+            self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM screenshot_files').fetchone()[0]
+            self.recent.extend(self.conn.execute(
+                'SELECT dhash, name, reason FROM (SELECT dhash, name, reason, created_at FROM screenshot_files '
+                'WHERE dhash IS NOT NULL ORDER BY created_at DESC LIMIT ?) ORDER BY created_at',
+                (self.recent.maxlen,)
+            ))
+        self._evict()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._process(*item)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error writing screenshot: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def _process(self, screenshot_id, png, kind, phone, reason, created_at):
+        start = time.perf_counter()
+        image = Image.open(io.BytesIO(png))
+        image.load()
+        image_hash = dhash(image)
+
+        duplicate = next((
+            (name, original) for value, name, original in self._recent_files(reason)
+            if hash_distance(value, image_hash) <= self.dedupe_distance
+        ), None)
+        if duplicate:
+            name, original = duplicate
+            with self.lock:
+                self.conn.execute(
+                    'INSERT INTO screenshots (id, created_at, kind, phone, reason, file, duplicate_of) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (screenshot_id, created_at, kind, phone, reason, name, original)
+                )
+            self.deduplicated += 1
+            return
+
+        if image.width > self.max_width:
+            image = image.resize((self.max_width, round(image.height * self.max_width / image.width)), Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options = {"method": 4} if self.image_format == 'webp' else {"optimize": True}
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format, quality=self.quality, **options)
+        data = buffer.getvalue()
+
+        name = screenshot_id + self.extension
+        path = os.path.join(self.folder, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.execute(
+                    'INSERT INTO screenshot_files (name, bytes, dhash, reason, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (name, len(data), image_hash, reason, created_at)
+                )
+                self.conn.execute(
+                    'INSERT INTO screenshots (id, created_at, kind, phone, reason, file, duplicate_of) '
+                    'VALUES (?, ?, ?, ?, ?, ?, NULL)',
+                    (screenshot_id, created_at, kind, phone, reason, name)
+                )
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.total_bytes += len(data)
+            self.recent.append((image_hash, name, reason))
+        self.written += 1
+        self.encode_seconds += time.perf_counter() - start
+        self._evict()
+
+    def _recent_files(self, reason):
+        # (hash, file name, id of the screenshot that wrote it) of the files kept for reason, newest first
+        with self.lock:
+            recent = list(self.recent)
+        return [(value, name, os.path.splitext(name)[0]) for value, name, kept_for in reversed(recent)
+                if kept_for == reason]
+
+    def _evict(self):
+        # Delete the oldest files until the folder fits in max_bytes
+        while self.total_bytes > self.max_bytes:
+            with self.lock:
+                row = self.conn.execute(
+                    'SELECT name, bytes FROM screenshot_files ORDER BY created_at LIMIT 1'
+                ).fetchone()
+                if not row:
+                    self.total_bytes = 0
+                    return
+                name, size = row
+                self.conn.execute('BEGIN')
+                self.conn.execute('DELETE FROM screenshot_files WHERE name = ?', (name,))
+                self.conn.execute('UPDATE screenshots SET file = NULL WHERE file = ?', (name,))
+                self.conn.execute('COMMIT')
+                self.total_bytes -= size
+                self.recent = deque((entry for entry in self.recent if entry[1] != name), maxlen=self.recent.maxlen)
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            self.evicted += 1
@@ -0,0 +1,167 @@
+import bisect
+import math
+import threading
+
+# Upper bounds (seconds) of the latency histograms: from a log write enqueue to the 30 s WebDriverWait timeouts
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        # One bucket is incremented here; the cumulative counts are only built when scraped
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+class Metric:
+    """
+    A counter, gauge or histogram family, with one child per label combination
+    Recorded metrics are updated with labels(...).inc() or .observe(); a
+    metric with a callback is computed when scraped instead, the callback
+    returning a number or a dict of label value tuples to numbers.
+    """
+
+    def __init__(self, name, help_text, kind, labelnames=(), callback=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.buckets = tuple(sorted(buckets))
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = _HistogramChild(self.buckets) if self.kind == 'histogram' else _CounterChild()
+                    self.children[values] = child
+        return child
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        """(suffix, label values, extra label, value) tuples of the current values"""
+        if self.callback:
+            value = self.callback()
+            if value is None:
+                return []
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            return [('', tuple(labels) if isinstance(labels, tuple) else (labels,), None, number)
+                    for labels, number in items if number is not None]
+
+        with self.lock:
+            children = list(self.children.items())
+        samples = []
+        for values, child in sorted(children):
+            if self.kind != 'histogram':
+                samples.append(('', values, None, child.value))
+                continue
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', values, ('le', _format_value(float(bound))), cumulative))
+            samples.append(('_sum', values, None, total))
+            samples.append(('_count', values, None, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, rendered in the Prometheus text exposition format
+
+    Recording is a dict lookup, a bisect and a short lock per call, so it can
+    stay on the send path. Gauges of queues and sessions are callbacks
+    evaluated only when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), callback=None):
+        return self._add(Metric(name, help_text, 'counter', labelnames, callback))
+
+    def gauge(self, name, help_text, labelnames=(), callback=None):
+        return self._add(Metric(name, help_text, 'gauge', labelnames, callback))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Metric(name, help_text, 'histogram', labelnames, buckets=buckets))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, values, extra, value in samples:
+                labels = _format_labels(metric.labelnames, values, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,248 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+
+class _NullSpan:
+    """Stands in for a span when tracing is off or the current send is not traced"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def annotate(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Trace:
+    def __init__(self, sampled):
+        self.id = uuid.uuid4().hex[:16]
+        self.sampled = sampled
+        self.events = []
+        # Spans entered and not exited yet, innermost last
+        self.open_spans = []
+        self.error = False
+
+
+class _Span:
+    def __init__(self, tracer, name, args, trace, root):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.trace = trace
+        self.root = root
+
+    def __enter__(self):
+        self.trace.open_spans.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.trace.open_spans.pop()
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+            # Errors caught inside the trace (a fallback taken) do not make it a failed one
+            if self.root:
+                self.trace.error = True
+        self.tracer._event(self.trace, self.name, self.start, end, self.args)
+        if self.root:
+            self.tracer._finish(self.trace, end - self.start)
+        return False
+
+    def annotate(self, **args):
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    Opt-in per-send span trees, written to a rotating Chrome trace file
+
+    A span opened with root=True on a thread without a trace starts one
+    (one per send, or per request); spans opened while it runs are its
+    children, and add_span() records a child from timings already taken.
+    A finished trace is kept when it was sampled (sample_rate), took at
+    least slow_seconds or failed with keep_errors, so slow sends are
+    traced even at a low sample rate. The file is in the Chrome trace
+    event format (JSON array of complete events), which chrome://tracing
+    and Perfetto open directly; it is rotated to .1, .2, ... once it
+    reaches max_bytes. With none of sample_rate, slow_seconds and
+    keep_errors set, tracing is off and every span is a shared no-op.
+    """
+
+    def __init__(self, path=None, sample_rate=0.0, slow_seconds=0.0, keep_errors=False, max_bytes=20 * 1024 * 1024,
+                 backups=3):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.file = None
+        self.separator = ''
+        self.thread_names = set()
+        self.random = random.Random()
+        self.pid = os.getpid()
+        # Offset from perf_counter() to wall-clock time, so traces from different runs line up
+        self.clock_offset = time.time() - time.perf_counter()
+        self.traces_started = 0
+        self.traces_written = 0
+        self.write_errors = 0
+        self.configure(path, sample_rate, slow_seconds, keep_errors, max_bytes, backups)
+
+    def configure(self, path=None, sample_rate=0.0, slow_seconds=0.0, keep_errors=False, max_bytes=20 * 1024 * 1024,
+                  backups=3):
+        with self.lock:
+            self._close_file()
+            self.path = path
+            self.sample_rate = max(0.0, min(float(sample_rate), 1.0))
+            self.slow_seconds = float(slow_seconds)
+            self.keep_errors = keep_errors
+            self.max_bytes = max_bytes
+            self.backups = backups
+            self.enabled = bool(path) and (self.sample_rate > 0 or self.slow_seconds > 0 or keep_errors)
+
+    def span(self, name, root=False, **args):
+        """Context manager timing name as a child of the thread's trace; with root=True starts a trace if there is none"""
+        if not self.enabled:
+            return NULL_SPAN
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            if not root:
+                return NULL_SPAN
+            sampled = self.random.random() < self.sample_rate
+            if not sampled and self.slow_seconds <= 0 and not self.keep_errors:
+                return NULL_SPAN
+            trace = self.local.trace = _Trace(sampled)
+            self.traces_started += 1
+            args["trace_id"] = trace.id
+            return _Span(self, name, args, trace, True)
+        return _Span(self, name, args, trace, False)
+
+    def add_span(self, name, start, end, **args):
+        """Record a span of the thread's trace from two perf_counter() readings"""
+        trace = getattr(self.local, 'trace', None) if self.enabled else None
+        if trace is not None:
+            self._event(trace, name, start, end, args)
+
+    def annotate(self, **args):
+        """Attach args to the innermost open span of the thread's trace; an 'error' arg marks the trace as failed"""
+        trace = getattr(self.local, 'trace', None) if self.enabled else None
+        if trace is not None and trace.open_spans:
+            trace.open_spans[-1].args.update(args)
+            if args.get("error"):
+                trace.error = True
+
+    @property
+    def active(self):
+        """True when the current thread is inside a trace"""
+        return self.enabled and getattr(self.local, 'trace', None) is not None
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "slow_seconds": self.slow_seconds,
+            "traces_started": self.traces_started,
+            "traces_written": self.traces_written,
+            "write_errors": self.write_errors
+        }
+
+    def close(self):
+        with self.lock:
+            self._close_file()
+
+    def _event(self, trace, name, start, end, args):
+        trace.events.append((name, start, end, args))
+
+    def _finish(self, trace, seconds):
+        self.local.trace = None
+        if trace.sampled:
+            kept = 'sampled'
+        elif self.slow_seconds > 0 and seconds >= self.slow_seconds:
+            kept = 'slow'
+        elif self.keep_errors and trace.error:
+            kept = 'error'
+        else:
+            return
+
+        thread = threading.current_thread()
+        tid = thread.ident
+        events = []
+        for name, start, end, args in trace.events:
+            events.append({
+                "name": name,
+                "cat": "send",
+                "ph": "X",
+                "ts": round((start + self.clock_offset) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": self.pid,
+                "tid": tid,
+                "args": args
+            })
+        # The root span finishes last
+        events[-1]["args"]["kept"] = kept
+        self._write(events, tid, thread.name)
+
+    def _write(self, events, tid, thread_name):
+        with self.lock:
+            try:
+                if self.file is None:
+                    self._open_file()
+                elif self.file.tell() >= self.max_bytes:
+                    self._rotate()
+                if tid not in self.thread_names:
+                    self.thread_names.add(tid)
+                    events = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                               "args": {"name": thread_name}}] + events
+                self.file.write(self.separator + ',\n'.join(json.dumps(event, default=str) for event in events))
+                self.separator = ',\n'
+                self.file.flush()
+                self.traces_written += 1
+            except Exception as e:
+                self.write_errors += 1
+                print(f"Error writing send trace: {str(e)}")
+
+    def _open_file(self):
+        # Caller holds the lock. The array is never closed: trace viewers accept a missing ']'
+        # (but not a trailing comma, so events are separated before, not after)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if self.file.tell() == 0:
+            self.file.write('[\n')
+            self.separator = ''
+        else:
+            self.separator = ',\n'
+        self.thread_names = set()
+
+    def _rotate(self):
+        # Caller holds the lock
+        self._close_file()
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open_file()
+
+    def _close_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+
+
+# The process-wide tracer; app.py configures it from TRACE_* settings
+tracer = Tracer()
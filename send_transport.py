@@ -0,0 +1,179 @@
+import json
+import os
+import time
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from retry_engine import SendFailure, TIMEOUT, INVALID_NUMBER, SESSION_LOST, UI_CHANGED
+from send_tracing import tracer
+
+
+class SendTransport:
+    """
+    How a WhatsAppBot reaches WhatsApp: one session, one chat at a time
+
+    A send goes through stages, each its own call so failures and latency
+    can be attributed to a stage: open_chat() opens the chat with the
+    message pre-filled, compose() waits until it can be sent (or attach()
+    attaches an image with its caption instead), click() sends it and
+    confirm() waits for the first acknowledgement. driver is
+    the underlying browser or connection, None while the transport is not
+    started.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.driver = None
+
+    def start(self):
+        """Connect and log in; returns True once messages can be sent"""
+        raise NotImplementedError
+
+    def open_chat(self, phone, message):
+        """Open the chat with phone, message pre-filled; returns the navigation mode used"""
+        raise NotImplementedError
+
+    def compose(self, timeout):
+        """Wait until the pre-filled message can be sent"""
+        raise NotImplementedError
+
+    def attach(self, path, caption, timeout):
+        """Attach the image file at path to the open chat, with caption, ready to be sent"""
+        raise NotImplementedError
+
+    def click(self):
+        """Send the composed message"""
+        raise NotImplementedError
+
+    def confirm(self, timeout):
+        """Wait for the first acknowledgement of the message just sent; returns 'pending', 'sent' or 'delivered'"""
+        raise NotImplementedError
+
+    def session_state(self):
+        """Cheap health probe: 'ready', 'qr' (logged out), 'loading' or 'dead'"""
+        raise NotImplementedError
+
+    def classify_failure(self, error, stage):
+        """Failure class of a send that raised error during stage (see retry_engine)"""
+        if isinstance(error, SendFailure):
+            return error.kind
+        if self.session_state() in ('dead', 'qr'):
+            return SESSION_LOST
+        return TIMEOUT
+
+    def capture_screenshot(self):
+        """PNG bytes of what the session shows, for failure reports; None if there is nothing to show"""
+        return None
+
+    def memory_stats(self):
+        return None
+
+    def close(self):
+        self.driver = None
+
+
+class HttpTransport(SendTransport):
+    """
+    Sends straight to a fake_whatsapp.py server over its JSON API, without a browser
+
+    The server applies the same latency and failure injection as to its
+    mock page, so the pipeline around the transport (parsing, scheduling,
+    retries, logging, concurrency) can be load-tested offline and without
+    Chrome. Not for real WhatsApp.
+    """
+
+    name = 'http'
+
+    def __init__(self, base_url, request_timeout=10):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+        self.request_timeout = request_timeout
+        self.chat = None
+        self.sending = None
+        self.uploaded = set()
+
+    def start(self):
+        state = self.session_state()
+        if state != 'ready':
+            print(f"Fake WhatsApp at {self.base_url} is not ready ({state})")
+            return False
+        self.driver = self.base_url
+        return True
+
+    def open_chat(self, phone, message):
+        self.chat = dict(self._call('GET', '/api/chat', {"phone": phone, "text": message}), phone=phone, text=message)
+        return 'http'
+
+    def compose(self, timeout):
+        outcome = self.chat.get("outcome")
+        if outcome == INVALID_NUMBER:
+            raise SendFailure(INVALID_NUMBER, "Phone number is not on WhatsApp")
+        if outcome == UI_CHANGED:
+            raise SendFailure(UI_CHANGED, "Message composer not found")
+
+    def attach(self, path, caption, timeout):
+        self.compose(timeout)
+        # Each image is uploaded to the server once per session; sends refer to it by its hash
+        key = os.path.splitext(os.path.basename(path))[0]
+        if key not in self.uploaded:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self._call('PUT', f'/api/media/{key}', raw=data, timeout=timeout)
+            self.uploaded.add(key)
+        self.chat.update(text=caption, media=key)
+
+    def click(self):
+        # The server acknowledges in the reply to the send, so the request is made by confirm()
+        self.sending, self.chat = self.chat, None
+
+    def confirm(self, timeout):
+        chat, self.sending = self.sending, None
+        payload = {"phone": chat["phone"], "text": chat["text"]}
+        if chat.get("media"):
+            payload["media"] = chat["media"]
+        reply = self._call('POST', '/api/send', payload, timeout=timeout)
+        if reply.get("status") != 'sent':
+            raise TimeoutError(f"No acknowledgement within {timeout}s")
+        return 'sent'
+
+    def session_state(self):
+        try:
+            return 'ready' if self._call('GET', '/api/state', timeout=2).get("logged_in") else 'qr'
+        except Exception:
+            return 'dead'
+
+    def capture_screenshot(self):
+        with tracer.span('GET /api/screenshot'), urlopen(self.base_url + '/api/screenshot',
+                                                         timeout=self.request_timeout) as response:
+            return response.read()
+
+    def _call(self, method, path, params=None, timeout=None, raw=None):
+        url = self.base_url + path
+        data = raw
+        content_type = "application/octet-stream" if raw is not None else "application/json"
+        if method == 'GET' and params:
+            url += '?' + urlencode(params)
+        elif params is not None:
+            data = json.dumps(params).encode('utf-8')
+        request = Request(url, data=data, method=method, headers={"Content-Type": content_type})
+        try:
+            with tracer.span(f"{method} {path}"), urlopen(request, timeout=timeout or self.request_timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except URLError as e:
+            # A socket timeout surfaces as URLError(reason=timeout)
+            if isinstance(e.reason, TimeoutError):
+                raise TimeoutError(str(e.reason))
+            raise
+
+
+def wait_for_server(base_url, timeout=10):
+    """Wait until a fake_whatsapp.py server answers; returns False if it does not within timeout"""
+    transport = HttpTransport(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if transport.session_state() != 'dead':
+            return True
+        time.sleep(0.1)
+    return False
@@ -0,0 +1,146 @@
+import threading
+import time
+
+# Session states reported by WhatsAppBot.session_state()
+READY = 'ready'
+QR = 'qr'
+LOADING = 'loading'
+DEAD = 'dead'
+
+
+class SessionMonitor:
+    """
+    Background health checker for the sessions of a BotPool
+
+    Every interval seconds each idle session is probed with one cheap script
+    call (bot.session_state()). A dead browser, or one still loading after
+    loading_grace probes in a row, is restarted with the same Chrome profile
+    so the linked WhatsApp login survives. A session showing the QR code was
+    logged out from the phone; it is taken out of rotation until it is linked
+    again in its browser window. Sessions busy sending are skipped, and while
+    a session is down the pool leaves its recipients to the others (or holds
+    them until it is back).
+    """
+
+    def __init__(self, pool, interval=30, loading_grace=3):
+        self.pool = pool
+        self.interval = interval
+        self.loading_grace = loading_grace
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.checks = 0
+        pool.monitor = self
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name='session-monitor', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        self.stopping = True
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout)
+        if self.pool.monitor is self:
+            self.pool.monitor = None
+
+    def check(self):
+        """Probe every session once, restarting the ones that need it"""
+        self.checks += 1
+        for worker in self.pool.workers:
+            if self.stopping:
+                return
+            try:
+                self._check_worker(worker)
+            except Exception as e:
+                print(f"Error checking session {worker.index}: {str(e)}")
+
+    def session_lost(self, worker):
+        """
+        Called by the pool after a failed send: True if the session itself is
+        gone (the recipient should be retried), in which case it is taken out
+        of rotation and the monitor wakes up to recover it
+        """
+        state = worker.bot.session_state()
+        if state not in (DEAD, QR):
+            return False
+        self._mark_down(worker, state)
+        self.wake.set()
+        return True
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval,
+            "checks": self.checks,
+            "running": bool(self.thread and self.thread.is_alive())
+        }
+
+    def _run(self):
+        while not self.stopping:
+            self.check()
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def _check_worker(self, worker):
+        bot = worker.bot
+        # A session in the middle of a send is alive; probe it next time
+        if not bot.lock.acquire(blocking=False):
+            return
+        try:
+            state = bot.session_state()
+            worker.health = state
+            worker.last_probe_at = time.time()
+
+            if state == READY:
+                worker.loading_probes = 0
+                self._mark_up(worker)
+            elif state == QR:
+                worker.loading_probes = 0
+                self._mark_down(worker, QR)
+            elif state == LOADING:
+                worker.loading_probes += 1
+                if worker.loading_probes >= self.loading_grace:
+                    self._restart(worker, 'stuck loading')
+            else:
+                self._restart(worker, 'browser not responding')
+        finally:
+            bot.lock.release()
+
+    def _restart(self, worker, reason):
+        # Caller holds the bot lock, so queued sends wait for the new browser
+        self._mark_down(worker, worker.health)
+        print(f"Restarting session {worker.index}: {reason}")
+        worker.restarts += 1
+        worker.last_restart_reason = reason
+        worker.loading_probes = 0
+        try:
+            if worker.bot.restart():
+                worker.health = READY
+                self._mark_up(worker)
+                return
+        except Exception as e:
+            print(f"Error restarting session {worker.index}: {str(e)}")
+        worker.restart_failures += 1
+        worker.health = worker.bot.session_state()
+        if worker.health == READY:
+            self._mark_up(worker)
+
+    def _mark_down(self, worker, state):
+        if worker.down_since is None:
+            worker.down_since = time.monotonic()
+            print(f"Session {worker.index} is down ({state})")
+        worker.health = state
+        worker.ready = False
+
+    def _mark_up(self, worker):
+        if worker.down_since is not None:
+            recovery = time.monotonic() - worker.down_since
+            worker.last_recovery_seconds = recovery
+            worker.total_recovery_seconds += recovery
+            worker.recoveries += 1
+            worker.down_since = None
+            print(f"Session {worker.index} recovered after {recovery:.1f}s")
+        worker.ready = True
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def whatsapp_app(tmp_path_factory):
+    """
+    The app module, imported from a scratch working directory
+    app.py creates its tracking databases and folders under the working
+    directory and starts its writer threads when imported, so tests take
+    it from here rather than importing it, keeping the checkout clean.
+    """
+    workdir = tmp_path_factory.mktemp('app')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+        yield app
+        app.log_writer.close()
+        app.screenshot_store.close()
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,133 @@
+import threading
+import time
+
+from bot_pool import BotPool
+from campaign_jobs import CANCELLED, RUNNING, CampaignJob
+
+
+class FakeBot:
+    """A session whose sends succeed; the first send to a phone in hold waits for its event"""
+
+    def __init__(self, hold=None):
+        self.lock = threading.RLock()
+        self.hold = hold or {}
+        self.calls = []
+
+    def setup_driver(self):
+        return True
+
+    def send_message_result(self, phone, message, media=None):
+        with self.lock:
+            self.calls.append(phone)
+            event = self.hold.pop(phone, None)
+            if event:
+                event.wait(5)
+            return {"phone": phone, "status": "success"}
+
+    def close(self):
+        pass
+
+
+def make_pool(bots, stall_timeout=120):
+    pool = BotPool(lambda i: bots[i], size=len(bots), stall_timeout=stall_timeout)
+    pool.start()
+    return pool
+
+
+def release_after(event, seconds):
+    threading.Timer(seconds, event.set).start()
+
+
+def test_every_recipient_is_sent_once():
+    bots = [FakeBot(), FakeBot()]
+    results = list(make_pool(bots).dispatch(['1', '2', '3', '4', '1'], "Hi"))
+    assert sorted(result["phone"] for result in results) == ['1', '1', '2', '3', '4']
+    assert sorted(bots[0].calls + bots[1].calls) == ['1', '1', '2', '3', '4']
+
+
+def test_stalled_recipient_is_handed_to_another_session():
+    slow = threading.Event()
+    # Whichever session takes '1' first stalls on it
+    hold = {'1': slow}
+    bots = [FakeBot(hold=hold), FakeBot(hold=hold)]
+    pool = make_pool(bots, stall_timeout=0.2)
+    try:
+        results = list(pool.dispatch(['1', '2', '3'], "Hi"))
+    finally:
+        slow.set()
+    assert sorted(result["phone"] for result in results) == ['1', '2', '3']
+    assert pool.workers[0].reassigned + pool.workers[1].reassigned == 1
+    assert sorted(bots[0].calls + bots[1].calls) == ['1', '1', '2', '3']
+
+
+def test_late_success_of_a_stalled_send_stands():
+    slow = threading.Event()
+    bot = FakeBot(hold={'1': slow})
+    pool = make_pool([bot], stall_timeout=0.2)
+    release_after(slow, 0.8)
+    results = list(pool.dispatch(['1', '2'], "Hi"))
+    assert [result["phone"] for result in results] == ['1', '2']
+    assert pool.workers[0].reassigned == 1
+    # The hand-over was dropped rather than sending '1' a second time
+    assert bot.calls == ['1', '2']
+
+
+def test_waiting_for_the_session_lock_is_not_a_stall():
+    bot = FakeBot()
+    pool = make_pool([bot], stall_timeout=0.2)
+    holding = threading.Event()
+
+    def hold_session():
+        # Another dispatch's send keeps the session busy
+        with bot.lock:
+            holding.set()
+            time.sleep(0.8)
+
+    threading.Thread(target=hold_session).start()
+    holding.wait()
+    results = list(pool.dispatch(['1'], "Hi"))
+    assert [result["phone"] for result in results] == ['1']
+    assert pool.workers[0].reassigned == 0
+    assert not pool.workers[0].stalled and pool.workers[0].current is None
+
+
+class NoticeNothing:
+    """A SessionMonitor stand-in: sessions that are down are expected back"""
+
+    def session_lost(self, worker):
+        return False
+
+
+def test_cancel_stops_a_campaign_waiting_for_sessions():
+    bot = FakeBot()
+    pool = make_pool([bot])
+    pool.monitor = NoticeNothing()
+    send = bot.send_message_result
+
+    def send_then_go_down(phone, message, media=None):
+        # The session drops after its first send and never comes back
+        pool.workers[0].ready = False
+        return send(phone, message, media)
+
+    bot.send_message_result = send_then_go_down
+    job = CampaignJob(iter(['1', '2', '3']), "Hi", dispatch=pool.dispatch).start()
+    time.sleep(0.5)
+    assert job.state == RUNNING
+    job.cancel()
+    job.thread.join(5)
+    assert job.state == CANCELLED
+    assert bot.calls == ['1']
+
+
+def test_cancel_reports_the_send_in_progress():
+    slow = threading.Event()
+    bot = FakeBot(hold={'1': slow})
+    pool = make_pool([bot])
+    job = CampaignJob(iter(['1', '2', '3']), "Hi", dispatch=pool.dispatch).start()
+    time.sleep(0.3)
+    job.cancel()
+    release_after(slow, 0.3)
+    job.thread.join(5)
+    assert job.state == CANCELLED
+    assert bot.calls == ['1']
+    assert job.sent == 1
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from campaign_jobs import CANCELLED, COMPLETED, PAUSED, QUEUED, RUNNING, CampaignJob
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class Sender:
+    """send_func whose sends wait until the test lets them through; numbers starting with 0 fail"""
+
+    def __init__(self):
+        self.allowed = threading.Semaphore(0)
+        self.sent = []
+
+    def allow(self, count=1):
+        for _ in range(count):
+            self.allowed.release()
+
+    def __call__(self, phone, message):
+        self.allowed.acquire()
+        self.sent.append(phone)
+        return {"phone": phone, "status": 'failed' if phone.startswith('0') else 'success'}
+
+
+@pytest.fixture
+def sender():
+    sender = Sender()
+    yield sender
+    # Let any send still waiting finish
+    sender.allow(100)
+
+
+def test_status_counts_through_the_lifecycle(sender):
+    job = CampaignJob(iter(['1', '02', '3']), "Hi", send_func=sender, total=3)
+    assert job.status()["state"] == QUEUED
+    job.start()
+    wait_for(lambda: job.state == RUNNING)
+
+    sender.allow(2)
+    wait_for(lambda: job.sent + job.failed == 2)
+    status = job.status()
+    assert (status["state"], status["sent"], status["failed"], status["pending"]) == (RUNNING, 1, 1, 1)
+
+    sender.allow()
+    job.thread.join(5)
+    status = job.status()
+    assert (status["state"], status["sent"], status["failed"], status["pending"]) == (COMPLETED, 2, 1, 0)
+    assert [result["phone"] for result in status["recent_results"]] == ['1', '02', '3']
+
+
+def test_pause_holds_the_next_recipient_until_resume(sender):
+    job = CampaignJob(iter(['1', '2', '3']), "Hi", send_func=sender).start()
+    sender.allow()
+    wait_for(lambda: job.sent == 1)
+    assert job.pause()
+    assert job.state == PAUSED and not job.pause()
+    # The recipient already taken goes out; nothing after it while paused
+    sender.allow(5)
+    time.sleep(0.3)
+    assert sender.sent == ['1', '2']
+
+    assert job.resume()
+    job.thread.join(5)
+    assert job.state == COMPLETED and sender.sent == ['1', '2', '3']
+    assert job.paused_seconds >= 0.3
+
+
+def test_cancelling_a_paused_job_ends_it(sender):
+    job = CampaignJob(iter(['1', '2', '3']), "Hi", send_func=sender).start()
+    sender.allow()
+    wait_for(lambda: job.sent == 1)
+    job.pause()
+    sender.allow()
+    wait_for(lambda: job.sent == 2)
+
+    assert job.cancel()
+    job.thread.join(5)
+    assert job.state == CANCELLED
+    assert sender.sent == ['1', '2']
+    assert job.paused_at is None and job.finished_at is not None
+    # A finished job cannot be paused, resumed or cancelled
+    assert not job.pause() and not job.resume() and not job.cancel()
+
+
+def test_cancelling_a_queued_job_sends_nothing(sender):
+    job = CampaignJob(iter(['1', '2']), "Hi", send_func=sender)
+    job.cancel()
+    job.start().thread.join(5)
+    assert job.state == CANCELLED and sender.sent == []
+
+
+def test_results_since_pages_through_results():
+    job = CampaignJob(iter(['1', '2', '3']), "Hi",
+                      send_func=lambda phone, message: {"phone": phone, "status": 'success'}).start()
+    job.thread.join(5)
+    results, cursor, missed = job.results_since(0, limit=2)
+    assert [result["phone"] for result in results] == ['1', '2'] and (cursor, missed) == (2, 0)
+    results, cursor, missed = job.results_since(cursor)
+    assert [result["phone"] for result in results] == ['3'] and cursor == 3
@@ -0,0 +1,97 @@
+import pytest
+
+from campaign_jobs import CANCELLED, COMPLETED, FAILED
+from campaign_store import CampaignCheckpoint, CampaignStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CampaignStore(str(tmp_path / 'campaigns.db'))
+
+
+def test_numbers_repeated_within_a_run_are_sent_once(store):
+    checkpoint = CampaignCheckpoint(store, store.create("Hello"), batch_size=2)
+    assert list(checkpoint.pending(iter(['1', '2', '1', '3', '2', '1']))) == ['1', '2', '3']
+    assert checkpoint.skipped_duplicates == 3
+
+
+def temp_tables(store):
+    return store.conn.execute("SELECT name FROM sqlite_temp_master WHERE type = 'table'").fetchall()
+
+
+def test_run_table_lives_from_the_first_read_to_finish(store):
+    checkpoint = CampaignCheckpoint(store, store.create("Hello"))
+    # A job that never starts leaves nothing behind
+    assert temp_tables(store) == []
+    list(checkpoint.pending(iter(['1', '2'])))
+    assert len(temp_tables(store)) == 1
+    checkpoint.finish(COMPLETED)
+    assert temp_tables(store) == []
+
+
+def test_stream_read_after_finish_stops_without_claiming(store):
+    checkpoint = CampaignCheckpoint(store, store.create("Hello"), batch_size=1)
+    pending = checkpoint.pending(iter(['1', '2', '3']))
+    assert next(pending) == '1'
+    # Cancelled while the feeder was still reading the stream
+    checkpoint.finish(CANCELLED)
+    assert list(pending) == []
+    assert temp_tables(store) == []
+
+
+def test_upload_is_removed_once_everyone_was_sent(store, tmp_path):
+    upload = tmp_path / 'numbers.csv'
+    upload.write_text("phone\n1\n2\n")
+    checkpoint = CampaignCheckpoint(store, store.create("Hello", file_path=str(upload)))
+    for phone in checkpoint.pending(iter(['1', '2'])):
+        checkpoint.record({"phone": phone, "status": 'success'})
+    checkpoint.finish(COMPLETED)
+    assert not upload.exists()
+    assert store.counts(checkpoint.id) == {'success': 2}
+
+
+def test_upload_is_kept_for_resume_after_a_failure(store, tmp_path):
+    upload = tmp_path / 'numbers.csv'
+    upload.write_text("phone\n1\n2\n")
+    checkpoint = CampaignCheckpoint(store, store.create("Hello", file_path=str(upload)))
+    checkpoint.record({"phone": '1', "status": 'success'})
+    checkpoint.record({"phone": '2', "status": 'failed', "failure": 'timeout'})
+    checkpoint.finish(COMPLETED)
+    assert upload.exists()
+    assert store.get(checkpoint.id)["state"] == COMPLETED
+
+
+def test_numbers_already_sent_are_skipped_on_resume(store):
+    campaign = store.create("Hello")
+    first = CampaignCheckpoint(store, campaign)
+    assert list(first.pending(iter(['1', '2']))) == ['1', '2']
+    first.record({"phone": '1', "status": 'success'})
+    first.record({"phone": '2', "status": 'failed'})
+    first.finish(FAILED)
+
+    resumed = CampaignCheckpoint(store, store.get(campaign["id"]))
+    assert list(resumed.pending(iter(['1', '2']))) == ['2']
+    assert resumed.skipped_done == 1
+
+
+def test_personalized_messages_are_keyed_by_rendered_text(store):
+    first = CampaignCheckpoint(store, store.create("Your code is {code}"))
+    assert list(first.pending(iter([('1', "Your code is 111")]))) == [('1', "Your code is 111")]
+    first.record({"phone": '1', "status": 'success'})
+    first.finish(COMPLETED)
+
+    # Same template, new data: sent; same rendered text: skipped
+    later = CampaignCheckpoint(store, store.create("Your code is {code}"))
+    items = [('1', "Your code is 222"), ('2', "Your code is 111")]
+    assert list(later.pending(iter(items))) == items
+    again = CampaignCheckpoint(store, store.create("Your code is {code}"))
+    assert list(again.pending(iter([('1', "Your code is 111")]))) == []
+    assert again.skipped_done == 1
+
+
+def test_static_message_keys_match_the_campaign_digest(store):
+    first = CampaignCheckpoint(store, store.create("Hello"))
+    list(first.pending(iter([('1', "Hello")])))
+    first.record({"phone": '1', "status": 'success'})
+    second = CampaignCheckpoint(store, store.create("Hello"))
+    assert list(second.pending(iter(['1']))) == []
@@ -0,0 +1,27 @@
+import pytest
+
+from contact_store import ContactStore
+
+
+@pytest.fixture
+def client(whatsapp_app, tmp_path, monkeypatch):
+    upload = tmp_path / 'contacts.csv'
+    upload.write_text("phone,name\n9876543210,Asha\n9876543211,Ravi\n9876543212,Mina\n")
+    store = ContactStore(str(tmp_path / 'contacts.db'))
+    store.import_file(str(upload))
+    monkeypatch.setattr(whatsapp_app, 'contact_store', store)
+    return whatsapp_app.app.test_client()
+
+
+def test_contacts_are_paged_with_after(client):
+    first = client.get('/contacts?limit=2').get_json()
+    assert first["total"] == 3 and len(first["contacts"]) == 2
+    rest = client.get(f'/contacts?after={first["next_after"]}').get_json()
+    assert [contact["phone"] for contact in rest["contacts"]] == ['919876543212']
+
+
+@pytest.mark.parametrize('after', ['abc', '-5', '1.5', '99999999999999999999', '²'])
+def test_bad_after_is_a_400(client, after):
+    response = client.get('/contacts', query_string={"after": after})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
@@ -0,0 +1,68 @@
+import json
+import threading
+
+import pytest
+
+from campaign_jobs import CANCELLED, COMPLETED, PAUSED, QUEUED, RUNNING, CampaignJob, JobManager
+from test_campaign_jobs import Sender, wait_for
+
+
+@pytest.fixture
+def api(whatsapp_app, monkeypatch):
+    monkeypatch.setattr(whatsapp_app, 'job_manager', JobManager())
+    sender = Sender()
+    yield whatsapp_app.app.test_client(), whatsapp_app.job_manager, sender
+    sender.allow(100)
+
+
+def events(response):
+    """The data payloads of a Server-Sent Events response, read to its end"""
+    text = b''.join(response.response).decode('utf-8')
+    return [json.loads(line[len('data: '):]) for line in text.splitlines() if line.startswith('data: ')]
+
+
+def test_job_status_counts(api):
+    client, jobs, sender = api
+    job = jobs.submit(CampaignJob(iter(['1', '02', '3']), "Hi", send_func=sender, total=3))
+    sender.allow(2)
+    wait_for(lambda: job.sent + job.failed == 2)
+
+    status = client.get(f'/jobs/{job.id}').get_json()["job"]
+    assert (status["state"], status["sent"], status["failed"], status["pending"]) == (RUNNING, 1, 1, 1)
+    assert [listed["job_id"] for listed in client.get('/jobs').get_json()["jobs"]] == [job.id]
+    assert client.get('/jobs/unknown').status_code == 404
+
+
+def test_pause_resume_and_cancel_a_paused_job(api):
+    client, jobs, sender = api
+    job = jobs.submit(CampaignJob(iter(['1', '2', '3']), "Hi", send_func=sender))
+
+    reply = client.post(f'/jobs/{job.id}/pause').get_json()
+    assert reply["success"] and reply["job"]["state"] == PAUSED
+    assert client.post(f'/jobs/{job.id}/resume').get_json()["job"]["state"] in (QUEUED, RUNNING)
+    client.post(f'/jobs/{job.id}/pause')
+    sender.allow()
+    wait_for(lambda: job.sent == 1)
+
+    assert client.post(f'/jobs/{job.id}/cancel').get_json()["success"]
+    job.thread.join(5)
+    assert client.get(f'/jobs/{job.id}').get_json()["job"]["state"] == CANCELLED
+    assert sender.sent == ['1']
+    reply = client.post(f'/jobs/{job.id}/resume')
+    assert reply.get_json()["success"] is False
+    assert client.post(f'/jobs/{job.id}/restart').status_code == 400
+
+
+def test_event_stream_follows_the_job_to_its_end(api):
+    client, jobs, sender = api
+    job = jobs.submit(CampaignJob(iter(['1', '2']), "Hi", send_func=sender, total=2))
+    response = client.get(f'/jobs/{job.id}/events')
+    assert response.mimetype == 'text/event-stream'
+
+    # The stream is read on this thread (it needs the request context) while the sends go out
+    threading.Timer(0.2, sender.allow, (2,)).start()
+    received = events(response)
+
+    assert received[-1]["state"] == COMPLETED and received[-1]["sent"] == 2
+    sent_counts = [event["sent"] for event in received]
+    assert sent_counts == sorted(sent_counts) and len(received) >= 2
@@ -0,0 +1,78 @@
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import psutil
+import pytest
+from selenium.webdriver.chrome.options import Options
+
+from bot_pool import BotPool, PoolWorker
+from resource_usage import process_tree_memory
+
+# A process with a child that looks like a Chrome renderer
+TREE_SCRIPT = (
+    "import subprocess, sys, time\n"
+    "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)', '--type=renderer'])\n"
+    "print('ready', flush=True)\n"
+    "time.sleep(30)\n"
+)
+
+
+@pytest.fixture
+def process_tree():
+    root = subprocess.Popen([sys.executable, '-c', TREE_SCRIPT], stdout=subprocess.PIPE, text=True)
+    assert root.stdout.readline().strip() == 'ready'
+    yield root
+    for proc in psutil.Process(root.pid).children(recursive=True):
+        proc.kill()
+    root.kill()
+    root.wait()
+
+
+def lean_options(whatsapp_app, headless):
+    options = Options()
+    transport = whatsapp_app.SeleniumTransport('unused_profile')
+    transport._add_lean_options(options, headless)
+    return options
+
+
+def test_process_tree_memory_counts_descendants_and_renderers(process_tree):
+    memory = process_tree_memory(process_tree.pid)
+    assert memory["processes"] == 2
+    assert memory["renderers"] == 1
+    assert memory["rss_mb"] > 0
+
+
+def test_lean_options_shrink_the_browser(whatsapp_app):
+    options = lean_options(whatsapp_app, headless=False)
+    assert f'--window-size={whatsapp_app.LEAN_WINDOW_SIZE}' in options.arguments
+    assert f'--renderer-process-limit={whatsapp_app.LEAN_RENDERER_LIMIT}' in options.arguments
+    assert '--disable-extensions' in options.arguments
+    assert '--headless=new' not in options.arguments
+    prefs = options.experimental_options['prefs']
+    assert prefs['profile.managed_default_content_settings.images'] == 2
+
+
+def test_lean_mode_goes_headless_once_linked(whatsapp_app):
+    assert '--headless=new' in lean_options(whatsapp_app, headless=True).arguments
+
+
+def test_sessions_report_browser_memory(whatsapp_app, process_tree, tmp_path, monkeypatch):
+    transport = whatsapp_app.SeleniumTransport(str(tmp_path / 'profile'))
+    # The chromedriver process of a started session, as Selenium exposes it
+    transport.driver = SimpleNamespace(service=SimpleNamespace(process=process_tree))
+    bot = whatsapp_app.WhatsAppBot(profile_dir=str(tmp_path / 'profile'), transport=transport)
+    pool = BotPool(lambda index: bot)
+    pool.workers = [PoolWorker(0, bot)]
+    monkeypatch.setattr(whatsapp_app, 'bot_pool', pool)
+    monkeypatch.setattr(whatsapp_app, 'session_monitor', None)
+
+    reply = whatsapp_app.app.test_client().get('/sessions').get_json()
+    memory = reply["sessions"][0]["memory"]
+    assert (memory["processes"], memory["renderers"]) == (2, 1)
+    assert reply["memory_rss_mb"] == memory["rss_mb"] > 0
+
+
+def test_sessions_without_a_browser_report_no_memory(whatsapp_app, tmp_path):
+    bot = whatsapp_app.WhatsAppBot(transport=whatsapp_app.SeleniumTransport(str(tmp_path / 'profile')))
+    assert bot.memory_stats() is None
@@ -0,0 +1,94 @@
+import io
+import json
+
+import pytest
+
+from mcp_server import (
+    INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND, PARSE_ERROR, PROTOCOL_VERSIONS, MCPServer, ToolError
+)
+
+
+@pytest.fixture
+def server():
+    server = MCPServer('test', '1.0', instructions="Test tools")
+
+    @server.tool(description="Echo text back", properties={"text": {"type": "string"}}, required=['text'])
+    def echo(text):
+        if text == 'bad':
+            raise ToolError("bad text")
+        return {"text": text}
+
+    return server
+
+
+def call(server, method, params=None, request_id=1):
+    message = {"jsonrpc": '2.0', "id": request_id, "method": method}
+    if params is not None:
+        message["params"] = params
+    return json.loads(server.handle_json(json.dumps(message)))
+
+
+def test_initialize_negotiates_the_protocol_version(server):
+    result = call(server, 'initialize', {"protocolVersion": PROTOCOL_VERSIONS[-1]})["result"]
+    assert result["protocolVersion"] == PROTOCOL_VERSIONS[-1]
+    assert result["serverInfo"] == {"name": 'test', "version": '1.0'}
+    result = call(server, 'initialize', {"protocolVersion": '1999-01-01'})["result"]
+    assert result["protocolVersion"] == PROTOCOL_VERSIONS[0]
+
+
+def test_tools_are_listed_and_called(server):
+    tools = call(server, 'tools/list')["result"]["tools"]
+    assert [tool["name"] for tool in tools] == ['echo']
+    result = call(server, 'tools/call', {"name": 'echo', "arguments": {"text": 'hi'}})["result"]
+    assert result["isError"] is False
+    assert result["structuredContent"] == {"text": 'hi'}
+    assert json.loads(result["content"][0]["text"]) == {"text": 'hi'}
+
+
+def test_tool_errors_are_results_for_the_agent(server):
+    result = call(server, 'tools/call', {"name": 'echo', "arguments": {"text": 'bad'}})["result"]
+    assert result["isError"] is True
+    assert result["structuredContent"] == {"error": 'bad text'}
+    assert server.stats()["tool_errors"] == 1
+
+
+@pytest.mark.parametrize('params', [
+    {"name": 'missing'},
+    {"name": 'echo', "arguments": {}},
+    {"name": 'echo', "arguments": {"text": 'hi', "extra": 1}},
+    {"name": 'echo', "arguments": ['hi']},
+])
+def test_bad_tool_calls_are_invalid_params(server, params):
+    assert call(server, 'tools/call', params)["error"]["code"] == INVALID_PARAMS
+
+
+@pytest.mark.parametrize('params', [['echo'], 'echo', 5])
+def test_params_must_be_an_object(server, params):
+    reply = call(server, 'tools/call', params)
+    assert reply["id"] == 1
+    assert reply["error"]["code"] == INVALID_PARAMS
+
+
+def test_protocol_errors(server):
+    assert json.loads(server.handle_json('{not json'))["error"]["code"] == PARSE_ERROR
+    assert json.loads(server.handle_json('[]'))["error"]["code"] == INVALID_REQUEST
+    assert json.loads(server.handle_json('{"jsonrpc": "1.0", "id": 1, "method": "ping"}'))["error"]["code"] == \
+        INVALID_REQUEST
+    assert call(server, 'resources/list')["error"]["code"] == METHOD_NOT_FOUND
+
+
+def test_notifications_and_batches(server):
+    assert server.handle_json('{"jsonrpc": "2.0", "method": "notifications/initialized"}') is None
+    replies = json.loads(server.handle_json(json.dumps([
+        {"jsonrpc": '2.0', "id": 1, "method": 'ping'},
+        {"jsonrpc": '2.0', "method": 'notifications/initialized'},
+        {"jsonrpc": '2.0', "id": 2, "method": 'tools/list'},
+    ])))
+    assert [reply["id"] for reply in replies] == [1, 2]
+
+
+def test_serve_stdio(server):
+    stdin = io.StringIO('{"jsonrpc": "2.0", "id": 7, "method": "ping"}\n\n')
+    stdout = io.StringIO()
+    server.serve_stdio(stdin, stdout)
+    assert json.loads(stdout.getvalue()) == {"jsonrpc": '2.0', "id": 7, "result": {}}
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+from message_template import MessageTemplate
+
+
+@pytest.fixture
+def rows():
+    return pd.DataFrame({'Name': ['Asha', None, '  '], 'amount': [5.0, None, 7.0], 'group': ['VIP', 'A', 'B']})
+
+
+def test_placeholders_and_fallbacks(rows):
+    template = MessageTemplate('Hi {name|there}, you are in {group}')
+    assert template.field_names == ['name', 'group']
+    assert template.render(rows) == ['Hi Asha, you are in VIP', 'Hi there, you are in A', 'Hi there, you are in B']
+
+
+def test_whole_number_floats_print_without_decimals(rows):
+    assert MessageTemplate('Due: {amount|none}').render(rows) == ['Due: 5', 'Due: none', 'Due: 7']
+
+
+@pytest.mark.parametrize('text', [
+    'Offer {limited time}!',
+    '{"a": 1}',
+    '{name!r}',
+    'Total {amount:.2f}',
+    'Unbalanced { brace',
+    'Closing } only',
+    '{}',
+    '{1st}',
+])
+def test_braces_that_are_not_placeholders_are_sent_as_typed(rows, text):
+    template = MessageTemplate(text)
+    assert template.is_static
+    assert template.render(rows) == [text] * len(rows)
+
+
+def test_literal_braces_next_to_placeholders_are_kept(rows):
+    template = MessageTemplate('Hi {name}, pay {amount:.2f} {"ref": 1}')
+    assert template.field_names == ['name']
+    assert template.render(rows.head(1)) == ['Hi Asha, pay {amount:.2f} {"ref": 1}']
+
+
+def test_fallback_may_contain_format_characters(rows):
+    assert MessageTemplate('{name|a:b!c}').render(rows) == ['Asha', 'a:b!c', 'a:b!c']
+
+
+def test_missing_column_renders_fallback(rows):
+    template = MessageTemplate('Code {code|none}')
+    assert template.missing_fields(rows.columns) == ['code']
+    assert template.render(rows) == ['Code none'] * 3
+
+
+def test_repeated_and_distinct_values_render_alike():
+    n = 5000
+    repeated = pd.DataFrame({'name': ['Asha', 'Ravi', None, 'Meera'] * (n // 4), 'group': ['A', 'B'] * (n // 2)})
+    distinct = repeated.assign(name=[f"Customer {i}" for i in range(n)])
+    template = MessageTemplate('Hi {name|there} from {group}')
+    # The same template first sees repeating values, then a chunk where they stop repeating
+    for df in (repeated, distinct, repeated):
+        expected = [f"Hi {name or 'there'} from {group}" for name, group in zip(df['name'], df['group'])]
+        assert template.render(df) == expected
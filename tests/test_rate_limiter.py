@@ -0,0 +1,65 @@
+from rate_limiter import AdaptiveRateLimiter
+
+
+def report(limiter, outcomes, latency=1.0):
+    for success in outcomes:
+        limiter.report(success, latency)
+
+
+def test_consecutive_failures_back_off_at_once():
+    limiter = AdaptiveRateLimiter(rate_per_minute=30)
+    report(limiter, [False, False])
+    assert limiter.rate == 30
+    report(limiter, [False])
+    assert limiter.rate == 15 and limiter.backoffs == 1
+
+
+def test_failure_ratio_is_judged_after_min_samples():
+    limiter = AdaptiveRateLimiter(rate_per_minute=30, min_samples=5)
+    report(limiter, [True, False, True, False])
+    assert limiter.rate == 30
+    report(limiter, [True])
+    # 2 of 5 failed, over the 0.3 ratio
+    assert limiter.rate == 15
+
+
+def test_slow_sends_back_off_before_a_full_window():
+    limiter = AdaptiveRateLimiter(rate_per_minute=30, slow_seconds=15)
+    report(limiter, [True] * 5, latency=30)
+    assert limiter.rate == 15
+
+
+def test_backoff_stops_at_the_floor():
+    limiter = AdaptiveRateLimiter(rate_per_minute=30, min_fraction=0.1)
+    for _ in range(10):
+        report(limiter, [False] * 3)
+    assert limiter.rate == 3
+
+
+def test_rate_recovers_after_a_window_of_healthy_sends():
+    limiter = AdaptiveRateLimiter(rate_per_minute=30, window=20, recovery_step=0.1)
+    report(limiter, [False] * 3)
+    assert limiter.rate == 15
+    report(limiter, [True] * 19)
+    assert limiter.rate == 15
+    report(limiter, [True])
+    assert limiter.rate == 18 and limiter.recoveries == 1
+    for _ in range(10):
+        report(limiter, [True] * 20)
+    assert limiter.rate == 30
+
+
+def test_configure_resets_the_backoff():
+    limiter = AdaptiveRateLimiter(rate_per_minute=30)
+    report(limiter, [False] * 3)
+    limiter.configure(20)
+    assert limiter.rate == 20
+    report(limiter, [False] * 2)
+    assert limiter.rate == 20
+
+
+def test_acquire_paces_sends():
+    limiter = AdaptiveRateLimiter(rate_per_minute=60, burst=2)
+    assert limiter.acquire(timeout=0) and limiter.acquire(timeout=0)
+    # The bucket is empty: the next slot is a second away
+    assert not limiter.acquire(timeout=0.05)
@@ -0,0 +1,64 @@
+import threading
+
+from bot_pool import BotPool
+from campaign_jobs import COMPLETED, CampaignJob
+from retry_engine import TIMEOUT, RetryingDispatch
+
+
+class FlakySession:
+    """A session whose first send times out and takes the session down with it"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.calls = []
+        self.pool = None
+
+    def setup_driver(self):
+        return True
+
+    def send_message_result(self, phone, message, media=None):
+        self.calls.append(phone)
+        if len(self.calls) == 1:
+            self.pool.workers[0].ready = False
+            # The monitor brings the session back a little later
+            threading.Timer(0.5, setattr, (self.pool.workers[0], 'ready', True)).start()
+            return {"phone": phone, "status": "failed", "failure": TIMEOUT}
+        return {"phone": phone, "status": "success"}
+
+    def close(self):
+        pass
+
+
+class Monitor:
+    def session_lost(self, worker):
+        return False
+
+
+def test_retry_pass_waits_for_a_session_to_come_back():
+    bot = FlakySession()
+    pool = BotPool(lambda i: bot, size=1)
+    bot.pool = pool
+    pool.start()
+    pool.monitor = Monitor()
+    retrying = RetryingDispatch(pool.dispatch, base_delay=0.01, max_delay=0.01)
+    job = CampaignJob(iter(['1']), "Hi", dispatch=retrying).start()
+    job.thread.join(10)
+    assert job.state == COMPLETED
+    assert job.sent == 1 and job.failed == 0
+    assert bot.calls == ['1', '1']
+    assert retrying.recovered == 1
+
+
+def test_retries_give_up_after_max_attempts():
+    calls = []
+
+    def dispatch(recipients, message, gate=None):
+        for phone in recipients:
+            calls.append(phone)
+            yield {"phone": phone, "status": "failed", "failure": TIMEOUT}
+
+    retrying = RetryingDispatch(dispatch, max_attempts=3, base_delay=0.01, max_delay=0.01)
+    results = list(retrying(['1', '2'], "Hi"))
+    assert sorted(result["phone"] for result in results) == ['1', '2']
+    assert all(result["attempts"] == 3 for result in results)
+    assert calls.count('1') == 3 and retrying.exhausted == 2
@@ -0,0 +1,86 @@
+import pytest
+
+from bot_pool import BotPool
+from campaign_jobs import COMPLETED, CampaignJob
+from campaign_store import CampaignCheckpoint, CampaignStore
+from fake_whatsapp import FakeWhatsAppServer
+from retry_engine import INVALID_NUMBER, RetryingDispatch
+from send_transport import HttpTransport
+
+INVALID = '919000000001'
+
+
+def observations(histogram, *labels):
+    counts, _ = histogram.labels(*labels).snapshot()
+    return sum(counts)
+
+
+@pytest.fixture
+def fake_whatsapp():
+    server = FakeWhatsAppServer(latency_ms=5, invalid_numbers=[INVALID], seed=1).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def pool(whatsapp_app, fake_whatsapp, tmp_path):
+    pool = BotPool(
+        lambda index: whatsapp_app.WhatsAppBot(
+            profile_dir=str(tmp_path / f'profile_{index}'), transport=HttpTransport(fake_whatsapp.url)
+        ),
+        size=2
+    )
+    assert pool.start() == 2
+    yield pool
+    pool.close()
+
+
+def test_campaign_over_the_fake_server(pool, tmp_path):
+    store = CampaignStore(str(tmp_path / 'campaigns.db'))
+    campaign = store.create("Hello")
+    checkpoint = CampaignCheckpoint(store, campaign)
+    phones = [INVALID, '919000000002', '919000000003', '919000000002']
+    job = CampaignJob(
+        checkpoint.pending(iter(phones)), "Hello", checkpoint=checkpoint,
+        dispatch=RetryingDispatch(pool.dispatch, base_delay=0.01, max_delay=0.01)
+    ).start()
+    job.thread.join(30)
+
+    assert job.state == COMPLETED
+    assert (job.sent, job.failed, checkpoint.skipped_duplicates) == (2, 1, 1)
+    assert store.counts(campaign["id"]) == {'success': 2, 'invalid_number': 1}
+    assert sum(worker.sent for worker in pool.workers) == 2
+
+
+def test_each_stage_of_a_send_is_timed(whatsapp_app, pool):
+    stages = ('navigation', 'compose', 'click', 'confirm', 'log_write')
+    before = {stage: observations(whatsapp_app.send_stage_seconds, stage) for stage in stages}
+    sends = observations(whatsapp_app.send_seconds, 'success')
+
+    assert pool.primary.send_message_result('919000000004', "Hi")["status"] == 'success'
+    for stage in stages:
+        assert observations(whatsapp_app.send_stage_seconds, stage) == before[stage] + 1, stage
+    assert observations(whatsapp_app.send_seconds, 'success') == sends + 1
+
+
+def test_failed_send_is_counted_under_its_stage(whatsapp_app, pool):
+    failures = whatsapp_app.send_failures_total.labels(INVALID_NUMBER, 'compose')
+    before = failures.value
+    confirms = observations(whatsapp_app.send_stage_seconds, 'confirm')
+    screenshots = observations(whatsapp_app.send_stage_seconds, 'screenshot')
+
+    result = pool.primary.send_message_result(INVALID, "Hi")
+    assert (result["status"], result["failure"], result["stage"]) == ('failed', INVALID_NUMBER, 'compose')
+    assert failures.value == before + 1
+    # The send stopped at compose: nothing was clicked or confirmed, and the failure was captured
+    assert observations(whatsapp_app.send_stage_seconds, 'confirm') == confirms
+    assert observations(whatsapp_app.send_stage_seconds, 'screenshot') == screenshots + 1
+
+
+def test_stage_metrics_are_served_at_metrics(whatsapp_app, pool):
+    pool.primary.send_message_result(INVALID, "Hi")
+    response = whatsapp_app.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'whatsapp_send_stage_seconds_bucket{stage="compose",le="+Inf"}' in text
+    assert f'whatsapp_send_failures_total{{failure="{INVALID_NUMBER}",stage="compose"}}' in text
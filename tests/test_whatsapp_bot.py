@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from fake_whatsapp import FakeWhatsAppServer
+from retry_engine import TIMEOUT
+from send_transport import HttpTransport
+
+
+class ClickTransport(HttpTransport):
+    """HttpTransport whose click() takes click_seconds, or raises click_error"""
+
+    click_seconds = 0
+    click_error = None
+
+    def click(self):
+        time.sleep(self.click_seconds)
+        if self.click_error:
+            raise self.click_error
+        super().click()
+
+
+@pytest.fixture
+def transport():
+    server = FakeWhatsAppServer(latency_ms=5).start()
+    transport = ClickTransport(server.url)
+    assert transport.start()
+    yield transport
+    server.stop()
+
+
+@pytest.fixture
+def bot(whatsapp_app, transport, tmp_path):
+    return whatsapp_app.WhatsAppBot(profile_dir=str(tmp_path / 'profile'), transport=transport)
+
+
+def test_click_failure_is_recorded_under_click(whatsapp_app, bot, transport):
+    transport.click_error = RuntimeError("Send button went stale")
+    failures = whatsapp_app.send_failures_total.labels(TIMEOUT, 'click')
+    before = failures.value
+
+    result = bot.send_message_result('919000000010', "Hi")
+    assert (result["status"], result["stage"], result["failure"]) == ('failed', 'click', TIMEOUT)
+    assert failures.value == before + 1
+
+
+def test_confirmation_time_starts_after_the_click(bot, transport):
+    transport.click_seconds = 0.3
+    result = bot.send_message_result('919000000011', "Hi")
+    assert result["status"] == 'success'
+    # Only the wait for the acknowledgement counts, not the 300 ms click
+    assert result["confirmation_ms"] < 200
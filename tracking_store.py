@@ -0,0 +1,181 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+from openpyxl import Workbook
+
+# Columns of the message log, in export order
+# (screenshot is the id of the failure screenshot in the ScreenshotStore)
+LOG_COLUMNS = ['timestamp', 'phone', 'type', 'content', 'status', 'error_message', 'screenshot']
+
+# Filters accepted by query(), mapped to their SQL condition
+FILTERS = {
+    'phone': 'phone = ?',
+    'status': 'status = ?',
+    'type': 'type = ?',
+    'since': 'timestamp >= ?',
+    'until': 'timestamp <= ?'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    phone TEXT,
+    type TEXT,
+    content TEXT,
+    status TEXT,
+    error_message TEXT,
+    screenshot TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_phone ON messages (phone);
+CREATE INDEX IF NOT EXISTS idx_messages_status ON messages (status);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_type ON messages (type);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class TrackingStore:
+    """
+    Append-only message log backed by SQLite in WAL mode
+
+    Every append is a single INSERT inside its own transaction, so the cost
+    does not grow with the size of the log and a killed process can at worst
+    lose the record being written, never the existing ones.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = self._connect()
+        self.conn.executescript(SCHEMA)
+        # Logs created before failure screenshots were linked to their records
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(messages)')}
+        if 'screenshot' not in columns:
+            self.conn.execute('ALTER TABLE messages ADD COLUMN screenshot TEXT')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def append(self, record):
+        """Append a single log record (dict keyed by LOG_COLUMNS)"""
+        return self.append_many([record])
+
+    def append_many(self, records):
+        """Append several log records in one transaction"""
+        rows = [tuple(record.get(col, '') for col in LOG_COLUMNS) for record in records]
+        if not rows:
+            return 0
+        with self.lock:
+            self._insert(rows)
+        return len(rows)
+
+    def _insert(self, rows, meta=None):
+        # Caller must hold self.lock
+        self.conn.execute('BEGIN')
+        try:
+            self.conn.executemany(
+                f'INSERT INTO messages ({", ".join(LOG_COLUMNS)}) VALUES ({", ".join("?" * len(LOG_COLUMNS))})',
+                rows
+            )
+            if meta:
+                self.conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', meta.items())
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def query(self, filters=None, after_id=None, limit=100):
+        """
+        Return one page of log records matching the filters
+        Pages are keyed on the record id, so each page costs the same no matter
+        how deep into the log it is. Returns (records, next_cursor).
+        """
+        conditions = []
+        params = []
+        for key, value in (filters or {}).items():
+            if key not in FILTERS:
+                raise ValueError(f"Unknown filter: {key}")
+            if value is None or value == '':
+                continue
+            conditions.append(FILTERS[key])
+            params.append(value)
+        if after_id is not None:
+            conditions.append('id > ?')
+            params.append(int(after_id))
+
+        sql = f'SELECT id, {", ".join(LOG_COLUMNS)} FROM messages'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(int(limit))
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        records = [dict(zip(['id'] + LOG_COLUMNS, row)) for row in rows]
+        next_cursor = str(records[-1]['id']) if len(records) == limit else None
+        return records, next_cursor
+
+    def iter_rows(self, filters=None, batch_size=1000):
+        """Yield matching log records in insertion order, one page in memory at a time"""
+        cursor = None
+        while True:
+            records, cursor = self.query(filters, after_id=cursor, limit=batch_size)
+            yield from records
+            if cursor is None:
+                break
+
+    def export_excel(self, path):
+        """
+        Write the whole log to an Excel file on demand
+        Rows are streamed into a write-only workbook, then moved into place atomically
+        """
+        tmp_path = path + '.tmp'
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('messages')
+        ws.append(LOG_COLUMNS)
+        for record in self.iter_rows():
+            ws.append([record[col] for col in LOG_COLUMNS])
+        wb.save(tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def import_excel_once(self, path):
+        """
+        Import a legacy Excel log the first time the store is opened
+        Returns the number of imported rows
+        """
+        with self.lock:
+            done = self.conn.execute("SELECT value FROM meta WHERE key = 'legacy_import'").fetchone()
+        if done or not os.path.exists(path):
+            return 0
+
+        df = pd.read_excel(path, dtype=str).reindex(columns=LOG_COLUMNS)
+        df = df.where(df.notna(), '')
+        rows = list(df.itertuples(index=False, name=None))
+
+        # Rows and the import marker go in one transaction so a crash cannot import twice
+        with self.lock:
+            self._insert(rows, meta={'legacy_import': os.path.basename(path)})
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()